@@ -0,0 +1,106 @@
+MODULE rpi_abb_irc5_dipc
+
+    ! Receives and sends numeric arrays using the DIPC framing of
+    ! rpi_abb_irc5.RAPIDIpcChannel with encoding 't', batch disabled and
+    ! frame_size <= 80 so each frame fits in a RAPID string:
+    !
+    !   <id>,<index>,<count>,t:<shape>;v1,v2,...   (first frame)
+    !   <id>,<index>,<count>,t:vN,vN+1,...          (following frames)
+    !
+    ! The task must be configured with RMQ Type set to "Remote" so RWS
+    ! can post to its queue.
+    
+    LOCAL VAR num dipc_next_id:=0;
+    
+    PROC DipcReceiveNumArray(INOUT num data{*}, INOUT num count \num TimeOut)
+        VAR rmqmessage msg;
+        VAR string frame;
+        VAR string body;
+        VAR num nfrag:=1;
+        VAR num frag:=0;
+        VAR num p1;
+        VAR num p2;
+        VAR num p3;
+        VAR num p4;
+        VAR num start;
+        VAR num pc;
+        VAR num value;
+        VAR num wait_time:=WAIT_MAX;
+        VAR bool ok;
+        
+        IF Present(TimeOut) THEN
+            wait_time:=TimeOut;
+        ENDIF
+        
+        count:=0;
+        WHILE frag < nfrag DO
+            RMQReadWait msg \TimeOut:=wait_time;
+            RMQGetMsgData msg, frame;
+            
+            p1:=StrFind(frame, 1, ",");
+            p2:=StrFind(frame, p1+1, ",");
+            p3:=StrFind(frame, p2+1, ",");
+            p4:=StrFind(frame, p3+1, ":");
+            ok:=StrToVal(StrPart(frame, p2+1, p3-p2-1), nfrag);
+            body:=StrPart(frame, p4+1, StrLen(frame)-p4);
+            
+            IF frag = 0 THEN
+                ! Skip the shape, the caller knows the array layout
+                start:=StrFind(body, 1, ";");
+                body:=StrPart(body, start+1, StrLen(body)-start);
+            ENDIF
+            
+            start:=1;
+            WHILE start <= StrLen(body) DO
+                pc:=StrFind(body, start, ",");
+                ok:=StrToVal(StrPart(body, start, pc-start), value);
+                count:=count+1;
+                data{count}:=value;
+                start:=pc+1;
+            ENDWHILE
+            
+            frag:=frag+1;
+        ENDWHILE
+    ENDPROC
+    
+    PROC DipcSendNumArray(num data{*}, num count, string queue \num Decimals)
+        VAR rmqslot slot;
+        VAR string frames{100};
+        VAR string header;
+        VAR string cur;
+        VAR string v;
+        VAR num nframes:=0;
+        VAR num dec:=4;
+        
+        IF Present(Decimals) THEN
+            dec:=Decimals;
+        ENDIF
+        
+        RMQFindSlot slot, queue;
+        
+        ! Header is added once the frame count is known, reserve room for it
+        cur:=NumToStr(count, 0) + ";";
+        FOR i FROM 1 TO count DO
+            v:=NumToStr(data{i}, dec);
+            IF StrLen(cur) + StrLen(v) + 1 > 60 THEN
+                nframes:=nframes+1;
+                frames{nframes}:=cur;
+                cur:=v;
+            ELSEIF StrLen(cur) = 0 OR StrPart(cur, StrLen(cur), 1) = ";" THEN
+                cur:=cur + v;
+            ELSE
+                cur:=cur + "," + v;
+            ENDIF
+        ENDFOR
+        nframes:=nframes+1;
+        frames{nframes}:=cur;
+        
+        FOR i FROM 1 TO nframes DO
+            header:=NumToStr(dipc_next_id, 0) + "," + NumToStr(i-1, 0) + "," + NumToStr(nframes, 0) + ",t:";
+            RMQSendMessage slot, header + frames{i};
+        ENDFOR
+        
+        dipc_next_id:=(dipc_next_id + 1) MOD 100000;
+    ENDPROC
+    
+ENDMODULE
@@ -14,6 +14,14 @@ MODULE rpi_abb_irc5_rapid
     PERS num JointTrajectoryTime{100};
     PERS num CurrentJointTrajectoryCount:=0;    
     
+    ! Streaming mode (JointTrajectoryCount = -2000): JointTrajectory_0..9 and
+    ! JointTrajectoryTime form a ring of 100 points. Point i is in slot
+    ! i MOD 100. The producer writes points ahead of CurrentJointTrajectoryCount
+    ! and advances JointTrajectoryStreamWritten, up to
+    ! JointTrajectoryStreamTotal points.
+    PERS num JointTrajectoryStreamTotal:=0;
+    PERS num JointTrajectoryStreamWritten:=0;
+    
     VAR intnum joint_trajectory_count_intnum:=-1;
     VAR intnum joint_trajectory_time_intnum:=-1;
     VAR intnum joint_trajectory_0_intnum:=-1;
@@ -33,8 +41,6 @@ MODULE rpi_abb_irc5_rapid
     CONST egm_minmax egm_minmax_joint1:=[-0.5,0.5];
                 
     PROC main()
-        VAR num j;
-        VAR num k;
         VAR jointtarget target;
         VAR zonedata zone;
         VAR rmqslot rmq;        
@@ -65,6 +71,13 @@ MODULE rpi_abb_irc5_rapid
             ExitCycle;            
         ENDIF
         
+        IF JointTrajectoryCount = -2000 THEN
+            RunJointTrajectoryStream;
+            CurrentJointTrajectoryCount:=0;
+            JointTrajectoryCount:=0;
+            ExitCycle;
+        ENDIF
+        
         IF JointTrajectoryCount <= 0 THEN
             
             WaitUntil FALSE;
@@ -74,32 +87,7 @@ MODULE rpi_abb_irc5_rapid
         
         FOR i FROM 0 TO JointTrajectoryCount - 1 DO
             CurrentJointTrajectoryCount:=i+1;
-            j:=i DIV 10;
-            k:=(i MOD 10) + 1;
-            TEST j
-                CASE 0:
-                    target:=JointTrajectory_0{k};
-                CASE 1:
-                    target:=JointTrajectory_1{k};
-                CASE 2:
-                    target:=JointTrajectory_2{k};
-                CASE 3:
-                    target:=JointTrajectory_3{k};
-                CASE 4:
-                    target:=JointTrajectory_4{k};
-                CASE 5:
-                    target:=JointTrajectory_5{k};
-                CASE 6:
-                    target:=JointTrajectory_6{k};
-                CASE 7:
-                    target:=JointTrajectory_7{k};
-                CASE 8:
-                    target:=JointTrajectory_8{k};
-                CASE 9:
-                    target:=JointTrajectory_9{k};
-                DEFAULT:
-                    JointTrajectoryCount:=0;
-            ENDTEST
+            target:=GetJointTrajectoryPoint(i);
             
             IF i < JointTrajectoryCount-2 THEN
                 zone:= z100;
@@ -168,6 +156,67 @@ MODULE rpi_abb_irc5_rapid
                
     ENDPROC
     
+    LOCAL FUNC jointtarget GetJointTrajectoryPoint(num slot)
+        VAR jointtarget target;
+        VAR num j;
+        VAR num k;
+        
+        j:=slot DIV 10;
+        k:=(slot MOD 10) + 1;
+        TEST j
+            CASE 0:
+                target:=JointTrajectory_0{k};
+            CASE 1:
+                target:=JointTrajectory_1{k};
+            CASE 2:
+                target:=JointTrajectory_2{k};
+            CASE 3:
+                target:=JointTrajectory_3{k};
+            CASE 4:
+                target:=JointTrajectory_4{k};
+            CASE 5:
+                target:=JointTrajectory_5{k};
+            CASE 6:
+                target:=JointTrajectory_6{k};
+            CASE 7:
+                target:=JointTrajectory_7{k};
+            CASE 8:
+                target:=JointTrajectory_8{k};
+            CASE 9:
+                target:=JointTrajectory_9{k};
+            DEFAULT:
+                JointTrajectoryCount:=0;
+        ENDTEST
+        RETURN target;
+    ENDFUNC
+    
+    LOCAL PROC RunJointTrajectoryStream()
+        VAR num i:=0;
+        VAR num slot;
+        VAR num t;
+        VAR jointtarget target;
+        VAR zonedata zone;
+        
+        WHILE i < JointTrajectoryStreamTotal DO
+            ! Only stops at the point if the producer falls behind
+            WaitUntil JointTrajectoryStreamWritten > i \PollRate:=0.04;
+            slot:=i MOD 100;
+            target:=GetJointTrajectoryPoint(slot);
+            t:=JointTrajectoryTime{slot+1};
+            ! The slot has been copied and may now be overwritten
+            CurrentJointTrajectoryCount:=i+1;
+            
+            IF i < JointTrajectoryStreamTotal-2 THEN
+                zone:= z100;
+            ELSE
+                zone:= fine;
+            ENDIF
+            
+            MoveAbsJ target, v1000, \T:=t, zone, tool0;
+            i:=i+1;
+        ENDWHILE
+    ENDPROC
+    
     PROC ResetProgram()
         CurrentJointTrajectoryCount:=0;
         JointTrajectoryCount:=0;        
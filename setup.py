@@ -5,7 +5,7 @@ from catkin_pkg.python_setup import generate_distutils_setup
 
 # fetch values from package.xml
 setup_args = generate_distutils_setup(
-    packages=['rpi_abb_irc5'],
+    packages=['rpi_abb_irc5', 'rpi_abb_irc5.ros'],
     package_dir={'': 'src'})
 
 setup(**setup_args)
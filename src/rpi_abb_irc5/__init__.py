@@ -1,3 +1,10 @@
 from __future__ import absolute_import
 
 from .rpi_abb_irc5 import *
+from .rapid_event_log import *
+from .rapid_ipc import *
+from .rapid_sampler import *
+from .rapid_trajectory import *
+from .joint_trajectory import *
+from .egm_trajectory import *
+from .trajectory_analytics import *
@@ -0,0 +1,149 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from __future__ import absolute_import
+
+import threading
+import time
+import numpy as np
+from collections import namedtuple
+from .joint_trajectory import sample_joint_trajectory
+
+EGMTrajectoryState=namedtuple('EGMTrajectoryState', ['setpoint', 'time', 'duration', 'braking'])
+
+class EGMTrajectoryExecutor(object):
+    
+    # Turns joint trajectories into one setpoint per EGM message. update()
+    # is called from the EGM loop with the measured joint angles and
+    # returns the setpoint to send. A trajectory starts at the first
+    # update() after start(), so a goal starts within one EGM cycle, and
+    # its last point is held once it is reached. stop() brakes every joint
+    # from the current setpoint velocity at the acceleration limits, or
+    # holds the current setpoint when no limits are given. start() while a
+    # trajectory is running brakes the same way before the new trajectory
+    # begins, so a trajectory that starts at rest from stop_position()
+    # preempts the old one without a velocity step.
+    #
+    # Trajectories are (t, q) pairs or RetimedJointTrajectory, see
+    # sample_joint_trajectory.
+    
+    def __init__(self, acceleration_limits=None):
+        self.acceleration_limits=None if acceleration_limits is None \
+            else np.asarray(acceleration_limits, dtype=np.float64)
+        self._lock=threading.Lock()
+        self._traj=None
+        self._duration=None
+        self._t0=None
+        self._brake=None
+        self._last_time=None
+        self.setpoint=None
+        self.velocity=None
+    
+    @property
+    def active(self):
+        with self._lock:
+            return self._traj is not None or self._brake is not None
+    
+    def start(self, traj):
+        t=np.asarray(traj[0], dtype=np.float64)
+        with self._lock:
+            self._brake=self._moving()
+            self._traj=traj
+            self._duration=float(t[-1])
+            self._t0=None
+    
+    def stop_position(self):
+        with self._lock:
+            b=self._moving()
+            if b is None:
+                return None if self.setpoint is None else self.setpoint.copy()
+            t0, q0, v0=b
+            return q0 + v0*np.abs(v0) / (2*self.acceleration_limits)
+    
+    def _moving(self):
+        if self._brake is not None:
+            return self._brake
+        if self._traj is not None and self._t0 is not None and self.velocity is not None \
+                and self.acceleration_limits is not None:
+            return (None, self.setpoint.copy(), self.velocity.copy())
+        return None
+    
+    def stop(self):
+        with self._lock:
+            self._traj=None
+            self._duration=None
+            self._brake=None
+            if self.setpoint is not None and self.velocity is not None and self.acceleration_limits is not None:
+                self._brake=(None, self.setpoint.copy(), self.velocity.copy())
+    
+    def hold(self, setpoint):
+        with self._lock:
+            self._traj=None
+            self._duration=None
+            self._brake=None
+            self.setpoint=np.array(setpoint, dtype=np.float64)
+            self.velocity=np.zeros_like(self.setpoint)
+    
+    def update(self, actual, now=None):
+        if now is None:
+            now=time.time()
+        with self._lock:
+            if self.setpoint is None:
+                self.setpoint=np.array(actual, dtype=np.float64)
+                self.velocity=np.zeros_like(self.setpoint)
+            
+            traj_time=None
+            braking=False
+            if self._brake is not None:
+                t0, q0, v0=self._brake
+                if t0 is None:
+                    # q0 and v0 are the state at the last update, so the
+                    # braking curve continues from there without a pause
+                    t0=now if self._last_time is None else self._last_time
+                    self._brake=(t0, q0, v0)
+                a=self.acceleration_limits
+                t_stop=np.abs(v0) / a
+                tt=np.minimum(now - t0, t_stop)
+                setpoint=q0 + v0*tt - 0.5*np.sign(v0)*a*tt**2
+                braking=True
+                if now - t0 >= np.max(t_stop):
+                    self._brake=None
+            elif self._traj is not None:
+                if self._t0 is None:
+                    self._t0=now
+                traj_time=now - self._t0
+                setpoint=sample_joint_trajectory(self._traj, traj_time)[0]
+            else:
+                setpoint=self.setpoint
+            
+            if self._last_time is not None and now > self._last_time:
+                self.velocity=(setpoint - self.setpoint) / (now - self._last_time)
+            self._last_time=now
+            self.setpoint=setpoint
+            return EGMTrajectoryState(setpoint, traj_time, self._duration, braking)
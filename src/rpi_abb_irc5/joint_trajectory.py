@@ -0,0 +1,362 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from __future__ import absolute_import
+
+import heapq
+import numpy as np
+from collections import namedtuple
+
+# Joint trajectory preprocessing shared by the RAPID and EGM trajectory
+# drivers. Trajectories are a time vector t (N,) in seconds from start and
+# a position array q (N,M) in radians.
+
+SimplifiedJointTrajectory=namedtuple('SimplifiedJointTrajectory', ['t', 'q', 'indices', 'max_deviation'])
+
+def _segment_deviation(t, q, i, j):
+    
+    # Largest joint deviation of points i+1..j-1 from the line between
+    # points i and j, interpolated by time as MoveAbsJ does.
+    
+    if j - i < 2:
+        return 0.0, -1
+    dt=t[j] - t[i]
+    if dt > 0:
+        s=(t[i+1:j] - t[i]) / dt
+    else:
+        s=np.zeros((j - i - 1,))
+    line=q[i] + s[:,None]*(q[j] - q[i])
+    err=np.max(np.abs(q[i+1:j] - line), axis=1)
+    k=int(np.argmax(err))
+    return float(err[k]), i + 1 + k
+
+def simplify_joint_trajectory(t, q, tolerance, max_points=None):
+    
+    # Time-aware Ramer-Douglas-Peucker: drops the waypoints that lie within
+    # tolerance (radians, any joint) of the time interpolated line between
+    # the waypoints kept around them. Segments are split largest deviation
+    # first, so with max_points the result is the best trajectory of at
+    # most that many points and max_deviation may exceed tolerance. The
+    # first and last points are always kept.
+    
+    t=np.asarray(t, dtype=np.float64)
+    q=np.asarray(q, dtype=np.float64)
+    n=len(t)
+    if q.ndim != 2 or len(q) != n:
+        raise ValueError("t must be (N,) and q (N,M)")
+    if n <= 2:
+        return SimplifiedJointTrajectory(t, q, np.arange(n), 0.0)
+    if max_points is not None and max_points < 2:
+        raise ValueError("max_points must be at least 2")
+    
+    keep=[0, n-1]
+    err, k=_segment_deviation(t, q, 0, n-1)
+    heap=[(-err, 0, n-1, k)]
+    while heap:
+        err, i, j, k=heap[0]
+        if -err <= tolerance or (max_points is not None and len(keep) >= max_points):
+            break
+        heapq.heappop(heap)
+        keep.append(k)
+        for a, b in ((i, k), (k, j)):
+            e, m=_segment_deviation(t, q, a, b)
+            if m >= 0:
+                heapq.heappush(heap, (-e, a, b, m))
+    
+    max_deviation=-heap[0][0] if heap else 0.0
+    indices=np.sort(np.array(keep))
+    return SimplifiedJointTrajectory(t[indices], q[indices], indices, max_deviation)
+
+JointLimits=namedtuple('JointLimits', ['lower', 'upper', 'velocity', 'acceleration'])
+
+def _abb_joint_limits(lower_deg, upper_deg, velocity_deg, ramp=0.25):
+    
+    # Axis ranges and speeds are from the ABB product specifications. ABB
+    # does not publish axis accelerations, these assume full speed is
+    # reached in ramp seconds, which is conservative for all listed models.
+    
+    velocity=np.deg2rad(velocity_deg)
+    return JointLimits(np.deg2rad(lower_deg), np.deg2rad(upper_deg), velocity, velocity / ramp)
+
+# Limits by robot model, extend or replace entries for other models or
+# cells with tighter software limits
+ABB_JOINT_LIMITS={
+    'IRB120':  _abb_joint_limits([-165, -110, -110, -160, -120, -400], [165, 110, 70, 160, 120, 400], \
+                                 [250, 250, 250, 320, 320, 420]),
+    'IRB1200': _abb_joint_limits([-170, -100, -200, -270, -130, -400], [170, 130, 70, 270, 130, 400], \
+                                 [288, 240, 297, 400, 405, 600]),
+    'IRB1600': _abb_joint_limits([-180, -90, -245, -200, -115, -400], [180, 150, 65, 200, 115, 400], \
+                                 [150, 160, 170, 320, 400, 460]),
+    'IRB2600': _abb_joint_limits([-180, -95, -180, -400, -120, -400], [180, 155, 75, 400, 120, 400], \
+                                 [175, 175, 175, 360, 360, 500]),
+    'IRB4600': _abb_joint_limits([-180, -90, -180, -400, -125, -400], [180, 150, 75, 400, 120, 400], \
+                                 [175, 175, 175, 250, 250, 360]),
+    'IRB6640': _abb_joint_limits([-170, -65, -180, -300, -120, -360], [170, 85, 70, 300, 120, 360], \
+                                 [100, 90, 90, 170, 120, 190])
+}
+
+def get_joint_limits(model):
+    key=model.upper().replace(' ', '').replace('_', '').split('-')[0]
+    if key not in ABB_JOINT_LIMITS:
+        raise ValueError("Unknown robot model: " + model)
+    return ABB_JOINT_LIMITS[key]
+
+RetimedJointTrajectory=namedtuple('RetimedJointTrajectory', ['t', 'q', 'duration', 'original_duration', \
+                                                             'sdot', 'sdot_peak', 'sddot'])
+
+def retime_joint_trajectory(t, q, velocity_limits, acceleration_limits, velocity_scaling=1.0, acceleration_scaling=1.0):
+    
+    # Time-optimal parameterization of the piecewise linear joint path
+    # through the waypoints, as executed by successive MoveAbsJ. The path
+    # is parameterized by joint space arc length s; along each segment the
+    # joint accelerations are proportional to sddot and at each corner the
+    # change of direction is spread over the adjacent half segments, as the
+    # controller zones blend it, using half of the acceleration limit so
+    # path acceleration can overlap the turn. The maximum velocity curve is then limited
+    # by a backward and a forward acceleration pass, both computed as
+    # cumulative minimums over the whole path, and each segment gets the
+    # resulting trapezoidal speed profile. The trajectory starts and ends
+    # at rest. t is only used to report original_duration.
+    
+    t=np.asarray(t, dtype=np.float64)
+    q=np.asarray(q, dtype=np.float64)
+    n=len(q)
+    if q.ndim != 2 or len(t) != n or n == 0:
+        raise ValueError("t must be (N,) and q (N,M)")
+    vmax=np.asarray(velocity_limits, dtype=np.float64) * velocity_scaling
+    amax=np.asarray(acceleration_limits, dtype=np.float64) * acceleration_scaling
+    if vmax.shape != q.shape[1:] or amax.shape != q.shape[1:]:
+        raise ValueError("Joint limits must have one entry per joint")
+    if np.any(vmax <= 0) or np.any(amax <= 0):
+        raise ValueError("Joint limits must be positive")
+    
+    # Repeated waypoints are kept, but reached in zero time
+    d=np.diff(q, axis=0)
+    length=np.sqrt(np.sum(d**2, axis=1))
+    keep=np.concatenate(([True], length > 1e-12))
+    qk=q[keep]
+    m=len(qk)
+    if m < 2:
+        tz=np.zeros((n,))
+        return RetimedJointTrajectory(tz, q, 0.0, t[-1] - t[0], np.zeros((n,)), np.zeros((n-1,)), np.ones((n-1,)))
+    
+    d=np.diff(qk, axis=0)
+    L=np.sqrt(np.sum(d**2, axis=1))
+    c=np.abs(d / L[:,None])
+    with np.errstate(divide='ignore'):
+        xv=np.min((vmax / c)**2, axis=1)
+        alpha=np.min(amax / c, axis=1)
+        dc=np.abs(np.diff(d / L[:,None], axis=0))
+        h=0.5*(L[:-1] + L[1:])
+        xc=np.min(0.5*amax * h[:,None] / dc, axis=1)
+    
+    # Path speed squared limit at each waypoint, zero at both ends
+    X=np.zeros((m,))
+    X[1:-1]=np.minimum(np.minimum(xv[:-1], xv[1:]), xc)
+    
+    S=np.concatenate(([0.0], np.cumsum(2.0*L*alpha)))
+    K=np.minimum.accumulate((X + S)[::-1])[::-1] - S
+    x=np.minimum.accumulate(K - S) + S
+    x=np.clip(x, 0.0, None)
+    
+    xa=x[:-1]
+    xb=x[1:]
+    xp=np.minimum(xv, 0.5*(xa + xb) + alpha*L)
+    va=np.sqrt(xa)
+    vb=np.sqrt(xb)
+    vp=np.sqrt(xp)
+    d1=(xp - xa) / (2.0*alpha)
+    d2=(xp - xb) / (2.0*alpha)
+    cruise=np.clip(L - d1 - d2, 0.0, None)
+    T=(vp - va) / alpha + (vp - vb) / alpha + cruise / vp
+    
+    tk=np.concatenate(([0.0], np.cumsum(T)))
+    idx=np.cumsum(keep) - 1
+    t2=tk[idx]
+    
+    # Expand the per segment profile back onto all waypoints, repeated
+    # waypoints get empty segments
+    sdot=np.sqrt(x)[idx]
+    seg=np.flatnonzero(keep[1:])
+    sdot_peak=np.zeros((n-1,))
+    sddot=np.ones((n-1,))
+    sdot_peak[seg]=vp
+    sddot[seg]=alpha
+    return RetimedJointTrajectory(t2, q, float(tk[-1]), float(t[-1] - t[0]), sdot, sdot_peak, sddot)
+
+def sample_joint_trajectory(traj, times):
+    
+    # Joint positions of a trajectory at the given times, for streaming
+    # setpoints through EGM. RetimedJointTrajectory is sampled along its
+    # trapezoidal speed profiles, any other (t, q) pair is linearly
+    # interpolated in time between waypoints.
+    
+    times=np.atleast_1d(np.asarray(times, dtype=np.float64))
+    t=np.asarray(traj[0], dtype=np.float64)
+    q=np.asarray(traj[1], dtype=np.float64)
+    if len(t) == 1:
+        return np.repeat(q, len(times), axis=0)
+    times=np.clip(times, t[0], t[-1])
+    k=np.clip(np.searchsorted(t, times, side='right') - 1, 0, len(t) - 2)
+    tau=times - t[k]
+    d=q[k+1] - q[k]
+    T=t[k+1] - t[k]
+    
+    if not isinstance(traj, RetimedJointTrajectory):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f=np.where(T > 0, tau / T, 1.0)
+        return q[k] + f[:,None]*d
+    
+    L=np.sqrt(np.sum(d**2, axis=1))
+    va=traj.sdot[k]
+    vb=traj.sdot[k+1]
+    vp=traj.sdot_peak[k]
+    a=traj.sddot[k]
+    T1=(vp - va) / a
+    T3=(vp - vb) / a
+    T2=np.clip(T - T1 - T3, 0.0, None)
+    t_acc=np.minimum(tau, T1)
+    s=va*t_acc + 0.5*a*t_acc**2
+    t_cruise=np.clip(tau - T1, 0.0, T2)
+    s+=vp*t_cruise
+    t_dec=np.clip(tau - T1 - T2, 0.0, T3)
+    s+=vp*t_dec - 0.5*a*t_dec**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f=np.where(L > 0, np.clip(s / L, 0.0, 1.0), 1.0)
+    return q[k] + f[:,None]*d
+
+JointTrajectoryViolation=namedtuple('JointTrajectoryViolation', ['point', 'joint', 'kind', 'value', 'limit', 'name'])
+JointTrajectoryValidation=namedtuple('JointTrajectoryValidation', ['valid', 'q', 'violations', 'total'])
+
+# Violation kinds caused by the joint names or count rather than the motion
+JOINT_TRAJECTORY_JOINT_VIOLATIONS=frozenset(['joint_name', 'unexpected_joint_name', 'joint_names', 'joint_count'])
+
+def _violations(kind, mask, value, limit, point_offset=0):
+    
+    # One violation per True entry of an (N,M) mask, or of an (N,) mask
+    # for checks on whole points
+    
+    whole_point=mask.ndim == 1
+    if whole_point:
+        mask=mask[:,None]
+        value=value[:,None]
+    points, joints=np.nonzero(mask)
+    limit=np.broadcast_to(limit, mask.shape)
+    return [JointTrajectoryViolation(int(i) + point_offset, -1 if whole_point else int(j), kind, \
+                                     float(value[i,j]), float(limit[i,j]), None) for i, j in zip(points, joints)]
+
+def validate_joint_trajectory(t, q, limits=None, joint_names=None, expected_joint_names=None, \
+                              check_velocity=True, check_acceleration=True, max_violations=100):
+    
+    # Checks a whole trajectory before it is sent to the controller. Goal
+    # joint_names are mapped onto expected_joint_names and the returned q
+    # is in controller joint order. Each failed check is reported once per
+    # point and joint, at most max_violations in total. Velocities are per
+    # segment ending at point i, accelerations are between the two
+    # segments around point i.
+    # Any limits field may be None to skip that check. joint is the index
+    # in controller order, or in joint_names for unexpected_joint_name, and
+    # -1 for checks that apply to a whole point or trajectory. The joint
+    # name checks carry the name itself, total counts every violation.
+    
+    t=np.asarray(t, dtype=np.float64)
+    q=np.asarray(q, dtype=np.float64)
+    violations=[]
+    
+    if q.ndim != 2 or len(t) != len(q) or len(t) == 0:
+        return JointTrajectoryValidation(False, q, [JointTrajectoryViolation(-1, -1, 'shape', float(len(t)), float('nan'), None)], 1)
+    
+    if joint_names is not None and expected_joint_names is not None:
+        index=dict((n, i) for i, n in enumerate(joint_names))
+        if len(index) != len(joint_names) or len(joint_names) != q.shape[1]:
+            return JointTrajectoryValidation(False, q, [JointTrajectoryViolation(-1, -1, 'joint_names', \
+                                                        float(len(joint_names)), float(q.shape[1]), None)], 1)
+        missing=[(j, n) for j, n in enumerate(expected_joint_names) if n not in index]
+        extra=[(index[n], n) for n in joint_names if n not in expected_joint_names]
+        if missing or extra:
+            violations=[JointTrajectoryViolation(-1, j, 'joint_name', float('nan'), float('nan'), n) for j, n in missing] + \
+                       [JointTrajectoryViolation(-1, j, 'unexpected_joint_name', float('nan'), float('nan'), n) \
+                        for j, n in extra]
+            return JointTrajectoryValidation(False, q, violations[:max_violations], len(violations))
+        q=q[:,[index[n] for n in expected_joint_names]]
+    elif expected_joint_names is not None and q.shape[1] != len(expected_joint_names):
+        return JointTrajectoryValidation(False, q, [JointTrajectoryViolation(-1, -1, 'joint_count', \
+                                                    float(q.shape[1]), float(len(expected_joint_names)), None)], 1)
+    
+    if limits is not None:
+        for l in limits:
+            if l is not None and np.shape(l) != (q.shape[1],):
+                return JointTrajectoryValidation(False, q, [JointTrajectoryViolation(-1, -1, 'joint_count', \
+                                                            float(q.shape[1]), float(np.size(l)), None)], 1)
+    
+    bad_t=~np.isfinite(t)
+    bad_q=~np.isfinite(q)
+    if np.any(bad_t) or np.any(bad_q):
+        violations+=_violations('time_nan', bad_t, t, np.nan)
+        violations+=_violations('nan', bad_q, q, np.nan)
+        return JointTrajectoryValidation(False, q, violations[:max_violations], len(violations))
+    
+    dt=np.diff(t)
+    time_ok=t[0] >= 0 and np.all(dt >= 0)
+    violations+=_violations('time', np.concatenate(([t[0] < 0], dt < 0)), np.concatenate(([t[0]], dt)), 0.0)
+    
+    if limits is not None and limits.lower is not None:
+        violations+=_violations('lower', q < limits.lower, q, limits.lower)
+    if limits is not None and limits.upper is not None:
+        violations+=_violations('upper', q > limits.upper, q, limits.upper)
+    
+    if len(t) > 1 and limits is not None and check_velocity and limits.velocity is not None and time_ok:
+        dq=np.diff(q, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            v=np.where(dq == 0, 0.0, dq / dt[:,None])
+        violations+=_violations('velocity', np.abs(v) > limits.velocity, v, limits.velocity, 1)
+        if len(t) > 2 and check_acceleration and limits.acceleration is not None:
+            h=0.5*(dt[:-1] + dt[1:])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dv=np.diff(v, axis=0)
+                a=np.where(dv == 0, 0.0, dv / h[:,None])
+            violations+=_violations('acceleration', np.abs(a) > limits.acceleration, a, limits.acceleration, 1)
+    
+    return JointTrajectoryValidation(len(violations) == 0, q, violations[:max_violations], len(violations))
+
+def format_joint_trajectory_violations(violations, joint_names=None, max_lines=10, total=None):
+    if total is None:
+        total=len(violations)
+    lines=[]
+    for v in violations[:max_lines]:
+        joint=""
+        if v.name is not None:
+            joint=" joint " + v.name
+        elif v.joint >= 0:
+            joint=" joint " + (joint_names[v.joint] if joint_names is not None and v.joint < len(joint_names) else str(v.joint))
+        point=" point %d" % v.point if v.point >= 0 else ""
+        lines.append("%s%s%s: %g (limit %g)" % (v.kind, point, joint, v.value, v.limit))
+    if total > min(len(violations), max_lines):
+        lines.append("... %d more" % (total - min(len(violations), max_lines)))
+    return "\n".join(lines)
@@ -0,0 +1,307 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import re
+import numpy as np
+from collections import namedtuple
+
+# Parsers and serializers for RAPID literal values as returned by and sent
+# to the RWS symbol data resources. All parsing is a single linear pass;
+# numeric arrays of any rank go straight to NumPy.
+
+JointTarget=namedtuple('JointTarget', ['robax', 'extax'])
+RobTarget=namedtuple('RobTarget', ['trans','rot','robconf','extax'])
+RAPIDPose=namedtuple('RAPIDPose', ['trans', 'rot'])
+RAPIDLoadData=namedtuple('RAPIDLoadData', ['mass', 'cog', 'aom', 'ix', 'iy', 'iz'])
+RAPIDToolData=namedtuple('RAPIDToolData', ['robhold', 'tframe', 'tload'])
+RAPIDWobjData=namedtuple('RAPIDWobjData', ['robhold', 'ufprog', 'ufmec', 'uframe', 'oframe'])
+RAPIDSpeedData=namedtuple('RAPIDSpeedData', ['v_tcp', 'v_ori', 'v_leax', 'v_reax'])
+
+_TOKEN_RE=re.compile(r'\s*(?:(\[)|(\])|(,)|"((?:[^"\\]|""|\\.)*)"|([^,\[\]\s"]+))')
+
+def parse_rapid_value(val):
+    
+    # Generic parser: records and arrays become lists, num becomes float,
+    # bool becomes bool and string becomes str.
+    
+    stack=[[]]
+    pos=0
+    end=len(val.rstrip())
+    while pos < end:
+        m=_TOKEN_RE.match(val, pos)
+        if m is None:
+            raise ValueError("Invalid RAPID value at position %d: %s" % (pos, val[pos:pos+20]))
+        pos=m.end()
+        open_, close, comma, string, atom=m.groups()
+        if open_ is not None:
+            stack.append([])
+        elif close is not None:
+            if len(stack) < 2:
+                raise ValueError("Unbalanced ']' in RAPID value")
+            v=stack.pop()
+            stack[-1].append(v)
+        elif comma is not None:
+            pass
+        elif string is not None:
+            stack[-1].append(string.replace('""', '"').replace('\\\\', '\\'))
+        else:
+            stack[-1].append(_parse_atom(atom))
+    if len(stack) != 1 or len(stack[0]) != 1:
+        raise ValueError("Invalid RAPID value")
+    return stack[0][0]
+
+def _parse_atom(atom):
+    if atom == 'TRUE':
+        return True
+    if atom == 'FALSE':
+        return False
+    return float(atom)
+
+def parse_rapid_num_array(val, shape=None):
+    
+    # Numeric arrays of any rank. The shape is recovered from the
+    # separators between groups at each nesting depth, so no Python list
+    # is ever built.
+    
+    val=val.strip()
+    if ' ' in val:
+        val=val.replace(' ', '')
+    depth=len(val) - len(val.lstrip('['))
+    flat=np.fromstring(val.replace('[', '').replace(']', ''), sep=',')
+    if shape is None:
+        if depth <= 1:
+            return flat
+        counts=[val.count(']'*k + ',' + '['*k) + 1 for k in xrange(depth)]
+        counts[0]=len(flat)
+        shape=[counts[depth-1]] + [counts[k-1]//counts[k] for k in xrange(depth-1, 0, -1)]
+    if int(np.prod(shape)) != len(flat):
+        raise ValueError("RAPID array is not rectangular")
+    return flat.reshape(shape)
+
+def format_rapid_num_array(val, fmt='%.9g'):
+    a=np.asarray(val, dtype=np.float64)
+    if a.ndim == 0:
+        return fmt % a
+    template=fmt
+    for n in reversed(a.shape):
+        template='[' + ','.join([template]*n) + ']'
+    return template % tuple(a.ravel().tolist())
+
+def format_rapid_value(val, fmt='%.9g'):
+    if isinstance(val, bool) or isinstance(val, np.bool_):
+        return 'TRUE' if val else 'FALSE'
+    if isinstance(val, basestring):
+        return '"' + val.replace('\\', '\\\\').replace('"', '""') + '"'
+    if isinstance(val, np.ndarray) and val.dtype.kind in 'iuf':
+        return format_rapid_num_array(val, fmt)
+    if isinstance(val, (list, tuple, np.ndarray)):
+        return '[' + ','.join([format_rapid_value(v, fmt) for v in val]) + ']'
+    return fmt % val
+
+def _record(val, n):
+    v=parse_rapid_value(val) if isinstance(val, basestring) else val
+    if not isinstance(v, list) or len(v) != n:
+        raise ValueError("Expected RAPID record with %d components" % n)
+    return v
+
+def _num(v):
+    return np.array(v, dtype=np.float64)
+
+def _num_array(val):
+    if isinstance(val, basestring):
+        return parse_rapid_num_array(val)
+    return np.array(val, dtype=np.float64)
+
+def decode_jointtarget(val):
+    a=_num_array(val)
+    if a.shape != (2,6):
+        raise ValueError("Invalid RAPID jointtarget")
+    return JointTarget(np.deg2rad(a[0]), np.deg2rad(a[1]))
+
+def encode_jointtarget(val):
+    assert np.shape(val[0]) == (6,)
+    assert np.shape(val[1]) == (6,)
+    return format_rapid_num_array(np.rad2deg([val[0], val[1]]), '%.4f')
+
+def decode_jointtarget_array(val):
+    a=parse_rapid_num_array(val)
+    if a.size == 0:
+        return []
+    if a.shape[1:] != (2,6):
+        raise ValueError("Invalid RAPID jointtarget array")
+    a=np.deg2rad(a)
+    return [JointTarget(a[i,0], a[i,1]) for i in xrange(a.shape[0])]
+
+def encode_jointtarget_array(val):
+    if len(val) == 0:
+        return '[]'
+    a=np.array([[v[0], v[1]] for v in val], dtype=np.float64)
+    assert a.shape[1:] == (2,6)
+    return format_rapid_num_array(np.rad2deg(a), '%.4f')
+
+def encode_jointtarget_positions(robax, extax=None):
+    
+    # jointtarget array from (N,6) robot axes and optional (N,6) external
+    # axes in radians, without building JointTarget tuples
+    
+    robax=np.asarray(robax, dtype=np.float64)
+    if len(robax) == 0:
+        return '[]'
+    assert robax.ndim == 2 and robax.shape[1] == 6
+    a=np.zeros((len(robax), 2, 6))
+    a[:,0,:]=robax
+    if extax is not None:
+        a[:,1,:]=extax
+    return format_rapid_num_array(np.rad2deg(a), '%.4f')
+
+def decode_robtarget(val):
+    v=_record(val, 4)
+    return RobTarget(_num(v[0])/1000.0, _num(v[1]), _num(v[2]), np.deg2rad(_num(v[3])))
+
+def encode_robtarget(val):
+    return '[' + ','.join([format_rapid_num_array(np.multiply(val[0], 1000.0)), format_rapid_num_array(val[1]), \
+                           format_rapid_num_array(val[2], '%d'), format_rapid_num_array(np.rad2deg(val[3]))]) + ']'
+
+# tooldata, wobjdata, speeddata and their components keep RAPID units (mm, deg)
+
+def decode_pose(val):
+    v=_record(val, 2)
+    return RAPIDPose(_num(v[0]), _num(v[1]))
+
+def encode_pose(val):
+    return '[' + format_rapid_num_array(val[0]) + ',' + format_rapid_num_array(val[1]) + ']'
+
+def decode_loaddata(val):
+    v=_record(val, 6)
+    return RAPIDLoadData(float(v[0]), _num(v[1]), _num(v[2]), float(v[3]), float(v[4]), float(v[5]))
+
+def encode_loaddata(val):
+    return '[' + ','.join([format_rapid_value(float(val[0])), format_rapid_num_array(val[1]), \
+                           format_rapid_num_array(val[2])] + [format_rapid_value(float(x)) for x in val[3:6]]) + ']'
+
+def decode_tooldata(val):
+    v=_record(val, 3)
+    return RAPIDToolData(bool(v[0]), decode_pose(v[1]), decode_loaddata(v[2]))
+
+def encode_tooldata(val):
+    return '[' + ','.join([format_rapid_value(bool(val[0])), encode_pose(val[1]), encode_loaddata(val[2])]) + ']'
+
+def decode_wobjdata(val):
+    v=_record(val, 5)
+    return RAPIDWobjData(bool(v[0]), bool(v[1]), v[2], decode_pose(v[3]), decode_pose(v[4]))
+
+def encode_wobjdata(val):
+    return '[' + ','.join([format_rapid_value(bool(val[0])), format_rapid_value(bool(val[1])), \
+                           format_rapid_value(val[2]), encode_pose(val[3]), encode_pose(val[4])]) + ']'
+
+def decode_speeddata(val):
+    v=_record(val, 4)
+    return RAPIDSpeedData(*[float(x) for x in v])
+
+def encode_speeddata(val):
+    return format_rapid_num_array(val)
+
+def decode_num(val):
+    return float(val)
+
+def decode_bool(val):
+    if isinstance(val, bool):
+        return val
+    v=val.strip()
+    if v not in ('TRUE', 'FALSE'):
+        raise ValueError("Invalid RAPID bool")
+    return v == 'TRUE'
+
+def decode_string(val):
+    return parse_rapid_value(val)
+
+# Codecs by RAPID data type: (decode, encode). Arrays of num, dnum and bool
+# are handled separately through NumPy.
+RAPID_CODECS={
+    'num': (decode_num, format_rapid_value),
+    'dnum': (decode_num, lambda v: format_rapid_value(v, '%.17g')),
+    'bool': (decode_bool, format_rapid_value),
+    'string': (decode_string, format_rapid_value),
+    'jointtarget': (decode_jointtarget, encode_jointtarget),
+    'robtarget': (decode_robtarget, encode_robtarget),
+    'pose': (decode_pose, encode_pose),
+    'loaddata': (decode_loaddata, encode_loaddata),
+    'tooldata': (decode_tooldata, encode_tooldata),
+    'wobjdata': (decode_wobjdata, encode_wobjdata),
+    'speeddata': (decode_speeddata, encode_speeddata)
+    }
+
+def decode_rapid_value(val, datatype=None, dims=None):
+    if datatype is None:
+        return parse_rapid_value(val)
+    if dims is None or len(dims) == 0:
+        if datatype in RAPID_CODECS:
+            return RAPID_CODECS[datatype][0](val)
+        return parse_rapid_value(val)
+    if datatype in ('num', 'dnum'):
+        return parse_rapid_num_array(val, dims)
+    if datatype == 'bool':
+        return np.array(parse_rapid_value(val), dtype=np.bool_).reshape(dims)
+    if datatype == 'jointtarget' and len(dims) == 1:
+        return decode_jointtarget_array(val)
+    v=parse_rapid_value(val)
+    if datatype == 'string':
+        return v
+    if datatype in RAPID_CODECS:
+        decode=RAPID_CODECS[datatype][0]
+        return _map_nested(v, len(dims), decode)
+    return v
+
+def encode_rapid_value(val, datatype=None, dims=None):
+    if datatype is None:
+        return format_rapid_value(val)
+    if dims is None or len(dims) == 0:
+        if datatype in RAPID_CODECS:
+            return RAPID_CODECS[datatype][1](val)
+        return format_rapid_value(val)
+    if datatype == 'num':
+        return format_rapid_num_array(val)
+    if datatype == 'dnum':
+        return format_rapid_num_array(val, '%.17g')
+    if datatype == 'jointtarget' and len(dims) == 1:
+        return encode_jointtarget_array(val)
+    if datatype in RAPID_CODECS:
+        encode=RAPID_CODECS[datatype][1]
+        return _format_nested(val, len(dims), encode)
+    return format_rapid_value(val)
+
+def _map_nested(v, depth, f):
+    if depth == 0:
+        return f(v)
+    return [_map_nested(x, depth-1, f) for x in v]
+
+def _format_nested(v, depth, f):
+    if depth == 0:
+        return f(v)
+    return '[' + ','.join([_format_nested(x, depth-1, f) for x in v]) + ']'
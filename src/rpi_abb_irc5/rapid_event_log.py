@@ -0,0 +1,372 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from __future__ import absolute_import
+
+import threading
+import os
+import json
+import time
+import traceback
+import numpy as np
+from datetime import datetime
+from .rpi_abb_irc5 import RAPIDEventLogEntry
+
+class RAPIDEventLogReader(object):
+    
+    # Reads an elog domain incrementally. Only entries newer than
+    # last_seqnum are requested, walking RWS pages until already seen
+    # entries are reached, and entries are yielded oldest first as a
+    # generator. Pages are requested as the generator advances and always
+    # bypass the RWS cache, since a cached page would hide new entries or
+    # be offset from the pages after it. Subscription notifications fetch
+    # just the announced entries.
+    
+    def __init__(self, rapid, elog=0, page_size=50, last_seqnum=None):
+        self._rapid=rapid
+        self.elog=elog
+        self.page_size=page_size
+        self.last_seqnum=last_seqnum
+        self._lock=threading.Lock()
+        self._subscription=None
+    
+    def skip_existing(self):
+        for e in self._pages():
+            if e.seqnum is not None and (self.last_seqnum is None or e.seqnum > self.last_seqnum):
+                self.last_seqnum=e.seqnum
+    
+    def read_new(self):
+        for entries in self._new_pages():
+            for e in entries:
+                if self.last_seqnum is None or e.seqnum > self.last_seqnum:
+                    self.last_seqnum=e.seqnum
+                yield e
+    
+    def read_seqnums(self, seqnums):
+        for seqnum in sorted(seqnums):
+            if self.last_seqnum is not None and seqnum <= self.last_seqnum:
+                continue
+            e=self._rapid.read_event_log_entry(seqnum, self.elog)
+            self.last_seqnum=seqnum
+            yield e
+    
+    def subscribe(self, callback, closed_callback=None):
+        
+        # callback(entry) is called for each new entry. Notifications only
+        # carry seqnums; each announced entry costs one small request.
+        
+        def cb(seqnums):
+            with self._lock:
+                for e in self.read_seqnums(seqnums):
+                    callback(e)
+        
+        self._subscription=self._rapid.subscribe_event_log(cb, closed_callback, self.elog)
+        return self._subscription
+    
+    def _new_pages(self):
+        
+        # Oldest first pages are passed on as they arrive. Newest first
+        # pages are collected back to the last seen entry, as the oldest
+        # new entry is only known then. Entries shifted onto the next page
+        # by new arrivals are dropped by seqnum.
+        
+        last=self.last_seqnum
+        seen=set()
+        pending=[]
+        for entries in self._page_lists():
+            new=[]
+            for e in entries:
+                if e.seqnum is None or e.seqnum in seen or (last is not None and e.seqnum <= last):
+                    continue
+                seen.add(e.seqnum)
+                new.append(e)
+            if _ascending(entries):
+                yield new
+            else:
+                pending.extend(new)
+        pending.sort(key=lambda e: e.seqnum)
+        if len(pending) > 0:
+            yield pending
+    
+    def _pages(self):
+        for entries in self._page_lists():
+            for e in entries:
+                yield e
+    
+    def _page_lists(self):
+        start=0
+        while True:
+            with self._lock:
+                entries, has_next=self._rapid.read_event_log_page(self.elog, start, self.page_size, False)
+            yield entries
+            if not has_next or len(entries) == 0:
+                return
+            # Pages are newest first, stop once an already seen entry
+            # shows up unless the controller lists oldest first
+            if not _ascending(entries) and self.last_seqnum is not None \
+                and entries[-1].seqnum <= self.last_seqnum:
+                return
+            start+=len(entries)
+
+def _ascending(entries):
+    return len(entries) > 1 and entries[0].seqnum < entries[-1].seqnum
+
+# Fixed size index record, one per stored entry. The text of the entry is
+# stored as a JSON line in entries.jsonl at offset/length.
+RAPID_EVENT_LOG_INDEX_DTYPE=np.dtype([('domain', '<i4'), ('msgtype', '<i4'), ('code', '<i4'), ('length', '<i4'), \
+                                      ('seqnum', '<i8'), ('offset', '<i8'), ('tstamp', '<f8')])
+
+_EPOCH=datetime(1970,1,1)
+
+class RAPIDEventLogStore(object):
+    
+    # Append-only local store of event log entries from all elog domains.
+    # Entries are deduplicated by (domain, seqnum). The index file is
+    # memory mapped for scanning, and sorted views by code and time are
+    # built on demand for queries.
+    
+    def __init__(self, path):
+        self.path=path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._index_fname=os.path.join(path, 'index.bin')
+        self._entries_fname=os.path.join(path, 'entries.jsonl')
+        self._lock=threading.RLock()
+        
+        # Drop a partially written index record left by a crash
+        rec_size=RAPID_EVENT_LOG_INDEX_DTYPE.itemsize
+        if os.path.exists(self._index_fname):
+            size=os.path.getsize(self._index_fname)
+            if size % rec_size != 0:
+                with open(self._index_fname, 'r+b') as f:
+                    f.truncate(size - (size % rec_size))
+        
+        self._index_f=open(self._index_fname, 'ab')
+        self._entries_f=open(self._entries_fname, 'ab')
+        self._index=None
+        self._views={}
+        self._pending={}
+        
+        index=self.scan()
+        self._keys=np.unique(_keys(index['domain'], index['seqnum']))
+        self._max_seqnum={}
+        for d in np.unique(index['domain']):
+            self._max_seqnum[int(d)]=int(index['seqnum'][index['domain']==d].max())
+    
+    def __len__(self):
+        return os.path.getsize(self._index_fname) // RAPID_EVENT_LOG_INDEX_DTYPE.itemsize
+    
+    def close(self):
+        with self._lock:
+            self._index_f.close()
+            self._entries_f.close()
+            self._index=None
+    
+    def max_seqnum(self, domain):
+        with self._lock:
+            return self._max_seqnum.get(domain, None)
+    
+    def contains(self, domain, seqnum):
+        with self._lock:
+            k=int(_keys(domain, seqnum))
+            if k in self._pending:
+                return True
+            i=np.searchsorted(self._keys, k)
+            return i < len(self._keys) and self._keys[i] == k
+    
+    def append(self, domain, entries):
+        n=0
+        with self._lock:
+            for e in entries:
+                if e.seqnum is None or self.contains(domain, e.seqnum):
+                    continue
+                line=json.dumps({'msgtype': e.msgtype, 'code': e.code, 'tstamp': e.tstamp.isoformat(), \
+                                 'args': e.args, 'title': e.title, 'desc': e.desc, 'conseqs': e.conseqs, \
+                                 'causes': e.causes, 'actions': e.actions, 'seqnum': e.seqnum}) + '\n'
+                offset=self._entries_f.tell()
+                self._entries_f.write(line)
+                rec=np.zeros((1,), dtype=RAPID_EVENT_LOG_INDEX_DTYPE)
+                rec[0]=(domain, e.msgtype, e.code, len(line), e.seqnum, offset, (e.tstamp - _EPOCH).total_seconds())
+                self._pending[int(_keys(domain, e.seqnum))]=True
+                self._index_f.write(rec.tobytes())
+                if e.seqnum > self._max_seqnum.get(domain, -1):
+                    self._max_seqnum[domain]=e.seqnum
+                n+=1
+            if n > 0:
+                # Entries are flushed before the index that points to them
+                self._entries_f.flush()
+                self._index_f.flush()
+                self._index=None
+                self._views={}
+                if len(self._pending) > 10000:
+                    self._keys=np.union1d(self._keys, np.array(list(self._pending.keys()), dtype=np.int64))
+                    self._pending={}
+        return n
+    
+    def scan(self):
+        
+        # Memory mapped structured array of all index records, suitable for
+        # vectorized scans of millions of entries
+        
+        with self._lock:
+            if self._index is None:
+                if len(self) == 0:
+                    self._index=np.zeros((0,), dtype=RAPID_EVENT_LOG_INDEX_DTYPE)
+                else:
+                    self._index=np.memmap(self._index_fname, dtype=RAPID_EVENT_LOG_INDEX_DTYPE, mode='r')
+            return self._index
+    
+    def query_index(self, code=None, msgtype=None, domain=None, start=None, end=None):
+        with self._lock:
+            index=self.scan()
+            rows=None
+            if code is not None:
+                rows=self._range('code', code, code)
+            if start is not None or end is not None:
+                t0=-np.inf if start is None else _to_epoch(start)
+                t1=np.inf if end is None else _to_epoch(end)
+                r=self._range('tstamp', t0, t1)
+                rows=r if rows is None else np.intersect1d(rows, r, assume_unique=True)
+            if rows is None:
+                rows=np.arange(len(index))
+            else:
+                rows=np.sort(rows)
+            sel=index[rows]
+            mask=np.ones((len(sel),), dtype=np.bool_)
+            if msgtype is not None:
+                mask&=sel['msgtype'] == msgtype
+            if domain is not None:
+                mask&=sel['domain'] == domain
+            return rows[mask]
+    
+    def query(self, code=None, msgtype=None, domain=None, start=None, end=None, limit=None):
+        rows=self.query_index(code, msgtype, domain, start, end)
+        if limit is not None:
+            rows=rows[-limit:]
+        return self.read_rows(rows)
+    
+    def read_rows(self, rows):
+        o=[]
+        with self._lock:
+            index=self.scan()
+            with open(self._entries_fname, 'rb') as f:
+                for i in rows:
+                    rec=index[i]
+                    f.seek(int(rec['offset']))
+                    d=json.loads(f.read(int(rec['length'])))
+                    tstamp=datetime.strptime(d['tstamp'].split('.')[0], '%Y-%m-%dT%H:%M:%S')
+                    o.append((int(rec['domain']), RAPIDEventLogEntry(d['msgtype'], d['code'], tstamp, d['args'], d['title'], \
+                        d['desc'], d['conseqs'], d['causes'], d['actions'], d['seqnum'])))
+        return o
+    
+    def _range(self, field, lo, hi):
+        view=self._views.get(field, None)
+        if view is None:
+            col=self.scan()[field]
+            order=np.argsort(col, kind='mergesort')
+            view=(order, col[order])
+            self._views[field]=view
+        order, sorted_col=view
+        i0=np.searchsorted(sorted_col, lo, side='left')
+        i1=np.searchsorted(sorted_col, hi, side='right')
+        return order[i0:i1]
+
+def _keys(domain, seqnum):
+    return (np.asarray(domain, dtype=np.int64) << 40) | np.asarray(seqnum, dtype=np.int64)
+
+def _to_epoch(t):
+    if isinstance(t, datetime):
+        return (t - _EPOCH).total_seconds()
+    return float(t)
+
+class RAPIDEventLogIngestor(object):
+    
+    # Background thread keeping a RAPIDEventLogStore fed from the
+    # controller. Each domain is read incrementally from the last stored
+    # seqnum; event log subscriptions wake the thread early and period is
+    # the polling fallback.
+    
+    def __init__(self, rapid, store, domains=None, period=30.0, subscribe=True):
+        self._rapid=rapid
+        self.store=store
+        self.period=period
+        self._domains=domains
+        self._subscribe=subscribe
+        self._readers={}
+        self._subscriptions=[]
+        self._wake=threading.Event()
+        self._stop=threading.Event()
+        self._thread=None
+        self.ingested=0
+        self.errors=0
+        self.last_poll=None
+    
+    def start(self):
+        if self._domains is None:
+            self._domains=self._rapid.get_event_log_domains()
+        for d in self._domains:
+            self._readers[d]=RAPIDEventLogReader(self._rapid, d, last_seqnum=self.store.max_seqnum(d))
+            if self._subscribe:
+                try:
+                    self._subscriptions.append(self._rapid.subscribe_event_log(lambda seqnums: self._wake.set(), \
+                                                                               None, d))
+                except:
+                    traceback.print_exc()
+        self._thread=threading.Thread(target=self._run, name="rapid_event_log_ingest")
+        self._thread.daemon=True
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for s in self._subscriptions:
+            try:
+                s.close()
+            except:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+    
+    def poll(self):
+        n=0
+        for d, reader in self._readers.items():
+            n+=self.store.append(d, reader.read_new())
+        self.ingested+=n
+        self.last_poll=time.time()
+        return n
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except:
+                self.errors+=1
+                traceback.print_exc()
+            self._wake.wait(self.period)
+            self._wake.clear()
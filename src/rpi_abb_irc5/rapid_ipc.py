@@ -0,0 +1,287 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import threading
+import time
+import traceback
+import base64
+import Queue
+import numpy as np
+from collections import namedtuple
+
+# Framing for DIPC messages. Every frame is text of the form
+#
+#   <id>,<index>,<count>,<encoding>:<payload>
+#
+# and a logical message is split into count frames sharing the same id.
+# Encodings:
+#   s  string, split anywhere
+#   t  numeric array as text, "<shape>;v1,v2,..." split only between
+#      numbers so RAPID can parse each frame with StrToVal
+#      (see rapid/rpi_abb_irc5_dipc.mod)
+#   b  numeric array as base64 of the raw little endian data,
+#      "<dtype>;<shape>;<base64>", for peers other than RAPID
+# With batch enabled several frames are sent in one DIPC message,
+# separated by newlines, up to max_msg_size.
+
+RAPIDIpcChannelStats=namedtuple('RAPIDIpcChannelStats', ['messages_sent', 'frames_sent', 'posts', 'bytes_sent', \
+                                                         'messages_received', 'frames_received', 'reads', \
+                                                         'bytes_received', 'incomplete_dropped', 'frames_invalid', \
+                                                         'reader_errors'])
+
+class RAPIDIpcChannel(object):
+    
+    def __init__(self, rapid, target_queue, queue_name="rpi_abb_irc5", frame_size=80, max_msg_size=444, \
+                 batch=False, encoding='t', fmt='%.7g', reassembly_timeout=10.0):
+        self._rapid=rapid
+        self.target_queue=target_queue
+        self.queue_name=queue_name
+        self.frame_size=frame_size
+        self.max_msg_size=max_msg_size
+        self.batch=batch
+        self.encoding=encoding
+        self.fmt=fmt
+        self.reassembly_timeout=reassembly_timeout
+        self._next_id=0
+        self._send_lock=threading.Lock()
+        self._recv_lock=threading.Lock()
+        self._partial={}
+        self._reader=None
+        self._reader_stop=threading.Event()
+        self._received=Queue.Queue()
+        self.messages_sent=0
+        self.frames_sent=0
+        self.posts=0
+        self.bytes_sent=0
+        self.messages_received=0
+        self.frames_received=0
+        self.reads=0
+        self.bytes_received=0
+        self.incomplete_dropped=0
+        self.frames_invalid=0
+        self.reader_errors=0
+    
+    def open(self, queue_size=4440):
+        return self._rapid.try_create_ipc_queue(self.queue_name, queue_size, self.max_msg_size)
+    
+    def get_stats(self):
+        return RAPIDIpcChannelStats(self.messages_sent, self.frames_sent, self.posts, self.bytes_sent, \
+                                    self.messages_received, self.frames_received, self.reads, \
+                                    self.bytes_received, self.incomplete_dropped, self.frames_invalid, \
+                                    self.reader_errors)
+    
+    def send(self, data, encoding=None):
+        self.send_many([data], encoding)
+    
+    def send_many(self, messages, encoding=None):
+        with self._send_lock:
+            frames=[]
+            for data in messages:
+                frames.extend(self._encode(data, encoding))
+                self.messages_sent+=1
+            for m in self._pack(frames):
+                self._rapid.send_ipc_message(self.target_queue, m, self.queue_name)
+                self.posts+=1
+                self.bytes_sent+=len(m)
+            self.frames_sent+=len(frames)
+    
+    def receive(self, timeout=0):
+        msgs=self._rapid.read_ipc_message(self.queue_name, timeout)
+        with self._recv_lock:
+            self.reads+=1
+            o=[]
+            for m in msgs:
+                self.bytes_received+=len(m.data)
+                for frame in m.data.split('\n'):
+                    if len(frame) == 0:
+                        continue
+                    # A malformed frame is counted and skipped so the rest
+                    # of the read, already taken off the queue, is kept
+                    try:
+                        d=self._add_frame(frame)
+                    except Exception:
+                        self.frames_invalid+=1
+                        continue
+                    if d is not None:
+                        o.append(d)
+            self._expire_partial()
+            return o
+    
+    def start_reader(self, poll_timeout=1):
+        
+        # Keeps one long-poll read outstanding at all times on a background
+        # thread, so reading overlaps with processing of received messages
+        
+        if self._reader is not None:
+            return
+        self._reader_stop.clear()
+        def run():
+            while not self._reader_stop.is_set():
+                try:
+                    for d in self.receive(poll_timeout):
+                        self._received.put(d)
+                except:
+                    self.reader_errors+=1
+                    traceback.print_exc()
+                    if self._reader_stop.wait(poll_timeout):
+                        return
+        self._reader=threading.Thread(target=run, name="rapid_ipc_reader")
+        self._reader.daemon=True
+        self._reader.start()
+    
+    def stop_reader(self):
+        self._reader_stop.set()
+        if self._reader is not None:
+            self._reader.join()
+            self._reader=None
+    
+    def get(self, timeout=None):
+        try:
+            return self._received.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+    
+    def _encode(self, data, encoding):
+        msg_id=self._next_id
+        self._next_id=(self._next_id + 1) % 100000
+        
+        if isinstance(data, basestring):
+            if self.batch and '\n' in data:
+                raise ValueError("Batched DIPC strings must not contain newlines")
+            enc='s'
+            chunks=self._split_text(data, self._capacity(msg_id, 's'))
+        else:
+            enc=encoding or self.encoding
+            a=np.asarray(data)
+            shape='x'.join([str(n) for n in a.shape])
+            if enc == 'b':
+                a=np.ascontiguousarray(a, dtype=a.dtype.newbyteorder('<'))
+                body=a.dtype.str + ';' + shape + ';' + base64.b64encode(a.tobytes())
+                chunks=self._split_text(body, self._capacity(msg_id, 'b'))
+            elif enc == 't':
+                values=(self.fmt + ',')*a.size % tuple(a.ravel().tolist())
+                chunks=self._split_numbers(shape + ';', values.split(',')[:-1], self._capacity(msg_id, 't'))
+            else:
+                raise ValueError("Invalid DIPC encoding: " + enc)
+        
+        n=len(chunks)
+        return ["%d,%d,%d,%s:%s" % (msg_id, i, n, enc, c) for i, c in enumerate(chunks)]
+    
+    def _capacity(self, msg_id, enc):
+        # Worst case header length, index and count are at most 5 digits
+        header=len("%d,%d,%d,%s:" % (msg_id, 99999, 99999, enc))
+        cap=self.frame_size - header
+        if cap <= 0:
+            raise ValueError("frame_size too small for DIPC header")
+        return cap
+    
+    def _split_text(self, s, cap):
+        if len(s) == 0:
+            return ['']
+        return [s[i:i+cap] for i in xrange(0, len(s), cap)]
+    
+    def _split_numbers(self, prefix, values, cap):
+        chunks=[]
+        cur=prefix
+        sep=''
+        for v in values:
+            if len(prefix) + len(v) > cap:
+                raise ValueError("frame_size too small for numeric value")
+            if len(cur) + len(sep) + len(v) > cap:
+                chunks.append(cur)
+                cur=''
+                sep=''
+            cur+=sep + v
+            sep=','
+        chunks.append(cur)
+        return chunks
+    
+    def _pack(self, frames):
+        if not self.batch:
+            return frames
+        o=[]
+        cur=None
+        for f in frames:
+            if cur is not None and len(cur) + 1 + len(f) <= self.max_msg_size:
+                cur+='\n' + f
+            else:
+                if cur is not None:
+                    o.append(cur)
+                cur=f
+        if cur is not None:
+            o.append(cur)
+        return o
+    
+    def _add_frame(self, frame):
+        header, payload=frame.split(':', 1)
+        msg_id, index, count, enc=header.split(',')
+        index=int(index)
+        count=int(count)
+        self.frames_received+=1
+        if count == 1:
+            return self._decode(enc, [payload])
+        
+        key=(msg_id, count, enc)
+        p=self._partial.get(key, None)
+        if p is None:
+            p=[time.time(), {}]
+            self._partial[key]=p
+        p[1][index]=payload
+        if len(p[1]) < count:
+            return None
+        del self._partial[key]
+        return self._decode(enc, [p[1][i] for i in xrange(count)])
+    
+    def _decode(self, enc, parts):
+        if enc == 's':
+            d=''.join(parts)
+        elif enc == 'b':
+            dtype, shape, body=''.join(parts).split(';', 2)
+            a=np.frombuffer(base64.b64decode(body), dtype=np.dtype(dtype))
+            d=a.reshape(_parse_shape(shape))
+        elif enc == 't':
+            shape, first=parts[0].split(';', 1)
+            body=','.join([x for x in [first] + parts[1:] if len(x) > 0])
+            a=np.fromstring(body, sep=',') if len(body) > 0 else np.zeros((0,))
+            d=a.reshape(_parse_shape(shape))
+        else:
+            raise ValueError("Invalid DIPC encoding: " + enc)
+        self.messages_received+=1
+        return d
+    
+    def _expire_partial(self):
+        now=time.time()
+        for key in [k for k, p in self._partial.items() if now - p[0] > self.reassembly_timeout]:
+            del self._partial[key]
+            self.incomplete_dropped+=1
+
+def _parse_shape(shape):
+    if len(shape) == 0:
+        return ()
+    return tuple([int(n) for n in shape.split('x')])
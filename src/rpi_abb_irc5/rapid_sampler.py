@@ -0,0 +1,176 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from __future__ import absolute_import
+
+import threading
+import time
+import traceback
+import requests
+from collections import namedtuple
+from .rpi_abb_irc5 import parse_jointtarget_xhtml, parse_robtarget_xhtml
+
+RAPIDJointStateSample=namedtuple('RAPIDJointStateSample', ['mechunit', 'jointtarget', 'robtarget', 'stamp', 'rtt'])
+RAPIDSamplerStats=namedtuple('RAPIDSamplerStats', ['samples', 'dropped', 'errors', 'rate', 'period', 'rtt', 'rtt_max', \
+                                                   'age', 'age_max', 'last_error'])
+
+class RAPIDJointStateSampler(object):
+    
+    # Samples a mechunit jointtarget (and optionally robtarget) as fast as
+    # the controller sustains. pipeline workers each keep their own
+    # keep-alive connection sharing the RAPID session cookies and take
+    # staggered time slots, so the next request is in flight while the
+    # previous response is parsed and delivered. The period adapts to the
+    # measured round-trip: rate = pipeline/rtt*headroom, clamped to
+    # [min_rate, max_rate], and halves on errors. Samples are stamped with
+    # the midpoint of the request, and delivered in order; a sample that
+    # arrives after a newer one is dropped.
+    
+    def __init__(self, rapid, callback, mechunit='ROB_1', robtarget=False, max_rate=50.0, min_rate=1.0, pipeline=2, \
+                 headroom=0.8, tool='tool0', wobj='wobj0', coordinate='Base', error_callback=None):
+        self._rapid=rapid
+        self._callback=callback
+        self._error_callback=error_callback
+        self.mechunit=mechunit
+        self.robtarget=robtarget
+        self.max_rate=max_rate
+        self.min_rate=min_rate
+        self.pipeline=pipeline
+        self.headroom=headroom
+        self._jointtarget_url="rw/motionsystem/mechunits/" + mechunit + "/jointtarget"
+        self._robtarget_url="rw/motionsystem/mechunits/" + mechunit + "/robtarget?tool=%s&wobj=%s&coordinate=%s" \
+            % (tool, wobj, coordinate)
+        self._lock=threading.Lock()
+        self._deliver_lock=threading.Lock()
+        self._stop_event=threading.Event()
+        self._threads=[]
+        self.period=1.0/max_rate
+        self._next_slot=0.0
+        self._last_stamp=0.0
+        self._rtt=None
+        self.samples=0
+        self.dropped=0
+        self.errors=0
+        self.rtt_max=0.0
+        self._age=None
+        self.age_max=0.0
+        self.last_error=None
+        self._rate_t=None
+        self._rate_n=0
+        self.rate=0.0
+    
+    def start(self):
+        self._stop_event.clear()
+        self._next_slot=time.time()
+        for i in xrange(self.pipeline):
+            t=threading.Thread(target=self._run, name="rapid_joint_state_sampler_%d" % i)
+            t.daemon=True
+            t.start()
+            self._threads.append(t)
+    
+    def stop(self):
+        self._stop_event.set()
+        for t in self._threads:
+            t.join()
+        self._threads=[]
+    
+    def get_stats(self):
+        with self._lock:
+            return RAPIDSamplerStats(self.samples, self.dropped, self.errors, self.rate, self.period, self._rtt, \
+                                     self.rtt_max, self._age, self.age_max, self.last_error)
+    
+    def _run(self):
+        session=requests.Session()
+        session.cookies=self._rapid._session.cookies
+        try:
+            while not self._stop_event.is_set():
+                with self._lock:
+                    slot=max(self._next_slot, time.time())
+                    self._next_slot=slot + self.period
+                if self._stop_event.wait(max(slot - time.time(), 0)):
+                    break
+                try:
+                    self._sample(session)
+                except Exception as e:
+                    self._error(e)
+        finally:
+            session.close()
+    
+    def _sample(self, session):
+        t1=time.time()
+        jt=self._rapid._do_get_text(self._jointtarget_url, session, parse_jointtarget_xhtml)
+        t2=time.time()
+        rt=None
+        if self.robtarget:
+            rt=self._rapid._do_get_text(self._robtarget_url, session, parse_robtarget_xhtml)
+        stamp=0.5*(t1 + t2)
+        rtt=t2 - t1
+        
+        with self._lock:
+            self._rtt=rtt if self._rtt is None else 0.8*self._rtt + 0.2*rtt
+            self.rtt_max=max(self.rtt_max, rtt)
+            rate=min(self.max_rate, max(self.min_rate, self.pipeline*self.headroom/self._rtt))
+            if self.robtarget:
+                rate=max(self.min_rate, rate/2)
+            self.period=1.0/rate
+        
+        with self._deliver_lock:
+            if stamp <= self._last_stamp:
+                with self._lock:
+                    self.dropped+=1
+                return
+            self._last_stamp=stamp
+            self._callback(RAPIDJointStateSample(self.mechunit, jt, rt, stamp, rtt))
+            now=time.time()
+            with self._lock:
+                age=now - stamp
+                self._age=age if self._age is None else 0.8*self._age + 0.2*age
+                self.age_max=max(self.age_max, age)
+                self.samples+=1
+                self._update_rate(now)
+    
+    def _update_rate(self, now):
+        if self._rate_t is None:
+            self._rate_t=now
+        self._rate_n+=1
+        if now - self._rate_t >= 1.0:
+            self.rate=self._rate_n/(now - self._rate_t)
+            self._rate_t=now
+            self._rate_n=0
+    
+    def _error(self, e):
+        with self._lock:
+            self.errors+=1
+            self.last_error=str(e)
+            self.period=min(self.period*2, 1.0/self.min_rate)
+        if self._error_callback is not None:
+            try:
+                self._error_callback(e)
+            except:
+                traceback.print_exc()
@@ -0,0 +1,161 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import threading
+import time
+from collections import namedtuple
+from .rapid_codec import decode_rapid_value, encode_rapid_value
+
+RAPIDSymbolInfo=namedtuple('RAPIDSymbolInfo', ['symburl', 'name', 'symtyp', 'datatype', 'dims', 'task', 'module', 'readonly'])
+
+class RAPIDSymbolCatalogue(object):
+    
+    # Caches RWS symbol properties so typed access does not need the
+    # caller to know the data type. Symbols are addressed as 'var' or
+    # 'module/var' within a task. Lookups that fail are remembered for
+    # missing_ttl seconds so repeated reads of a missing symbol do not
+    # hit the controller.
+    
+    def __init__(self, rapid, missing_ttl=10.0):
+        self._rapid=rapid
+        self.missing_ttl=missing_ttl
+        self._symbols={}
+        self._missing={}
+        self._lock=threading.Lock()
+    
+    def lookup(self, var, task='T_ROB1'):
+        key=task + '/' + var
+        with self._lock:
+            info=self._symbols.get(key, None)
+            if info is not None:
+                return info
+            missing=self._missing.get(key, None)
+            if missing is not None and missing[0] > time.time():
+                raise missing[1]
+        
+        try:
+            soup=self._rapid._do_get("rw/rapid/symbol/properties/RAPID/" + task + "/" + var)
+            info=_parse_symbol_properties(soup, task)
+        except Exception as e:
+            with self._lock:
+                self._missing[key]=(time.time() + self.missing_ttl, e)
+            raise
+        
+        with self._lock:
+            self._symbols[key]=info
+            if info.module is not None:
+                self._symbols[task + '/' + info.module + '/' + info.name]=info
+        return info
+    
+    def prefetch_module(self, module, task='T_ROB1'):
+        payload={'view': 'block', 'blockurl': 'RAPID/' + task + '/' + module, 'symtyp': 'any', \
+                 'recursive': 'FALSE', 'skipshared': 'FALSE', 'onlyused': 'FALSE'}
+        soup=self._rapid._do_post("rw/rapid/symbols?action=search-symbols", payload)
+        o=[]
+        while True:
+            for li in soup.findAll('li'):
+                if li.find('span', attrs={'class': 'symburl'}) is None:
+                    continue
+                info=_parse_symbol_li(li, task)
+                if info.symtyp not in ('con', 'var', 'per'):
+                    continue
+                o.append(info)
+            next_link=soup.find('a', attrs={'rel': 'next'})
+            if next_link is None:
+                break
+            soup=self._rapid._do_get(next_link['href'].lstrip('/'))
+        
+        with self._lock:
+            for info in o:
+                self._symbols[task + '/' + info.name]=info
+                self._symbols[task + '/' + module + '/' + info.name]=info
+                self._missing.pop(task + '/' + info.name, None)
+        return o
+    
+    def invalidate(self, var=None, task='T_ROB1'):
+        with self._lock:
+            if var is None:
+                self._symbols.clear()
+                self._missing.clear()
+            else:
+                self._symbols.pop(task + '/' + var, None)
+                self._missing.pop(task + '/' + var, None)
+    
+    def _value_aliases(self, symburl):
+        
+        # A value can be read through 'RAPID/task/var' or through the
+        # module-qualified symburl, and RWS caches them under separate
+        # urls. Returns every known url of the same symbol.
+        
+        parts=symburl.strip('/').split('/')
+        if len(parts) == 4:
+            return [symburl, '/'.join(parts[:2] + parts[3:])]
+        if len(parts) == 3:
+            with self._lock:
+                info=self._symbols.get(parts[1] + '/' + parts[2], None)
+            if info is not None and info.symburl != symburl:
+                return [symburl, info.symburl]
+        return [symburl]
+    
+    def get(self, var, task='T_ROB1'):
+        info=self.lookup(var, task)
+        val=self._rapid._get_rapid_symbol_value(info.symburl)
+        return decode_rapid_value(val, info.datatype, info.dims)
+    
+    def set(self, var, value, task='T_ROB1'):
+        info=self.lookup(var, task)
+        if info.readonly:
+            raise Exception("RAPID symbol " + info.symburl + " is read only")
+        if isinstance(value, basestring) and info.datatype != 'string':
+            rws_value=value
+        else:
+            rws_value=encode_rapid_value(value, info.datatype, info.dims)
+        self._rapid._set_rapid_symbol_value(info.symburl, rws_value)
+
+def _span_text(li, c):
+    s=li.find('span', attrs={'class': c})
+    return s.text if s is not None else None
+
+def _parse_symbol_li(li, task):
+    symburl=_span_text(li, 'symburl')
+    symtyp=_span_text(li, 'symtyp')
+    ndim=int(_span_text(li, 'ndim') or 0)
+    dims=None
+    if ndim > 0:
+        dims=[int(d) for d in _span_text(li, 'dim').split()]
+    parts=symburl.split('/')
+    module=parts[2] if len(parts) >= 4 else None
+    readonly=symtyp == 'con' or _span_text(li, 'rdonly') == 'true'
+    return RAPIDSymbolInfo(symburl, _span_text(li, 'name'), symtyp, _span_text(li, 'dattyp'), dims, task, module, readonly)
+
+def _parse_symbol_properties(soup, task):
+    for li in soup.findAll('li'):
+        if li.find('span', attrs={'class': 'symburl'}) is not None:
+            return _parse_symbol_li(li, task)
+    raise Exception("Robot returned no symbol properties")
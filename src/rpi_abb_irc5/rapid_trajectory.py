@@ -0,0 +1,208 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from __future__ import absolute_import
+
+import threading
+import time
+import traceback
+import numpy as np
+from collections import namedtuple, deque
+from .rapid_codec import encode_jointtarget_positions, format_rapid_num_array
+
+# Joint trajectory buffers of rpi_abb_irc5_rapid.mod: JointTrajectory_0..9
+# hold 10 points each and JointTrajectoryTime the MoveAbsJ time of each
+# point. JointTrajectoryCount selects the mode.
+RAPID_TRAJECTORY_BUFFER_SIZE=100
+RAPID_TRAJECTORY_SEGMENT_SIZE=10
+RAPID_TRAJECTORY_EGM=-1000
+RAPID_TRAJECTORY_STREAM=-2000
+
+def _segment_value(positions):
+    n=len(positions)
+    if n < RAPID_TRAJECTORY_SEGMENT_SIZE:
+        positions=np.vstack((positions, np.repeat(positions[-1:], RAPID_TRAJECTORY_SEGMENT_SIZE - n, axis=0)))
+    return encode_jointtarget_positions(positions)
+
+RAPIDTrajectoryUploadStats=namedtuple('RAPIDTrajectoryUploadStats', ['points', 'duration', 'writes', 'unchanged', 'bytes'])
+
+class RAPIDTrajectoryUploader(object):
+    
+    # Uploads joint trajectories of up to 100 points to the buffers of
+    # rpi_abb_irc5_rapid.mod. The last value written to each buffer is
+    # remembered, so only the 10 point segments and time table that
+    # differ from the previous goal are sent, and those writes run
+    # concurrently. JointTrajectoryCount is only reset first when a
+    # trajectory may still be running, since every count write fires the
+    # ExitCycle trap. Call invalidate() when something else writes the
+    # buffers (streaming, another client).
+    
+    def __init__(self, rapid, history=100):
+        self._rapid=rapid
+        self._uploaded={}
+        self._lock=threading.Lock()
+        self.history=deque(maxlen=history)
+    
+    def invalidate(self):
+        with self._lock:
+            self._uploaded.clear()
+    
+    def upload(self, positions, durations, stop_first=True):
+        positions=np.asarray(positions, dtype=np.float64)
+        durations=np.asarray(durations, dtype=np.float64)
+        count=len(positions)
+        if count == 0 or count > RAPID_TRAJECTORY_BUFFER_SIZE:
+            raise ValueError("Trajectory must have 1 to %d points" % RAPID_TRAJECTORY_BUFFER_SIZE)
+        if positions.shape[1:] != (6,) or durations.shape != (count,):
+            raise ValueError("positions must be (N,6) and durations (N,)")
+        
+        t1=time.time()
+        times=np.zeros((RAPID_TRAJECTORY_BUFFER_SIZE,))
+        times[:count]=durations
+        values=[("JointTrajectoryTime", format_rapid_num_array(times))]
+        padded=np.zeros((RAPID_TRAJECTORY_BUFFER_SIZE, 6))
+        padded[:count]=positions
+        for j in xrange((count + RAPID_TRAJECTORY_SEGMENT_SIZE - 1)/RAPID_TRAJECTORY_SEGMENT_SIZE):
+            p=j*RAPID_TRAJECTORY_SEGMENT_SIZE
+            values.append(("JointTrajectory_%d" % j, encode_jointtarget_positions(padded[p:p+RAPID_TRAJECTORY_SEGMENT_SIZE])))
+        
+        with self._lock:
+            changed=[(var, val) for var, val in values if self._uploaded.get(var, None) != val]
+            # Forget the buffers being rewritten until the writes succeed
+            for var, val in changed:
+                self._uploaded.pop(var, None)
+        
+        rapid=self._rapid
+        if stop_first:
+            rapid.set_rapid_variable_num("JointTrajectoryCount", 0)
+        def write(v):
+            rapid.set_rapid_variable(v[0], v[1])
+            with self._lock:
+                self._uploaded[v[0]]=v[1]
+        rapid.map_concurrent(write, changed)
+        rapid.set_rapid_variable_num("JointTrajectoryCount", count)
+        
+        stats=RAPIDTrajectoryUploadStats(count, time.time() - t1, len(changed) + 1 + (1 if stop_first else 0), \
+                                         len(values) - len(changed), sum([len(v[1]) for v in changed]))
+        self.history.append(stats)
+        return stats
+
+class RAPIDTrajectoryStreamer(object):
+    
+    # Streams a joint trajectory of any length through the 100 point ring
+    # of rpi_abb_irc5_rapid.mod. start() fills the ring and switches RAPID
+    # to streaming mode, then a producer thread writes each following
+    # 10 point segment as soon as RAPID has copied the points it replaces,
+    # i.e. while point p satisfies p < CurrentJointTrajectoryCount + 100.
+    # RAPID keeps z100 zones between points, so the motion only stops if
+    # the producer falls a full ring behind.
+    #
+    # positions is (N,6) in radians, durations (N,) is the MoveAbsJ time of
+    # each point in seconds.
+    
+    def __init__(self, rapid, positions, durations, poll_period=0.05, done_callback=None):
+        self._rapid=rapid
+        self.positions=np.asarray(positions, dtype=np.float64)
+        self.durations=np.asarray(durations, dtype=np.float64)
+        if self.positions.ndim != 2 or self.positions.shape[1] != 6 or len(self.durations) != len(self.positions):
+            raise ValueError("positions must be (N,6) and durations (N,)")
+        self.total=len(self.positions)
+        self.poll_period=poll_period
+        self._done_callback=done_callback
+        self._times=np.zeros((RAPID_TRAJECTORY_BUFFER_SIZE,))
+        self._stop_event=threading.Event()
+        self._thread=None
+        self.written=0
+        self.current=0
+        self.underruns=0
+        self.error=None
+        self.done=threading.Event()
+    
+    def start(self):
+        rapid=self._rapid
+        rapid.set_rapid_variable_num("JointTrajectoryCount", 0)
+        rapid.set_rapid_variable_num("JointTrajectoryStreamWritten", 0)
+        rapid.set_rapid_variable_num("JointTrajectoryStreamTotal", self.total)
+        n=min(self.total, RAPID_TRAJECTORY_BUFFER_SIZE)
+        self._times[:n]=self.durations[:n]
+        rapid.set_rapid_variable_num_array("JointTrajectoryTime", self._times)
+        for p in xrange(0, n, RAPID_TRAJECTORY_SEGMENT_SIZE):
+            self._write_segment(p)
+        self._set_written(n)
+        rapid.set_rapid_variable_num("JointTrajectoryCount", RAPID_TRAJECTORY_STREAM)
+        
+        self._thread=threading.Thread(target=self._run, name="rapid_trajectory_streamer")
+        self._thread.daemon=True
+        self._thread.start()
+    
+    def cancel(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+    
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+    
+    def _write_segment(self, p):
+        j=(p % RAPID_TRAJECTORY_BUFFER_SIZE)/RAPID_TRAJECTORY_SEGMENT_SIZE
+        self._rapid.set_rapid_variable("JointTrajectory_%d" % j, \
+                                       _segment_value(self.positions[p:p+RAPID_TRAJECTORY_SEGMENT_SIZE]))
+    
+    def _set_written(self, n):
+        self._rapid.set_rapid_variable_num("JointTrajectoryStreamWritten", n)
+        self.written=n
+    
+    def _run(self):
+        rapid=self._rapid
+        try:
+            while not self._stop_event.is_set():
+                count=rapid.get_rapid_variable_num("JointTrajectoryCount")
+                if count != RAPID_TRAJECTORY_STREAM:
+                    # Finished, or stopped by a trap or cancel
+                    break
+                self.current=int(rapid.get_rapid_variable_num("CurrentJointTrajectoryCount"))
+                p=self.written
+                if p < self.total and p + RAPID_TRAJECTORY_SEGMENT_SIZE <= self.current + RAPID_TRAJECTORY_BUFFER_SIZE:
+                    if self.current >= p:
+                        self.underruns+=1
+                    n=min(RAPID_TRAJECTORY_SEGMENT_SIZE, self.total - p)
+                    slot=p % RAPID_TRAJECTORY_BUFFER_SIZE
+                    self._times[slot:slot+n]=self.durations[p:p+n]
+                    rapid.set_rapid_variable_num_array("JointTrajectoryTime", self._times)
+                    self._write_segment(p)
+                    self._set_written(p + n)
+                    continue
+                self._stop_event.wait(self.poll_period)
+        except Exception as e:
+            traceback.print_exc()
+            self.error=e
+        finally:
+            self.done.set()
+            if self._done_callback is not None:
+                self._done_callback(self)
@@ -35,7 +35,9 @@ from ..srv import \
     RapidGetStatus, RapidGetStatusRequest, RapidGetStatusResponse, \
     RapidGetDigitalIO, RapidGetDigitalIORequest, RapidGetDigitalIOResponse, \
     RapidSetDigitalIO, RapidSetDigitalIORequest, RapidSetDigitalIOResponse, \
-    RapidReadEventLog, RapidReadEventLogRequest, RapidReadEventLogResponse
+    RapidReadEventLog, RapidReadEventLogRequest, RapidReadEventLogResponse, \
+    RapidGetIOSignals, RapidGetIOSignalsRequest, RapidGetIOSignalsResponse, \
+    RapidSetIOSignals, RapidSetIOSignalsRequest, RapidSetIOSignalsResponse
 
 from ..msg import RapidEventLogMessage
 
@@ -79,6 +81,10 @@ class RAPIDCommander(object):
                                                     RapidGetDigitalIO)
         self._set_digital_io_srv=rospy.ServiceProxy(rospy.names.ns_join(ns,'set_digital_io'), \
                                                     RapidSetDigitalIO)
+        self._get_io_signals_srv=rospy.ServiceProxy(rospy.names.ns_join(ns,'get_io_signals'), \
+                                                    RapidGetIOSignals)
+        self._set_io_signals_srv=rospy.ServiceProxy(rospy.names.ns_join(ns,'set_io_signals'), \
+                                                    RapidSetIOSignals)
         
         self._get_status_srv=rospy.ServiceProxy(rospy.names.ns_join(ns,'status'), \
                                                     RapidGetStatus)
@@ -130,6 +136,35 @@ class RAPIDCommander(object):
         
         if not res.success:
             raise Exception("RAPID Set Digital IO Failed")
+    
+    def get_io_signals(self, signals=[], network='', unit=''):
+        req=RapidGetIOSignalsRequest()
+        req.signals=signals
+        req.network=network
+        req.unit=unit
+        
+        self._get_io_signals_srv.wait_for_service(1.0)        
+        res=self._get_io_signals_srv(req)
+        
+        if not res.success:
+            raise Exception("RAPID Get IO Signals Failed")
+        
+        return dict(zip(res.signals, res.lvalues))
+    
+    def set_io_signals(self, values, network='', unit=''):
+        if isinstance(values, dict):
+            values=values.items()
+        req=RapidSetIOSignalsRequest()
+        req.signals=[v[0] for v in values]
+        req.lvalues=[float(v[1]) for v in values]
+        req.network=network
+        req.unit=unit
+        
+        self._set_io_signals_srv.wait_for_service(1.0)        
+        res=self._set_io_signals_srv(req)
+        
+        if not res.success:
+            raise Exception("RAPID Set IO Signals Failed")
 
     def get_status(self):
         req=RapidGetStatusRequest()
@@ -142,8 +177,9 @@ class RAPIDCommander(object):
         
         return RAPIDNodeStatus(res.running, res.cycle, res.opmode, res.ctrlstate)
     
-    def read_event_log(self):
+    def read_event_log(self, incremental=False):
         req=RapidReadEventLogRequest()
+        req.incremental=incremental
         
         self._read_event_log_srv.wait_for_service(1.0)        
         res=self._read_event_log_srv(req)
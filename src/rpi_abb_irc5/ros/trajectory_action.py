@@ -0,0 +1,80 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import rospy
+import numpy as np
+from control_msgs.msg import FollowJointTrajectoryResult
+
+from ..joint_trajectory import get_joint_limits, JointLimits, format_joint_trajectory_violations, \
+    JOINT_TRAJECTORY_JOINT_VIOLATIONS
+from ..trajectory_analytics import append_trajectory_summary_csv
+
+# Helpers shared by the FollowJointTrajectory action servers of the RAPID
+# and EGM drivers
+
+def get_joint_limits_param():
+    
+    # Joint limits from ~robot_model, each field can be overridden with a
+    # list parameter. Returns None if no limits are configured.
+    
+    model=rospy.get_param('~robot_model', None)
+    limits=get_joint_limits(model) if model is not None else JointLimits(None, None, None, None)
+    fields=[]
+    for name, default in zip(['~joint_lower_limits', '~joint_upper_limits', '~joint_velocity_limits', \
+                              '~joint_acceleration_limits'], limits):
+        v=rospy.get_param(name, default)
+        fields.append(np.array(v, dtype=np.float64) if v is not None else None)
+    if all([f is None for f in fields]):
+        return None
+    return JointLimits(*fields)
+
+def reject_goal(gh, error_code, error_string):
+    rospy.logerr(error_string)
+    res=FollowJointTrajectoryResult()
+    res.error_code=error_code
+    res.error_string=error_string
+    gh.set_rejected(res, error_string)
+
+def reject_invalid_goal(gh, validation, joint_names):
+    
+    # Rejects a goal that failed validate_joint_trajectory, with
+    # INVALID_JOINTS when the joint names or count are wrong
+    
+    code=FollowJointTrajectoryResult.INVALID_GOAL
+    if any([v.kind in JOINT_TRAJECTORY_JOINT_VIOLATIONS for v in validation.violations]):
+        code=FollowJointTrajectoryResult.INVALID_JOINTS
+    reject_goal(gh, code, "Invalid trajectory:\n" + \
+                format_joint_trajectory_violations(validation.violations, joint_names, total=validation.total))
+
+def log_trajectory_run(analysis, analytics_log=None):
+    s=analysis.summary
+    rospy.loginfo("Trajectory run %.3f s commanded, %.3f s measured, lag %.1f ms, rms error %.2f mrad, fine %.3f s" \
+                  % (s.commanded_duration, s.measured_duration, 1e3*s.lag_mean, 1e3*s.error_rms, s.fine_time))
+    if analytics_log:
+        append_trajectory_summary_csv(analytics_log, s)
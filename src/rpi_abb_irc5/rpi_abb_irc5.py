@@ -40,9 +40,19 @@ from datetime import datetime
 import errno
 import re
 from ws4py.client.threadedclient import WebSocketClient
+from ws4py.client import WebSocketBaseClient
+from ws4py.manager import WebSocketManager
+from xml.sax.saxutils import unescape
 import threading
 import time
 import random
+from multiprocessing.pool import ThreadPool
+from .rapid_codec import *
+from .rapid_symbols import RAPIDSymbolCatalogue, RAPIDSymbolInfo
+from .rws_metrics import RWSMetrics, endpoint_template, histogram_percentile, format_metrics
+from .rws_cache import RWSCache, RWSCacheStats
+from .rws_auth import RWSDigestAuth, RWSAuthStats, RWS_SESSION_COOKIES
+from .subscription_dispatch import RAPIDCallbackDispatcher, RAPIDDispatchStats
 
 class EGM(object):
 
@@ -123,34 +133,203 @@ class EGM(object):
         return True
 
 EGMRobotState=namedtuple('EGMRobotState', ['joint_angles', 'rapid_running', 'motors_on', 'robot_message'], verbose=False)
-JointTarget=namedtuple('JointTarget', ['robax', 'extax'])
-RobTarget=namedtuple('RobTarget', ['trans','rot','robconf','extax'])
+
+#Default cache TTLs in seconds, selected by longest matching resource prefix.
+#Mechunit targets are only cached while the motors are off. RAPID symbol
+#data is not cached by default since RAPID itself writes PERS variables
+#(JointTrajectoryCount, CurrentJointTrajectoryCount, the streaming ring
+#counters) and a cached read would hide those changes. Cache individual
+#variables only RAPID never writes, with set_rapid_variable_cache_ttl.
+RWS_CACHE_DEFAULT_TTLS={'rw/panel/opmode': 2.0,
+                        'rw/elog': 1.0,
+                        'rw/motionsystem/mechunits': 10.0}
+
+#Resources whose cached values become stale when another resource changes
+_RWS_CACHE_DEPENDENCIES={'rw/panel/ctrlstate': ['rw/motionsystem']}
 
 class RAPID(object):
 
     def __init__(self, base_url='http://127.0.0.1:80', username='Default User', password='robotics'):
         self.base_url=base_url
-        self.auth=requests.auth.HTTPDigestAuth(username, password)
+        self.auth=RWSDigestAuth(username, password)
         self._session=requests.Session()
         self._rmmp_session=None
         self._rmmp_session_t=None
+        self._cache=None
+        self._metrics=None
+        self._ctrlstate=None
+        self._ctrlstate_subscriptions=0
+        self._ctrlstate_lock=threading.Lock()
+        self._subscription_engine=None
+        self._dispatcher=None
+        self.symbols=RAPIDSymbolCatalogue(self)
+        self._pool=None
+        self._pool_lock=threading.Lock()
+        self._rmmp_keeper=None
+        
+    def _do_get(self, relative_url, use_cache=True):
+        cache=self._cache if use_cache else None
+        if cache is not None and cache.ttl(relative_url) > 0:
+            hit, soup=cache.get(relative_url)
+            if hit:
+                return soup
+        else:
+            cache=None
+        
+        soup=self._request('GET', relative_url)
+        
+        if cache is not None:
+            cache.put(relative_url, soup)
+        return soup
+    
+
+    def _do_get_text(self, relative_url, session=None, parse=None):
+        
+        # Same as _do_get but without building a soup, for hot paths parsed
+        # with regular expressions. Returns parse(body), or the raw body if
+        # parse is None; the parse is timed as the parse time in metrics.
+        
+        cache=self._cache
+        key=None
+        if cache is not None and cache.ttl(relative_url) > 0:
+            key=relative_url + ('&' if '?' in relative_url else '?') + 'raw'
+            hit, text=cache.get(key)
+            if hit:
+                return text if parse is None else parse(text)
         
-    def _do_get(self, relative_url):
         url="/".join([self.base_url, relative_url])
-        res=self._session.get(url, auth=self.auth)
-        try:            
-            return self._process_response(res)
+        if session is None:
+            session=self._session
+        t1=time.time()
+        res=session.get(url, auth=self.auth)
+        t2=time.time()
+        try:
+            if res.status_code != 200:
+                self._process_response(res)
+            text=res.content
+            if key is not None:
+                cache.put(key, text)
+            return text if parse is None else parse(text)
         finally:
             res.close()
-    
+            if self._metrics is not None:
+                self._metrics.record('GET', relative_url, res.status_code, t2-t1, time.time()-t2, len(res.content), 0)
 
     def _do_post(self, relative_url, payload=None):
+        try:
+            return self._request('POST', relative_url, payload)
+        finally:
+            self._invalidate_cache_resource(relative_url)
+    
+    def _request(self, method, relative_url, payload=None):
         url="/".join([self.base_url, relative_url])
-        res=self._session.post(url, data=payload, auth=self.auth)
+        session=self._session
+        metrics=self._metrics
+        if metrics is None:
+            res=session.request(method, url, data=payload, auth=self.auth)
+            try:
+                return self._process_response(res)
+            finally:
+                res.close()
+        
+        t1=time.time()
+        res=session.request(method, url, data=payload, auth=self.auth)
+        t2=time.time()
         try:
             return self._process_response(res)
         finally:
             res.close()
+            t3=time.time()
+            body=res.request.body
+            metrics.record(method, relative_url, res.status_code, t2-t1, t3-t2, len(res.content), \
+                           len(body) if body is not None else 0)
+    
+    def enable_metrics(self, trace_size=0):
+        if self._metrics is None:
+            self._metrics=RWSMetrics(trace_size)
+        return self._metrics
+    
+    def disable_metrics(self):
+        self._metrics=None
+    
+    def get_metrics(self):
+        if self._metrics is None:
+            return []
+        return self._metrics.snapshot()
+    
+    def get_auth_stats(self):
+        return self.auth.get_stats()
+    
+    def enable_cache(self, max_entries=256, ttls=None):
+        if ttls is None:
+            ttls=RWS_CACHE_DEFAULT_TTLS
+        cache=RWSCache(max_entries)
+        for prefix, ttl in ttls.items():
+            condition=self._motors_off if prefix.startswith('rw/motionsystem') else None
+            cache.set_ttl(prefix, ttl, condition)
+        self._cache=cache
+        return cache
+    
+    def disable_cache(self):
+        self._cache=None
+    
+    def set_cache_ttl(self, resource, ttl):
+        if self._cache is None:
+            raise Exception("RWS cache is not enabled")
+        condition=self._motors_off if resource.strip('/').startswith('rw/motionsystem') else None
+        self._cache.set_ttl(resource, ttl, condition)
+    
+    def set_rapid_variable_cache_ttl(self, var, ttl, task='T_ROB1'):
+        
+        # Opt-in caching of one RAPID variable, under both the task and the
+        # module-qualified url. Never use this for variables RAPID writes,
+        # our own writes are the only invalidation.
+        
+        if self._cache is None:
+            raise Exception("RWS cache is not enabled")
+        symburl=self.symbols.lookup(var, task).symburl
+        for p in set(self.symbols._value_aliases(symburl) + ["RAPID/" + task + "/" + var]):
+            self._cache.set_ttl("rw/rapid/symbol/data/" + p, ttl)
+    
+    def invalidate_cache(self, resource=None):
+        if self._cache is None:
+            return 0
+        return self._cache.invalidate(resource)
+    
+    def get_cache_stats(self):
+        if self._cache is None:
+            return RWSCacheStats(0, 0, 0, 0, 0)
+        return self._cache.stats()
+    
+    def _motors_off(self):
+        
+        # The last known state is only trusted while a ctrlstate
+        # subscription would report the motors turning back on
+        
+        return self._ctrlstate_subscriptions > 0 and self._ctrlstate == 'motoroff'
+    
+    def _ctrlstate_subscription_changed(self, live):
+        with self._ctrlstate_lock:
+            if live:
+                if self._ctrlstate_subscriptions == 0:
+                    self._ctrlstate=None
+                self._ctrlstate_subscriptions+=1
+            else:
+                self._ctrlstate_subscriptions-=1
+                if self._ctrlstate_subscriptions == 0:
+                    self._ctrlstate=None
+    
+    def _invalidate_cache_resource(self, resource):
+        cache=self._cache
+        if cache is None:
+            return
+        path=resource.split('?')[0].strip('/')
+        cache.invalidate(path)
+        if path.startswith('rw/rapid/symbol/data/'):
+            for p in self.symbols._value_aliases(path[len('rw/rapid/symbol/data/'):]):
+                cache.invalidate('rw/rapid/symbol/data/' + p)
+        for p in _RWS_CACHE_DEPENDENCIES.get(path, []):
+            cache.invalidate(p)
 
     def _process_response(self, response):        
         soup=BeautifulSoup(response.text)
@@ -194,7 +373,9 @@ class RAPID(object):
     
     def get_controller_state(self):
         soup = self._do_get("rw/panel/ctrlstate")
-        return soup.find('span', attrs={'class': 'ctrlstate'}).text
+        ctrlstate=soup.find('span', attrs={'class': 'ctrlstate'}).text
+        self._ctrlstate=ctrlstate
+        return ctrlstate
     
     def get_operation_mode(self):
         soup = self._do_get("rw/panel/opmode")        
@@ -210,18 +391,134 @@ class RAPID(object):
         payload={'lvalue': lvalue}
         res=self._do_post("rw/iosystem/signals/" + network + "/" + unit + "/" + signal + "?action=set", payload)
     
-    def get_rapid_variable(self, var):
-        soup = self._do_get("rw/rapid/symbol/data/RAPID/T_ROB1/" + var)        
+    def get_analog_io(self, signal, network='Local', unit='DRV_1'):
+        return float(self._get_signal_lvalue(network + "/" + unit + "/" + signal))
+    
+    def set_analog_io(self, signal, value, network='Local', unit='DRV_1'):
+        self._set_signal_lvalue(network + "/" + unit + "/" + signal, float(value))
+    
+    def get_group_io(self, signal, network='Local', unit='DRV_1'):
+        return int(self._get_signal_lvalue(network + "/" + unit + "/" + signal))
+    
+    def set_group_io(self, signal, value, network='Local', unit='DRV_1'):
+        self._set_signal_lvalue(network + "/" + unit + "/" + signal, int(value))
+    
+    def get_io_signals(self, signals=None, network='Local', unit='DRV_1'):
+        
+        # Reads many signals with one listing request per network/unit
+        # instead of one request per signal. signals are names in
+        # network/unit or full network/unit/name paths; None reads every
+        # signal of network/unit. Returns RAPIDSignalState in request order,
+        # with lvalue None if the controller did not report a value.
+        
+        if signals is None:
+            return self._get_signal_listing(network, unit)
+        paths=[s if s.count('/') == 2 else network + "/" + unit + "/" + s for s in signals]
+        units=sorted(set([p.rsplit('/',1)[0] for p in paths]))
+        listings=self.map_concurrent(lambda u: self._get_signal_listing(*u.split('/')), units)
+        found=dict([(s.network + "/" + s.unit + "/" + s.name, s) for l in listings for s in l])
+        missing=[p for p in paths if p not in found]
+        if len(missing) > 0:
+            raise Exception("IO signals not found: " + ", ".join(missing))
+        return [found[p] for p in paths]
+    
+    def set_io_signals(self, values, network='Local', unit='DRV_1'):
+        
+        # values is a dict or (signal, value) list. Each signal is still one
+        # RWS set request, but they are issued concurrently.
+        
+        if isinstance(values, dict):
+            values=values.items()
+        paths=[(s if s.count('/') == 2 else network + "/" + unit + "/" + s, v) for s, v in values]
+        self.map_concurrent(lambda p: self._set_signal_lvalue(*p), paths)
+    
+    def _get_signal_lvalue(self, path):
+        soup = self._do_get("rw/iosystem/signals/" + path)
+        return soup.find('span', attrs={'class': 'lvalue'}).text
+    
+    def _set_signal_lvalue(self, path, value):
+        if isinstance(value, bool):
+            lvalue='1' if value else '0'
+        elif isinstance(value, float) and value.is_integer():
+            lvalue='%d' % value
+        else:
+            lvalue=str(value)
+        self._do_post("rw/iosystem/signals/" + path + "?action=set", {'lvalue': lvalue})
+    
+    def _get_signal_listing(self, network, unit, limit=100):
+        o=[]
+        soup=self._do_get("rw/iosystem/signals?network=%s&device=%s&start=0&limit=%d" % (network, unit, limit))
+        while True:
+            for li in soup.findAll('li', attrs={'class': 'ios-signal-li'}):
+                def find_val(v):
+                    s=li.find('span', attrs={'class': v})
+                    return s.text if s is not None else None
+                sigtype=find_val('type')
+                lvalue=find_val('lvalue')
+                # lvalue stays None when the listing does not report it
+                if lvalue is not None and sigtype in ('AI', 'AO'):
+                    lvalue=float(lvalue)
+                elif lvalue is not None and sigtype in ('DI', 'DO', 'GI', 'GO'):
+                    lvalue=int(lvalue)
+                title=li.get('title')
+                if title is None:
+                    title=network + "/" + unit + "/" + find_val('name')
+                path=title.split('/')
+                o.append(RAPIDSignalState(path[-1], path[0], path[1] if len(path) == 3 else unit, \
+                                          sigtype, find_val('category'), lvalue))
+            next_link=soup.find('a', attrs={'rel': 'next'})
+            if next_link is None:
+                break
+            soup=self._do_get("rw/iosystem/" + next_link['href'].lstrip('/').split('rw/iosystem/')[-1])
+        return o
+    
+    def get_rapid_variable(self, var, task='T_ROB1'):
+        return self._get_rapid_symbol_value("RAPID/" + task + "/" + var)
+    
+    def set_rapid_variable(self, var, value, task='T_ROB1'):
+        self._set_rapid_symbol_value("RAPID/" + task + "/" + var, value)
+    
+    def _get_rapid_symbol_value(self, symburl):
+        soup = self._do_get("rw/rapid/symbol/data/" + symburl)        
         state = soup.find('span', attrs={'class': 'value'}).text
         return state
     
-    def set_rapid_variable(self, var, value):
+    def _set_rapid_symbol_value(self, symburl, value):
         payload={'value': value}
-        res=self._do_post("rw/rapid/symbol/data/RAPID/T_ROB1/" + var + "?action=set", payload)
+        res=self._do_post("rw/rapid/symbol/data/" + symburl + "?action=set", payload)
+    
+    def get(self, var, task='T_ROB1'):
+        return self.symbols.get(var, task)
+    
+    def set(self, var, value, task='T_ROB1'):
+        self.symbols.set(var, value, task)
+    
+    def prefetch_rapid_symbols(self, module, task='T_ROB1'):
+        return self.symbols.prefetch_module(module, task)
         
     def read_event_log(self, elog=0):
-        o=[]
         soup = self._do_get("rw/elog/" + str(elog) + "/?lang=en")
+        return self._parse_event_log(soup)
+    
+    def get_event_log_domains(self):
+        soup = self._do_get("rw/elog?lang=en")
+        o=[]
+        for li in soup.findAll('li', attrs={'class': 'elog-domain-li'}):
+            a=li.find('a', attrs={'rel': 'self'})
+            o.append(int(a['href'].split('?')[0].rstrip('/').rsplit('/',1)[-1]))
+        return o
+    
+    def read_event_log_page(self, elog=0, start=0, limit=50, use_cache=True):
+        soup = self._do_get("rw/elog/" + str(elog) + "/?lang=en&start=%d&limit=%d" % (start, limit), use_cache)
+        has_next = soup.find('a', attrs={'rel': 'next'}) is not None
+        return self._parse_event_log(soup), has_next
+    
+    def read_event_log_entry(self, seqnum, elog=0):
+        soup = self._do_get("rw/elog/" + str(elog) + "/" + str(seqnum) + "?lang=en")
+        return self._parse_event_log(soup)[0]
+    
+    def _parse_event_log(self, soup):
+        o=[]
         state=soup.find('div', attrs={'class': 'state'})
         ul=state.find('ul')
         
@@ -241,96 +538,110 @@ class RAPID(object):
             for i in xrange(nargs):
                 arg=find_val('arg%d' % (i+1))
                 args.append(arg)
+            seqnum=None
+            a=li.find('a', attrs={'rel': 'self'})
+            if a is not None:
+                seqnum=int(a['href'].split('?')[0].rstrip('/').rsplit('/',1)[-1])
             
-            o.append(RAPIDEventLogEntry(msg_type,code,tstamp,args,title,desc,conseqs,causes,actions))
+            o.append(RAPIDEventLogEntry(msg_type,code,tstamp,args,title,desc,conseqs,causes,actions,seqnum))
         return o
     
     def get_jointtarget(self, mechunit="ROB_1"):
-        soup=self._do_get("rw/motionsystem/mechunits/" + mechunit + "/jointtarget")
-        state=str(soup.find('li', attrs={'class': 'ms-jointtarget'}))
-        robjoint=np.zeros((6,))
-        i=0
-        for match in re.finditer('class=\"rax_(\\d)">(-?\\d+(?:\\.\\d+)?)',state):
-            j=int(match.groups()[0])
-            assert i+1==j
-            a=float(match.groups()[1])
-            robjoint[j-1]=np.deg2rad(a)
-            i+=1
-            
-        #robjoint=np.array([np.deg2rad(float(state.find('span', attrs={'class': 'rax_' + str(i+1)}).text)) for i in xrange(6)]) 
-        #extjoint=np.array([np.deg2rad(float(state.find('span', attrs={'class': 'eax_' + chr(i)}).text)) for i in xrange(ord('a'),ord('g'))])
-        extjoint=None
-        return JointTarget(robjoint,extjoint)
+        return self._do_get_text("rw/motionsystem/mechunits/" + mechunit + "/jointtarget", \
+                                 parse=parse_jointtarget_xhtml)
         
     def get_robtarget(self, mechunit='ROB_1', tool='tool0', wobj='wobj0', coordinate='Base'):
-        soup=self._do_get("rw/motionsystem/mechunits/" + mechunit + "/robtarget?tool=%s&wobj=%s&coordinate=%s" % (tool, wobj, coordinate))
-        state=soup.find('li', attrs={'class': 'ms-robtargets'})
-        trans=np.array([(float(state.find('span', attrs={'class': i}).text)/1000.0) for i in 'xyz'])
-        rot=np.array([(float(state.find('span', attrs={'class': 'q' + str(i+1)}).text)) for i in xrange(4)])
-        robconf=np.array([(float(state.find('span', attrs={'class': i}).text)) for i in ['cf1','cf4','cf6','cfx']])
-        extax=np.array([np.deg2rad(float(state.find('span', attrs={'class': 'eax_' + chr(i)}).text)) for i in xrange(ord('a'),ord('g'))])
-        return RobTarget(trans,rot,robconf,extax)
+        return self._do_get_text("rw/motionsystem/mechunits/" + mechunit + "/robtarget?tool=%s&wobj=%s&coordinate=%s" \
+                                 % (tool, wobj, coordinate), parse=parse_robtarget_xhtml)
+    
+    def get_tasks(self):
+        soup=self._do_get("rw/rapid/tasks")
+        o=[]
+        for li in soup.findAll('li', attrs={'class': 'rap-task-li'}):
+            def find_val(v):
+                s=li.find('span', attrs={'class': v})
+                return s.text if s is not None else None
+            o.append(RAPIDTaskState(find_val('name'), find_val('type'), find_val('taskstate'), find_val('excstate'), \
+                                    find_val('active') == 'On', find_val('motiontask') == 'TRUE'))
+        return o
+    
+    def get_mechunits(self):
+        soup=self._do_get("rw/motionsystem/mechunits")
+        return [li['title'] for li in soup.findAll('li', attrs={'class': 'ms-mechunit-li'})]
+    
+    def get_jointtargets(self, mechunits=None):
+        
+        # Reads all mechunits concurrently, so a MultiMove cell is sampled
+        # in about one round-trip. robax and extax are stacked (N,6).
+        
+        if mechunits is None:
+            mechunits=self.get_mechunits()
+        jt=self.map_concurrent(self.get_jointtarget, mechunits)
+        robax=np.vstack([j.robax for j in jt])
+        extax=None
+        if all([j.extax is not None for j in jt]):
+            extax=np.vstack([j.extax for j in jt])
+        return mechunits, JointTarget(robax, extax)
+    
+    def get_robtargets(self, mechunits=None, tool='tool0', wobj='wobj0', coordinate='Base'):
+        if mechunits is None:
+            mechunits=self.get_mechunits()
+        rt=self.map_concurrent(lambda m: self.get_robtarget(m, tool, wobj, coordinate), mechunits)
+        return mechunits, RobTarget(*[np.vstack([r[i] for r in rt]) for i in xrange(4)])
+    
+    def map_concurrent(self, f, args):
+        
+        # Runs f over args on a shared pool of 8 threads and returns the
+        # results in order. The requests share the session, so helpers that
+        # issue several independent RWS requests overlap their round trips.
+        
+        if len(args) <= 1:
+            return [f(a) for a in args]
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool=ThreadPool(8)
+            pool=self._pool
+        return pool.map(f, args)
     
     def _rws_value_to_jointtarget(self, val):
-        v1=re.match('^\\[\\[([^\\]]+)\\],\\[([^\\]]+)\\]',val)
-        robax = np.deg2rad(np.fromstring(v1.groups()[0],sep=','))
-        extax = np.deg2rad(np.fromstring(v1.groups()[1],sep=','))
-        return JointTarget(robax,extax)
+        return decode_jointtarget(val)
     
     def _jointtarget_to_rws_value(self, val):
-        assert np.shape(val[0]) == (6,)
-        assert np.shape(val[1]) == (6,)
-        robax=','.join([format(x, '.4f') for x in np.rad2deg(val[0])])
-        extax=','.join([format(x, '.4f') for x in np.rad2deg(val[1])])
-        rws_value="[[" + robax + "],[" + extax + "]]"
-        return rws_value
-    
-    def get_rapid_variable_jointtarget(self, var):
-        v = self.get_rapid_variable(var)
+        return encode_jointtarget(val)
+    
+    def get_rapid_variable_jointtarget(self, var, task='T_ROB1'):
+        v = self.get_rapid_variable(var, task)
         return self._rws_value_to_jointtarget(v)
     
-    def set_rapid_variable_jointtarget(self,var,value):
+    def set_rapid_variable_jointtarget(self,var,value, task='T_ROB1'):
         rws_value=self._jointtarget_to_rws_value(value)
-        self.set_rapid_variable(var, rws_value)
+        self.set_rapid_variable(var, rws_value, task)
             
     def _rws_value_to_jointtarget_array(self,val):
-        m1=re.match('^\\[(.*)\\]$',val)
-        if len(m1.groups()[0])==0:
-            return []
-        arr=[]
-        val1=m1.groups()[0]
-        while len(val1) > 0:
-            m2=re.match('^(\\[\\[[^\\]]+\\],\\[[^\\]]+\\]\\]),?(.*)$',val1)            
-            val1 = m2.groups()[1]
-            arr.append(self._rws_value_to_jointtarget(m2.groups()[0]))
-        
-        return arr       
+        return decode_jointtarget_array(val)
     
     def _jointtarget_array_to_rws_value(self, val):
-        return "[" + ','.join([self._jointtarget_to_rws_value(v) for v in val]) + "]"
+        return encode_jointtarget_array(val)
     
-    def get_rapid_variable_jointtarget_array(self, var):
-        v = self.get_rapid_variable(var)
+    def get_rapid_variable_jointtarget_array(self, var, task='T_ROB1'):
+        v = self.get_rapid_variable(var, task)
         return self._rws_value_to_jointtarget_array(v)
     
-    def set_rapid_variable_jointtarget_array(self,var,value):
+    def set_rapid_variable_jointtarget_array(self,var,value, task='T_ROB1'):
         rws_value=self._jointtarget_array_to_rws_value(value)
-        self.set_rapid_variable(var, rws_value)
+        self.set_rapid_variable(var, rws_value, task)
 
-    def get_rapid_variable_num(self, var):
-        return float(self.get_rapid_variable(var))
+    def get_rapid_variable_num(self, var, task='T_ROB1'):
+        return float(self.get_rapid_variable(var, task))
     
-    def set_rapid_variable_num(self, var, val):
-        self.set_rapid_variable(var, str(val))
+    def set_rapid_variable_num(self, var, val, task='T_ROB1'):
+        self.set_rapid_variable(var, str(val), task)
         
-    def get_rapid_variable_num_array(self, var):
-        val1=self.get_rapid_variable(var)
-        m=re.match("^\\[([^\\]]*)\\]$", val1)
-        val2=m.groups()[0].strip()
-        return np.fromstring(val2,sep=',')
+    def get_rapid_variable_num_array(self, var, task='T_ROB1'):
+        return parse_rapid_num_array(self.get_rapid_variable(var, task))
     
-    def set_rapid_variable_num_array(self, var, val):
-        self.set_rapid_variable(var, "[" + ','.join([str(s) for s in val]) + "]")
+    def set_rapid_variable_num_array(self, var, val, task='T_ROB1'):
+        self.set_rapid_variable(var, format_rapid_num_array(val), task)
     
     
     def read_ipc_message(self, queue_name, timeout=0):
@@ -378,7 +689,11 @@ class RAPID(object):
                 return False
             raise
     
-    def request_rmmp(self, timeout=5):
+    def request_rmmp(self, timeout=5, keep_alive=True):
+        
+        # With keep_alive the grant is held by start_rmmp_keeper() once it
+        # is given, otherwise the caller has to keep calling poll_rmmp()
+        
         t1=time.time()
         self._do_post('users/rmmp', {'privilege': 'modify'})
         while time.time() - t1 < timeout:
@@ -387,6 +702,8 @@ class RAPID(object):
             status=soup.find('span', {'class': 'status'}).text
             if status=="GRANTED":
                 self.poll_rmmp()
+                if keep_alive:
+                    self.start_rmmp_keeper()
                 return
             elif status!="PENDING":
                 raise Exception("User did not grant remote access")                               
@@ -405,24 +722,27 @@ class RAPID(object):
         
         old_rmmp_session=None
         if self._rmmp_session is None:
-            self._do_get(url)
+            self._do_get('users/rmmp/poll')
             self._rmmp_session=requests.Session()
             self._rmmp_session_t=time.time()            
             
             for c in self._session.cookies:
                 self._rmmp_session.cookies.set_cookie(c) 
+            rmmp_session=self._rmmp_session
+        elif time.time() - self._rmmp_session_t > 30:
+            old_rmmp_session=self._rmmp_session
+            rmmp_session=requests.Session()
+            
+            for c in self._session.cookies:
+                rmmp_session.cookies.set_cookie(c)
         else:
-            if time.time() - self._rmmp_session_t > 30:
-                old_rmmp_session=self._rmmp_session
-                rmmp_session=requests.Session()
-                
-                for c in self._session.cookies:
-                    rmmp_session.cookies.set_cookie(c)
-        
-        rmmp_session=self._rmmp_session        
+            rmmp_session=self._rmmp_session
                 
         res=rmmp_session.get(url, auth=self.auth)
-        soup=self._process_response(res)
+        try:
+            soup=self._process_response(res)
+        finally:
+            res.close()
                 
         if old_rmmp_session is not None:
             self._rmmp_session=rmmp_session
@@ -434,6 +754,23 @@ class RAPID(object):
         
         return soup.find('span', {'class': 'status'}).text == "GRANTED"
     
+    def start_rmmp_keeper(self, period=5.0, max_calls=300, rotate_period=30.0, state_callback=None):
+        if self._rmmp_keeper is None:
+            self._rmmp_keeper=RAPIDRmmpKeeper(self, period, max_calls, rotate_period, state_callback)
+            self._rmmp_keeper.start()
+        return self._rmmp_keeper
+    
+    def stop_rmmp_keeper(self):
+        keeper=self._rmmp_keeper
+        self._rmmp_keeper=None
+        if keeper is not None:
+            keeper.stop()
+    
+    def get_rmmp_state(self):
+        if self._rmmp_keeper is None:
+            return None
+        return self._rmmp_keeper.get_state()
+    
     def subscribe_controller_state(self, callback, closed_callback=None):
         payload = {'resources':['1'],             
              '1':'/rw/panel/ctrlstate',
@@ -455,9 +792,9 @@ class RAPID(object):
         
         return self._subscribe(payload, RAPIDExecutionStateSubscription, callback, closed_callback)
      
-    def subscribe_rapid_pers_variable(self, var, callback, closed_callback=None):
+    def subscribe_rapid_pers_variable(self, var, callback, closed_callback=None, task='T_ROB1'):
         payload = {'resources':['1'],             
-             '1':'/rw/rapid/symbol/data/RAPID/T_ROB1/' + var + ';value',
+             '1':'/rw/rapid/symbol/data/RAPID/' + task + '/' + var + ';value',
              '1-p':'1'}
         
         return self._subscribe(payload, RAPIDPersVarSubscription, callback, closed_callback)
@@ -469,9 +806,9 @@ class RAPID(object):
         
         return self._subscribe(payload, RAPIDIpcQueueSubscription, callback, closed_callback)
      
-    def subscribe_event_log(self, callback, closed_callback=None):
+    def subscribe_event_log(self, callback, closed_callback=None, elog=0):
         payload = {'resources':['1'],             
-             '1':'/rw/elog/0',
+             '1':'/rw/elog/' + str(elog),
              '1-p':'1'}
         
         return self._subscribe(payload, RAPIDElogSubscription, callback, closed_callback)
@@ -484,31 +821,272 @@ class RAPID(object):
         return self._subscribe(payload, RAPIDSignalSubscription, callback, closed_callback)
      
     
+    def enable_subscription_engine(self):
+        if self._subscription_engine is None:
+            self._subscription_engine=RAPIDSubscriptionEngine()
+        return self._subscription_engine
     
-    def _subscribe(self, payload, ws_type, callback, closed_callback):    
+    def close_subscription_engine(self):
+        engine=self._subscription_engine
+        self._subscription_engine=None
+        if engine is not None:
+            engine.close()
+    
+    def enable_callback_dispatch(self, workers=1, maxsize=100, block_timeout=1.0, overflow_callback=None):
+        if self._dispatcher is None:
+            self._dispatcher=RAPIDCallbackDispatcher(workers, maxsize, block_timeout, overflow_callback)
+        return self._dispatcher
+    
+    def get_dispatch_stats(self):
+        if self._dispatcher is None:
+            return []
+        return self._dispatcher.stats()
+    
+    def subscribe_group(self, closed_callback=None):
+        return RAPIDSubscriptionGroup(self, closed_callback)
+    
+    def subscribe_managed_group(self, closed_callback=None, reconnect_callback=None, min_backoff=0.5, max_backoff=30.0):
+        return RAPIDManagedSubscriptionGroup(self, closed_callback, reconnect_callback, min_backoff, max_backoff)
+    
+    def _subscription_callback(self, resources, callback, kind=None):
+        
+        # Subscription events mean the resource changed on the controller,
+        # so drop any cached copy before handing the event to the user
+        
+        if callback is not None and self._dispatcher is not None:
+            callback=self._dispatcher.channel(",".join(resources), callback, kind in RAPID_COALESCED_KINDS)
+        
+        def cb(data):
+            for r in resources:
+                if r == 'rw/panel/ctrlstate':
+                    self._ctrlstate=data
+                self._invalidate_cache_resource(r)
+            if callback is not None:
+                callback(data)
+        return cb
+    
+    def _create_subscription(self, payload):
         
+        # Share the controller session cookies so the subscription does not
+        # need its own digest challenge and RWS session
         session=requests.Session()
+        session.cookies=self._session.cookies
         
         url="/".join([self.base_url, "subscription"])
+        t1=time.time()
         res1=session.post(url, data=payload, auth=self.auth)
+        t2=time.time()
         try:
             res=self._process_response(res1)
+            group_url=res1.headers.get('Location', None)
         finally:
             res1.close()        
+            if self._metrics is not None:
+                self._metrics.record('POST', 'subscription', res1.status_code, t2-t1, time.time()-t2, \
+                                     len(res1.content), 0)
         
         ws_url=res.find("a", {"rel": "self"})['href']
-        cookie = 'ABBCX={0}'.format(session.cookies['ABBCX'])
-        header=[('Cookie',cookie), ('Authorization', self.auth.build_digest_header("GET", ws_url))]
-        ws=ws_type(ws_url, ['robapi2_subscription'], header, callback, closed_callback, session)
-        ws.connect()        
+        cookie='; '.join(['{0}={1}'.format(c, session.cookies[c]) for c in RWS_SESSION_COOKIES if c in session.cookies])
+        header=[('Cookie',cookie)]
+        auth_header=self.auth.build_digest_header("GET", ws_url)
+        if auth_header is not None:
+            header.append(('Authorization', auth_header))
+        return session, group_url, ws_url, header
+    
+    def _subscribe(self, payload, ws_type, callback, closed_callback):    
+        
+        resources=[payload[r].split(';')[0].strip('/') for r in payload['resources']]
+        callback=self._subscription_callback(resources, callback, ws_type.kind)
+        
+        if 'rw/panel/ctrlstate' in resources:
+            user_closed_callback=closed_callback
+            live=[True]
+            def ctrlstate_closed():
+                if live[0]:
+                    live[0]=False
+                    self._ctrlstate_subscription_changed(False)
+            def closed_callback():
+                ctrlstate_closed()
+                if user_closed_callback is not None:
+                    user_closed_callback()
+            self._ctrlstate_subscription_changed(True)
+        
+        try:
+            session, group_url, ws_url, header=self._create_subscription(payload)
+            t1=time.time()
+            engine=self._subscription_engine
+            if engine is not None:
+                ws=engine.connect(ws_url, header, session, _kind_extractor(ws_type.kind), callback, closed_callback)
+            else:
+                ws=ws_type(ws_url, ['robapi2_subscription'], header, callback, closed_callback, session)
+                ws.connect()
+        except:
+            if 'rw/panel/ctrlstate' in resources:
+                ctrlstate_closed()
+            raise
+        if self._metrics is not None:
+            self._metrics.record('WS', 'poll/{group}', 101, time.time()-t1, 0.0, 0, 0)
         return ws
 
+_TARGET_SPAN_RE=re.compile(r'<span class="(rax_\d|eax_[a-f]|[xyz]|q\d|cf[146x])">([^<]*)</span>')
+
+def parse_jointtarget_xhtml(text):
+    
+    # Regex over the response text of the mechunit jointtarget resource,
+    # several times faster than BeautifulSoup. Unused external axes are
+    # reported by the controller as 9E+09 and kept as is (in radians,
+    # like decode_jointtarget).
+    
+    v=dict(_TARGET_SPAN_RE.findall(text))
+    try:
+        robax=np.deg2rad([float(v['rax_%d' % (i+1)]) for i in xrange(6)])
+        extax=np.deg2rad([float(v['eax_' + c]) for c in 'abcdef'])
+    except KeyError:
+        raise Exception("Invalid jointtarget returned by robot")
+    return JointTarget(robax, extax)
+
+def parse_robtarget_xhtml(text):
+    v=dict(_TARGET_SPAN_RE.findall(text))
+    try:
+        trans=np.array([float(v[c]) for c in 'xyz'])/1000.0
+        rot=np.array([float(v['q%d' % (i+1)]) for i in xrange(4)])
+        robconf=np.array([float(v[c]) for c in ('cf1','cf4','cf6','cfx')])
+        extax=np.deg2rad([float(v['eax_' + c]) for c in 'abcdef'])
+    except KeyError:
+        raise Exception("Invalid robtarget returned by robot")
+    return RobTarget(trans, rot, robconf, extax)
+
 RAPIDExecutionState=namedtuple('RAPIDExecutionState', ['ctrlexecstate', 'cycle'], verbose=False)
-RAPIDEventLogEntry=namedtuple('RAPIDEventLogEntry', ['msgtype', 'code', 'tstamp', 'args', 'title', 'desc', 'conseqs', 'causes', 'actions'])
+
+class RAPIDEventLogEntry(namedtuple('RAPIDEventLogEntry', ['msgtype', 'code', 'tstamp', 'args', 'title', 'desc', 'conseqs', 'causes', 'actions'])):
+    
+    # seqnum is an attribute outside the tuple, so entries still unpack
+    # into the original nine fields. It is None when not known.
+    
+    seqnum=None
+    
+    def __new__(cls, msgtype, code, tstamp, args, title, desc, conseqs, causes, actions, seqnum=None):
+        self=super(RAPIDEventLogEntry, cls).__new__(cls, msgtype, code, tstamp, args, title, desc, conseqs, causes, actions)
+        self.seqnum=seqnum
+        return self
+
 RAPIDIpcMessage=namedtuple('RAPIDIpcMessage',['data','userdef','msgtype','cmd'])
 RAPIDSignal=namedtuple('RAPIDSignal',['name','lvalue'])
+RAPIDSignalState=namedtuple('RAPIDSignalState', ['name', 'network', 'unit', 'type', 'category', 'lvalue'])
+RAPIDRmmpState=namedtuple('RAPIDRmmpState', ['status', 'granted', 'last_poll', 'polls', 'rotations', 'errors'])
+RAPIDTaskState=namedtuple('RAPIDTaskState', ['name', 'type', 'taskstate', 'excstate', 'active', 'motiontask'])
 
 
+class RAPIDRmmpKeeper(object):
+    
+    # Holds a RMMP grant in the background. The grant is tied to a
+    # persistent connection that the controller drops after 400 calls, so
+    # polls go through a dedicated session that is replaced with a fresh
+    # connection sharing the same cookies after max_calls polls or
+    # rotate_period seconds, before the old one is closed. errors counts
+    # the failed polls since the last successful one.
+    
+    def __init__(self, rapid, period=5.0, max_calls=300, rotate_period=30.0, state_callback=None):
+        self._rapid=rapid
+        self.period=period
+        self.max_calls=max_calls
+        self.rotate_period=rotate_period
+        self._state_callback=state_callback
+        self._session=None
+        self._session_t=None
+        self._session_calls=0
+        self._stop_event=threading.Event()
+        self._granted_event=threading.Event()
+        self._thread=None
+        self.status=None
+        self.last_poll=None
+        self.polls=0
+        self.rotations=0
+        self.errors=0
+    
+    @property
+    def granted(self):
+        return self._granted_event.is_set()
+    
+    def get_state(self):
+        return RAPIDRmmpState(self.status, self.granted, self.last_poll, self.polls, self.rotations, self.errors)
+    
+    def wait_granted(self, timeout=None):
+        return self._granted_event.wait(timeout)
+    
+    def start(self):
+        self._poll()
+        self._thread=threading.Thread(target=self._run, name="rapid_rmmp_keeper")
+        self._thread.daemon=True
+        self._thread.start()
+    
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._session is not None:
+            self._session.close()
+            self._session=None
+    
+    def _run(self):
+        while not self._stop_event.wait(self.period):
+            try:
+                self._poll()
+            except:
+                self.errors+=1
+                self._set_status("ERROR")
+    
+    def _rotate(self):
+        old_session=self._session
+        # Copy the cookies, the RAPID session jar is used by other threads
+        session=requests.Session()
+        for c in self._rapid._session.cookies:
+            session.cookies.set_cookie(c)
+        self._session=session
+        self._session_t=time.time()
+        self._session_calls=0
+        if old_session is not None:
+            self.rotations+=1
+        return old_session
+    
+    def _poll(self):
+        old_session=None
+        if self._session is None or self._session_calls >= self.max_calls \
+            or time.time() - self._session_t > self.rotate_period:
+            old_session=self._rotate()
+        
+        url="/".join([self._rapid.base_url, 'users/rmmp/poll'])
+        try:
+            res=self._session.get(url, auth=self._rapid.auth)
+            try:
+                soup=self._rapid._process_response(res)
+            finally:
+                res.close()
+            self._session_calls+=1
+            self.polls+=1
+            self.last_poll=time.time()
+            self.errors=0
+        finally:
+            # Close the old connection only once the new one has been
+            # used, even if that poll failed, so it is never leaked
+            if old_session is not None:
+                try:
+                    old_session.close()
+                except:
+                    pass
+        
+        self._set_status(soup.find('span', {'class': 'status'}).text)
+    
+    def _set_status(self, status):
+        changed=status != self.status
+        self.status=status
+        if status == "GRANTED":
+            self._granted_event.set()
+        else:
+            self._granted_event.clear()
+        if changed and self._state_callback is not None:
+            self._state_callback(self.get_state())
+
 class ABBException(Exception):
     def __init__(self, message, code):
         super(ABBException, self).__init__(message)
@@ -541,19 +1119,27 @@ class RAPIDSubscriptionClient(WebSocketClient):
         return None
             
 class RAPIDControllerStateSubscription(RAPIDSubscriptionClient):
+    kind='ctrlstate'
+    
     def extract_data(self, soup):
         return soup.find("span", attrs={"class": "ctrlstate"}).text
 
 class RAPIDOpmodeSubscription(RAPIDSubscriptionClient):
+    kind='opmode'
+    
     def extract_data(self, soup):
         return soup.find("span", attrs={"class": "opmode"}).text
     
 class RAPIDExecutionStateSubscription(RAPIDSubscriptionClient):
+    kind='execstate'
+    
     def extract_data(self, soup):
         ctrlexecstate=soup.find('span', attrs={'class': 'ctrlexecstate'}).text        
         return ctrlexecstate
 
 class RAPIDPersVarSubscription(RAPIDSubscriptionClient):
+    kind='persvar'
+    
     def extract_data(self, soup):
         state=soup.find('div', attrs={'class': 'state'})
         ul=state.find('ul')
@@ -562,11 +1148,13 @@ class RAPIDPersVarSubscription(RAPIDSubscriptionClient):
         
         for li in ul.findAll('li'):
             url=li.find('a')['href']
-            m=re.match('^/rw/rapid/symbol/data/RAPID/T_ROB1/(.+);value$', url)
+            m=re.match('^/rw/rapid/symbol/data/RAPID/[^/]+/(.+);value$', url)
             o.append(m.groups()[0])
         return o
     
 class RAPIDIpcQueueSubscription(RAPIDSubscriptionClient):
+    kind='ipc'
+    
     def extract_data(self, soup):
         state=soup.find('div', attrs={'class': 'state'})
         ul=state.find('ul')
@@ -580,6 +1168,8 @@ class RAPIDIpcQueueSubscription(RAPIDSubscriptionClient):
         return o
 
 class RAPIDElogSubscription(RAPIDSubscriptionClient):
+    kind='elog'
+    
     def extract_data(self, soup):
         state=soup.find('div', attrs={'class': 'state'})
         ul=state.find('ul')
@@ -593,6 +1183,8 @@ class RAPIDElogSubscription(RAPIDSubscriptionClient):
         return o
     
 class RAPIDSignalSubscription(RAPIDSubscriptionClient):
+    kind='signal'
+    
     def extract_data(self, soup):
         state=soup.find('div', attrs={'class': 'state'})
         ul=state.find('ul')
@@ -604,3 +1196,491 @@ class RAPIDSignalSubscription(RAPIDSubscriptionClient):
                         
             o.append(RAPIDSignal(name,lvalue))
         return o
+
+
+RAPIDSubscriptionEventItem=namedtuple('RAPIDSubscriptionEventItem', ['cls', 'title', 'href', 'values'])
+
+_EVENT_LI_RE=re.compile(r'<li\b([^>]*)>(.*?)</li>', re.S)
+_EVENT_ATTR_RE=re.compile(r'([\w-]+)="([^"]*)"')
+_EVENT_HREF_RE=re.compile(r'<a\b[^>]*\bhref="([^"]*)"')
+_EVENT_SPAN_RE=re.compile(r'<span\b[^>]*\bclass="([^"]*)"[^>]*>([^<]*)</span>')
+_EVENT_ENTITIES={'&quot;': '"', '&apos;': "'"}
+
+def parse_subscription_event(event_xml):
+    
+    # Single pass over the event text instead of building a BeautifulSoup
+    # tree. Each <li> becomes one item with its class, title, self link
+    # and a dict of span class -> text.
+    
+    o=[]
+    for li in _EVENT_LI_RE.finditer(event_xml):
+        attrs=dict(_EVENT_ATTR_RE.findall(li.group(1)))
+        body=li.group(2)
+        href=_EVENT_HREF_RE.search(body)
+        values={}
+        for m in _EVENT_SPAN_RE.finditer(body):
+            values[m.group(1)]=unescape(m.group(2), _EVENT_ENTITIES)
+        o.append(RAPIDSubscriptionEventItem(attrs.get('class'), unescape(attrs.get('title', ''), _EVENT_ENTITIES), \
+                                            href.group(1) if href is not None else None, values))
+    return o
+
+def _item_ctrlstate(item):
+    return item.values['ctrlstate']
+
+def _item_opmode(item):
+    return item.values['opmode']
+
+def _item_ctrlexecstate(item):
+    return item.values['ctrlexecstate']
+
+def _item_pers_var(item):
+    return item.href.split(';')[0].rsplit('/',1)[-1]
+
+def _item_ipc_data(item):
+    return item.values['dipc-data']
+
+def _item_elog_seqnum(item):
+    return int(item.values['seqnum'])
+
+def _item_signal(item):
+    return RAPIDSignal(item.title, float(item.values['lvalue']))
+
+# Resource kinds for subscription groups: (event extractor, delivers list).
+# List kinds pass every entry of an event to the callback like the
+# single resource subscriptions do, state kinds pass only the latest value.
+RAPID_SUBSCRIPTION_KINDS={
+    'ctrlstate': (_item_ctrlstate, False),
+    'opmode': (_item_opmode, False),
+    'execstate': (_item_ctrlexecstate, False),
+    'persvar': (_item_pers_var, True),
+    'ipc': (_item_ipc_data, True),
+    'elog': (_item_elog_seqnum, True),
+    'signal': (_item_signal, True)
+    }
+
+# State-like kinds where only the latest value matters when callbacks
+# fall behind. Event-like kinds (elog, ipc) are queued instead, and dropped
+# with the dispatcher overflow_callback called if the queue stays full.
+RAPID_COALESCED_KINDS=frozenset(['ctrlstate', 'opmode', 'execstate', 'persvar', 'signal'])
+
+def _kind_extractor(kind):
+    extract, is_list=RAPID_SUBSCRIPTION_KINDS[kind]
+    if is_list:
+        return lambda items: [extract(i) for i in items]
+    return lambda items: extract(items[-1])
+
+RAPIDSubscriptionResource=namedtuple('RAPIDSubscriptionResource', ['url', 'kind', 'callback', 'priority'])
+
+class RAPIDSubscriptionGroupClient(RAPIDSubscriptionClient):
+    def received_message(self, event_xml):
+        if event_xml.is_text:
+            self._callback(parse_subscription_event(event_xml.data))
+        else:
+            print "Received Illegal Event " + str(event_xml)
+
+class RAPIDSubscriptionGroup(object):
+    
+    # Many resources of mixed kinds sharing one RWS subscription group and
+    # one WebSocket. Resources can be added and removed while connected;
+    # the group is modified in place with PUT/DELETE on the group url.
+    
+    def __init__(self, rapid, closed_callback=None):
+        self._rapid=rapid
+        self._closed_callback=closed_callback
+        self._resources={}
+        self._lock=threading.RLock()
+        self._session=None
+        self._group_url=None
+        self._ws=None
+        self._ctrlstate_live=False
+    
+    @property
+    def connected(self):
+        return self._ws is not None
+    
+    @property
+    def resources(self):
+        with self._lock:
+            return list(self._resources.keys())
+    
+    def add_controller_state(self, callback, priority=1):
+        return self.add('/rw/panel/ctrlstate', 'ctrlstate', callback, priority)
+    
+    def add_operation_mode(self, callback, priority=1):
+        return self.add('/rw/panel/opmode', 'opmode', callback, priority)
+    
+    def add_execution_state(self, callback, priority=1):
+        return self.add('/rw/rapid/execution;ctrlexecstate', 'execstate', callback, priority)
+    
+    def add_rapid_pers_variable(self, var, callback, priority=1, task='T_ROB1'):
+        return self.add('/rw/rapid/symbol/data/RAPID/' + task + '/' + var + ';value', 'persvar', callback, priority)
+    
+    def add_ipc_queue(self, queue_name, callback, priority=1):
+        return self.add('/rw/dipc/' + queue_name, 'ipc', callback, priority)
+    
+    def add_event_log(self, callback, elog=0, priority=1):
+        return self.add('/rw/elog/' + str(elog), 'elog', callback, priority)
+    
+    def add_digital_io(self, signal, callback, network='Local', unit='DRV_1', priority=1):
+        return self.add('/rw/iosystem/signals/' + network + '/' + unit + '/' + signal + ';state', 'signal', callback, priority)
+    
+    def add(self, url, kind, callback, priority=1):
+        if kind not in RAPID_SUBSCRIPTION_KINDS:
+            raise ValueError("Unknown subscription resource kind: " + kind)
+        path=url.split(';')[0].strip('/')
+        r=RAPIDSubscriptionResource(url, kind, self._rapid._subscription_callback([path], callback, kind), priority)
+        with self._lock:
+            if path in self._resources:
+                raise ValueError("Resource already subscribed: " + path)
+            if self._ws is not None:
+                self._request('put', self._group_url, self._payload([r]))
+            self._resources[path]=r
+            self._update_ctrlstate_live()
+        return path
+    
+    def remove(self, path):
+        path=path.split(';')[0].strip('/')
+        with self._lock:
+            r=self._resources[path]
+            # Only forget the resource once the controller has stopped
+            # sending its events, so a failed DELETE can be retried
+            if self._ws is not None:
+                self._request('delete', self._group_url + '/' + r.url.lstrip('/'))
+            del self._resources[path]
+            self._update_ctrlstate_live()
+    
+    def start(self):
+        with self._lock:
+            if self._ws is not None:
+                return
+            if len(self._resources) == 0:
+                raise Exception("Subscription group has no resources")
+            session, group_url, ws_url, header=self._rapid._create_subscription(self._payload(self._resources.values()))
+            if group_url is None:
+                raise Exception("Robot did not return subscription group location")
+            engine=self._rapid._subscription_engine
+            if engine is not None:
+                ws=engine.connect(ws_url, header, session, None, self._dispatch, self._closed)
+            else:
+                ws=RAPIDSubscriptionGroupClient(ws_url, ['robapi2_subscription'], header, self._dispatch, \
+                                                self._closed, session)
+                ws.connect()
+            self._session=session
+            self._group_url=group_url
+            self._ws=ws
+            self._update_ctrlstate_live()
+    
+    def close(self):
+        with self._lock:
+            ws=self._ws
+        if ws is not None:
+            ws.close()
+    
+    def _payload(self, resources):
+        payload={'resources': []}
+        for i, r in enumerate(resources):
+            n=str(i+1)
+            payload['resources'].append(n)
+            payload[n]=r.url
+            payload[n + '-p']=str(r.priority)
+        return payload
+    
+    def _request(self, method, url, payload=None):
+        res1=self._session.request(method, url, data=payload, auth=self._rapid.auth)
+        try:
+            return self._rapid._process_response(res1)
+        finally:
+            res1.close()
+    
+    def _update_ctrlstate_live(self):
+        live=self._ws is not None and 'rw/panel/ctrlstate' in self._resources
+        if live != self._ctrlstate_live:
+            self._ctrlstate_live=live
+            self._rapid._ctrlstate_subscription_changed(live)
+    
+    def _closed(self):
+        with self._lock:
+            self._ws=None
+            self._group_url=None
+            self._session=None
+            self._update_ctrlstate_live()
+        if self._closed_callback is not None:
+            self._closed_callback()
+    
+    def _match(self, href):
+        path=href.split(';')[0].split('?')[0].strip('/')
+        best=None
+        with self._lock:
+            r=self._resources.get(path, None)
+            if r is not None:
+                return r
+            for p, r in self._resources.items():
+                if path.startswith(p + '/') and (best is None or len(p) > len(best[0])):
+                    best=(p, r)
+        return best[1] if best is not None else None
+    
+    def _dispatch(self, items):
+        events=[]
+        for item in items:
+            if item.href is None:
+                continue
+            r=self._match(item.href)
+            if r is None:
+                continue
+            extract, is_list=RAPID_SUBSCRIPTION_KINDS[r.kind]
+            data=extract(item)
+            for e in events:
+                if e[0] is r:
+                    if is_list:
+                        e[1].append(data)
+                    else:
+                        e[1]=data
+                    break
+            else:
+                events.append([r, [data] if is_list else data])
+        
+        for r, data in events:
+            self._deliver(r, data)
+    
+    def _deliver(self, r, data):
+        try:
+            r.callback(data)
+        except:
+            traceback.print_exc()
+
+RAPIDReconnectStats=namedtuple('RAPIDReconnectStats', ['reconnects', 'failed_attempts', 'last_reconnect_latency', \
+                                                       'last_gap', 'max_gap', 'total_gap'])
+
+class RAPIDManagedSubscriptionGroup(RAPIDSubscriptionGroup):
+    
+    # Subscription group that survives socket loss. When the socket closes
+    # the group is recreated with exponential backoff, then the current
+    # value of every resource is read once over HTTP and delivered to its
+    # callback so no state change is missed during the gap.
+    
+    def __init__(self, rapid, closed_callback=None, reconnect_callback=None, min_backoff=0.5, max_backoff=30.0):
+        super(RAPIDManagedSubscriptionGroup,self).__init__(rapid, closed_callback)
+        self._reconnect_callback=reconnect_callback
+        self.min_backoff=min_backoff
+        self.max_backoff=max_backoff
+        self._stop_event=threading.Event()
+        self._elog_seqnum={}
+        self._elog_resync_from={}
+        self._elog_delivered={}
+        self.reconnects=0
+        self.failed_attempts=0
+        self.last_reconnect_latency=None
+        self.last_gap=None
+        self.max_gap=0.0
+        self.total_gap=0.0
+    
+    def get_reconnect_stats(self):
+        return RAPIDReconnectStats(self.reconnects, self.failed_attempts, self.last_reconnect_latency, \
+                                   self.last_gap, self.max_gap, self.total_gap)
+    
+    def start(self):
+        super(RAPIDManagedSubscriptionGroup,self).start()
+        
+        # Remember where each event log stood when it was first subscribed,
+        # so entries written while a later reconnect is pending can be found
+        with self._lock:
+            paths=[p for p, r in self._resources.items() if r.kind == 'elog' and p not in self._elog_seqnum]
+        for path in paths:
+            try:
+                self._record_elog_seqnum(path)
+            except:
+                traceback.print_exc()
+    
+    def add(self, url, kind, callback, priority=1):
+        path=super(RAPIDManagedSubscriptionGroup,self).add(url, kind, callback, priority)
+        if kind == 'elog' and self.connected:
+            self._record_elog_seqnum(path)
+        return path
+    
+    def close(self):
+        self._stop_event.set()
+        super(RAPIDManagedSubscriptionGroup,self).close()
+    
+    def _closed(self):
+        t_closed=time.time()
+        with self._lock:
+            # Where each event log stood when the socket was lost, and what
+            # is delivered from then on, so the resync neither skips entries
+            # nor repeats ones already delivered by live events
+            self._elog_resync_from=dict(self._elog_seqnum)
+            self._elog_delivered=dict([(p, set()) for p in self._elog_seqnum])
+        super(RAPIDManagedSubscriptionGroup,self)._closed()
+        if self._stop_event.is_set():
+            return
+        t=threading.Thread(target=self._reconnect, args=(t_closed,), name="rapid_subscription_reconnect")
+        t.daemon=True
+        t.start()
+    
+    def _reconnect(self, t_closed):
+        delay=self.min_backoff
+        t1=time.time()
+        while not self._stop_event.is_set():
+            try:
+                self.start()
+                break
+            except:
+                self.failed_attempts+=1
+            self._stop_event.wait(delay*(0.5 + 0.5*random.random()))
+            delay=min(delay*2, self.max_backoff)
+        else:
+            return
+        t2=time.time()
+        
+        with self._lock:
+            resources=list(self._resources.items())
+        for path, r in resources:
+            try:
+                self._resync(path, r)
+            except:
+                traceback.print_exc()
+        t3=time.time()
+        
+        self.reconnects+=1
+        self.last_reconnect_latency=t2-t1
+        self.last_gap=t3-t_closed
+        self.max_gap=max(self.max_gap, self.last_gap)
+        self.total_gap+=self.last_gap
+        if self._reconnect_callback is not None:
+            self._reconnect_callback(self.get_reconnect_stats())
+    
+    def _resync(self, path, r):
+        rapid=self._rapid
+        rapid._invalidate_cache_resource(path)
+        if r.kind == 'ctrlstate':
+            data=rapid.get_controller_state()
+        elif r.kind == 'opmode':
+            data=rapid.get_operation_mode()
+        elif r.kind == 'execstate':
+            data=rapid.get_execution_state().ctrlexecstate
+        elif r.kind == 'persvar':
+            # Like the subscription events, only the name is delivered and
+            # the callback reads the current value itself
+            data=[path.rsplit('/',1)[-1]]
+        elif r.kind == 'signal':
+            # Named by network/unit/signal like the title of live events
+            name=path[len('rw/iosystem/signals/'):]
+            data=[RAPIDSignal(name, float(rapid._get_signal_lvalue(name)))]
+        elif r.kind == 'elog':
+            with self._lock:
+                last=self._elog_resync_from.get(path, None)
+                if last is None:
+                    self._record_elog_seqnum(path)
+                    return
+                delivered=self._elog_delivered.get(path, set())
+                data=[s for s in self._elog_seqnums(path, last) if s > last and s not in delivered]
+                if len(data) > 0:
+                    self._deliver(r, data)
+                del self._elog_resync_from[path]
+            return
+        else:
+            # DIPC messages stay queued on the controller while disconnected
+            return
+        self._deliver(r, data)
+    
+    def _elog_seqnums(self, path, last=None, limit=50):
+        
+        # Sequence numbers of the event log, newest page first. Without last
+        # only the first page is read; otherwise pages are followed until
+        # an entry at or before last is reached.
+        
+        o=[]
+        start=0
+        while True:
+            soup=self._rapid._do_get(path + "?lang=en&start=%d&limit=%d" % (start, limit), False)
+            page=[]
+            for li in soup.findAll('li', attrs={'class': 'elog-message-li'}):
+                a=li.find('a', attrs={'rel': 'self'})
+                if a is not None:
+                    page.append(int(a['href'].split('?')[0].rstrip('/').rsplit('/',1)[-1]))
+            o.extend(page)
+            if last is None or len(page) == 0 or min(page) <= last \
+                or soup.find('a', attrs={'rel': 'next'}) is None:
+                break
+            start+=limit
+        return sorted(o)
+    
+    def _record_elog_seqnum(self, path):
+        with self._lock:
+            seqnums=self._elog_seqnums(path)
+            self._elog_seqnum[path]=max(seqnums + [self._elog_seqnum.get(path, 0)])
+    
+    def _deliver(self, r, data):
+        if r.kind != 'elog':
+            super(RAPIDManagedSubscriptionGroup,self)._deliver(r, data)
+            return
+        path=r.url.split(';')[0].strip('/')
+        with self._lock:
+            delivered=self._elog_delivered.get(path, None)
+            if delivered is not None:
+                data=[s for s in data if s not in delivered]
+                if path not in self._elog_resync_from and len(data) > 0 \
+                    and min(data) > max(list(delivered) + [0]):
+                    # Resync done and live events have moved past it
+                    del self._elog_delivered[path]
+                else:
+                    delivered.update(data)
+            if len(data) == 0:
+                return
+            self._elog_seqnum[path]=max(data + [self._elog_seqnum.get(path, 0)])
+            super(RAPIDManagedSubscriptionGroup,self)._deliver(r, data)
+
+class RAPIDEngineSubscriptionClient(WebSocketBaseClient):
+    
+    def __init__(self, ws_url, protocols, headers, extract, callback, closed_callback, session):
+        super(RAPIDEngineSubscriptionClient,self).__init__(ws_url, protocols=protocols, headers=headers)
+        self._extract=extract
+        self._callback=callback
+        self._closed_callback=closed_callback
+        self._session=session
+        self.event_count=0
+    
+    def closed(self, code, reason=None):
+        if self._closed_callback is not None:
+            self._closed_callback()
+    
+    def received_message(self, event_xml):
+        if not event_xml.is_text:
+            print "Received Illegal Event " + str(event_xml)
+            return
+        items=parse_subscription_event(event_xml.data)
+        if len(items) == 0:
+            return
+        self.event_count+=1
+        data=items if self._extract is None else self._extract(items)
+        # Callbacks run on the shared engine thread, so one failing
+        # callback must not take down every other subscription
+        try:
+            self._callback(data)
+        except:
+            traceback.print_exc()
+
+class RAPIDSubscriptionEngine(object):
+    
+    # Serves every WebSocket subscription of a RAPID instance from one
+    # ws4py WebSocketManager thread polling all sockets, instead of one
+    # WebSocketClient thread per subscription.
+    
+    def __init__(self):
+        self._manager=WebSocketManager()
+        self._manager.start()
+    
+    def connect(self, ws_url, headers, session, extract, callback, closed_callback):
+        ws=RAPIDEngineSubscriptionClient(ws_url, ['robapi2_subscription'], headers, extract, callback, \
+                                         closed_callback, session)
+        ws.connect()
+        self._manager.add(ws)
+        return ws
+    
+    @property
+    def subscription_count(self):
+        return len(self._manager)
+    
+    def close(self):
+        self._manager.close_all()
+        self._manager.stop()
+        self._manager.join()
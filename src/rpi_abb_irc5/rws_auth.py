@@ -0,0 +1,149 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import hashlib
+import os
+import re
+import threading
+from binascii import hexlify
+from urlparse import urlparse
+from collections import namedtuple
+from requests.auth import AuthBase
+from requests.utils import parse_dict_header
+from requests.cookies import extract_cookies_to_jar
+
+RWSAuthStats=namedtuple('RWSAuthStats', ['requests', 'challenges', 'avoided_challenges'])
+
+RWS_SESSION_COOKIES=('ABBCX', '-http-session-')
+
+class RWSDigestAuth(AuthBase):
+    
+    # Digest auth for RWS that shares one challenge between all threads
+    # and sessions of a RAPID instance. Requests that already carry the
+    # controller session cookie are sent without an Authorization header,
+    # otherwise the cached nonce is reused with an incrementing nc, so a
+    # 401 round-trip is only needed when the session or nonce expires.
+    
+    def __init__(self, username, password):
+        self.username=username
+        self.password=password
+        self._lock=threading.Lock()
+        self._chal=None
+        self._nonce_count=0
+        self.requests=0
+        self.challenges=0
+        self.avoided_challenges=0
+    
+    def get_stats(self):
+        with self._lock:
+            return RWSAuthStats(self.requests, self.challenges, self.avoided_challenges)
+    
+    def build_digest_header(self, method, url):
+        with self._lock:
+            chal=self._chal
+            if chal is None:
+                return None
+            self._nonce_count+=1
+            nc='%08x' % self._nonce_count
+        
+        realm=chal['realm']
+        nonce=chal['nonce']
+        qop=chal.get('qop')
+        opaque=chal.get('opaque')
+        
+        p=urlparse(url)
+        path=p.path or '/'
+        if p.query:
+            path+='?' + p.query
+        
+        ha1=_md5('%s:%s:%s' % (self.username, realm, self.password))
+        ha2=_md5('%s:%s' % (method, path))
+        cnonce=hexlify(os.urandom(8))
+        
+        if qop is None:
+            response=_md5('%s:%s:%s' % (ha1, nonce, ha2))
+        elif 'auth' in qop.split(','):
+            response=_md5('%s:%s:%s:%s:auth:%s' % (ha1, nonce, nc, cnonce, ha2))
+        else:
+            return None
+        
+        h='username="%s", realm="%s", nonce="%s", uri="%s", response="%s"' % \
+            (self.username, realm, nonce, path, response)
+        if opaque:
+            h+=', opaque="%s"' % opaque
+        h+=', algorithm="MD5"'
+        if qop is not None:
+            h+=', qop="auth", nc=%s, cnonce="%s"' % (nc, cnonce)
+        return 'Digest ' + h
+    
+    def __call__(self, r):
+        if not _has_session_cookie(r.headers.get('Cookie', '')):
+            h=self.build_digest_header(r.method, r.url)
+            if h is not None:
+                r.headers['Authorization']=h
+        r.register_hook('response', self.handle_response)
+        return r
+    
+    def handle_response(self, r, **kwargs):
+        if r.status_code != 401:
+            preemptive='Authorization' in r.request.headers or _has_session_cookie(r.request.headers.get('Cookie', ''))
+            with self._lock:
+                self.requests+=1
+                if preemptive:
+                    self.avoided_challenges+=1
+            return r
+        
+        s_auth=r.headers.get('www-authenticate', '')
+        if 'digest' not in s_auth.lower():
+            return r
+        
+        with self._lock:
+            self._chal=parse_dict_header(re.sub(r'(?i)digest ', '', s_auth, count=1))
+            self._nonce_count=0
+            self.requests+=1
+            self.challenges+=1
+        
+        # Same as requests.auth.HTTPDigestAuth.handle_401: resend once on
+        # the same connection. Hooks are not dispatched for the resend.
+        r.content
+        r.close()
+        prep=r.request.copy()
+        extract_cookies_to_jar(prep._cookies, r.request, r.raw)
+        prep.prepare_cookies(prep._cookies)
+        prep.headers['Authorization']=self.build_digest_header(prep.method, prep.url)
+        _r=r.connection.send(prep, **kwargs)
+        _r.history.append(r)
+        _r.request=prep
+        return _r
+
+def _has_session_cookie(cookie):
+    return any([(c + '=') in cookie for c in RWS_SESSION_COOKIES])
+
+def _md5(s):
+    return hashlib.md5(s).hexdigest()
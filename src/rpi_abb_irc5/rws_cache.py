@@ -0,0 +1,125 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+RWSCacheStats=namedtuple('RWSCacheStats', ['hits', 'misses', 'evictions', 'invalidations', 'entries'])
+
+class RWSCache(object):
+    
+    # Response cache for slow-changing RWS resources. Entries are keyed
+    # by relative url (including the query string), expire after a
+    # per-resource TTL selected by longest matching path prefix, and are
+    # evicted least recently used first once max_entries is reached.
+    
+    def __init__(self, max_entries=256, default_ttl=0):
+        self.max_entries=max_entries
+        self.default_ttl=default_ttl
+        self._ttls={}
+        self._entries=OrderedDict()
+        self._lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.invalidations=0
+    
+    def set_ttl(self, prefix, ttl, condition=None):
+        with self._lock:
+            self._ttls[prefix.strip('/')]=(ttl, condition)
+    
+    def clear_ttl(self, prefix):
+        with self._lock:
+            self._ttls.pop(prefix.strip('/'), None)
+    
+    def ttl(self, key):
+        path=key.split('?')[0].strip('/')
+        best=None
+        for prefix, rule in self._ttls.items():
+            if path==prefix or path.startswith(prefix + '/'):
+                if best is None or len(prefix) > len(best[0]):
+                    best=(prefix, rule)
+        if best is None:
+            return self.default_ttl
+        ttl, condition=best[1]
+        if condition is not None and not condition():
+            return 0
+        return ttl
+    
+    def get(self, key):
+        with self._lock:
+            entry=self._entries.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                self._entries[key]=entry
+                self.hits+=1
+                return True, entry[1]
+            self.misses+=1
+            return False, None
+    
+    def put(self, key, value, ttl=None):
+        if ttl is None:
+            ttl=self.ttl(key)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key]=(time.time() + ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions+=1
+    
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                n=len(self._entries)
+                self._entries.clear()
+                self.invalidations+=n
+                return n
+            path=path.split('?')[0].strip('/')
+            keys=[k for k in self._entries if _key_matches(k, path)]
+            for k in keys:
+                del self._entries[k]
+            self.invalidations+=len(keys)
+            return len(keys)
+    
+    def stats(self):
+        with self._lock:
+            return RWSCacheStats(self.hits, self.misses, self.evictions, self.invalidations, len(self._entries))
+    
+    def reset_stats(self):
+        with self._lock:
+            self.hits=0
+            self.misses=0
+            self.evictions=0
+            self.invalidations=0
+
+def _key_matches(key, path):
+    key_path=key.split('?')[0].strip('/')
+    return key_path==path or key_path.startswith(path + '/')
@@ -0,0 +1,193 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import bisect
+import re
+import threading
+import time
+from collections import namedtuple, deque
+
+# Upper bucket edges in seconds, 100 us doubling up to about 13 s
+RWS_LATENCY_BUCKETS=tuple([0.0001 * 2**i for i in xrange(18)])
+
+# Endpoint templates, first match wins. The query string is dropped except
+# for the action parameter.
+RWS_ENDPOINT_TEMPLATES=[
+    (re.compile(r'^rw/rapid/symbol/data/RAPID/[^/]+/[^/]+/[^/]+$'), 'rw/rapid/symbol/data/RAPID/{task}/{module}/{var}'),
+    (re.compile(r'^rw/rapid/symbol/data/RAPID/[^/]+/[^/]+$'), 'rw/rapid/symbol/data/RAPID/{task}/{var}'),
+    (re.compile(r'^rw/rapid/symbol/properties/RAPID/[^/]+/.+$'), 'rw/rapid/symbol/properties/RAPID/{task}/{var}'),
+    (re.compile(r'^rw/iosystem/signals/[^/]+/[^/]+/[^/]+$'), 'rw/iosystem/signals/{network}/{unit}/{signal}'),
+    (re.compile(r'^rw/motionsystem/mechunits/[^/]+/([^/]+)$'), 'rw/motionsystem/mechunits/{mechunit}/\\1'),
+    (re.compile(r'^rw/elog/\d+/\d+$'), 'rw/elog/{domain}/{seqnum}'),
+    (re.compile(r'^rw/elog/\d+$'), 'rw/elog/{domain}'),
+    (re.compile(r'^rw/dipc/[^/]+$'), 'rw/dipc/{queue}'),
+    (re.compile(r'^subscription/.+$'), 'subscription/{group}')
+    ]
+
+_ACTION_RE=re.compile(r'(?:^|&)action=([^&]*)')
+
+def endpoint_template(relative_url):
+    path, _, query=relative_url.partition('?')
+    path=path.strip('/')
+    for r, template in RWS_ENDPOINT_TEMPLATES:
+        if r.match(path):
+            path=r.sub(template, path)
+            break
+    m=_ACTION_RE.search(query)
+    if m is not None:
+        path+='?action=' + m.group(1)
+    return path
+
+RWSHistogramSnapshot=namedtuple('RWSHistogramSnapshot', ['count', 'sum', 'max', 'buckets'])
+RWSEndpointStats=namedtuple('RWSEndpointStats', ['method', 'endpoint', 'count', 'status', 'bytes_in', 'bytes_out', \
+                                                 'network', 'parse', 'total'])
+RWSTraceRecord=namedtuple('RWSTraceRecord', ['time', 'method', 'url', 'status', 'network', 'parse', 'bytes_in'])
+
+class RWSLatencyHistogram(object):
+    
+    def __init__(self):
+        self.counts=[0]*(len(RWS_LATENCY_BUCKETS) + 1)
+        self.count=0
+        self.sum=0.0
+        self.max=0.0
+    
+    def add(self, dt):
+        self.counts[bisect.bisect_left(RWS_LATENCY_BUCKETS, dt)]+=1
+        self.count+=1
+        self.sum+=dt
+        if dt > self.max:
+            self.max=dt
+    
+    def snapshot(self):
+        return RWSHistogramSnapshot(self.count, self.sum, self.max, list(self.counts))
+
+def histogram_percentile(h, p):
+    
+    # Upper bucket edge at percentile p (0-100) of a histogram snapshot
+    
+    if h.count == 0:
+        return None
+    target=h.count * p / 100.0
+    n=0
+    for i, c in enumerate(h.buckets):
+        n+=c
+        if n >= target:
+            return RWS_LATENCY_BUCKETS[i] if i < len(RWS_LATENCY_BUCKETS) else h.max
+    return h.max
+
+class _RWSEndpoint(object):
+    def __init__(self):
+        self.status={}
+        self.bytes_in=0
+        self.bytes_out=0
+        self.network=RWSLatencyHistogram()
+        self.parse=RWSLatencyHistogram()
+        self.total=RWSLatencyHistogram()
+
+class RWSMetrics(object):
+    
+    # Latency, status and transfer statistics of RAPID HTTP calls grouped
+    # by method and endpoint template. RAPID only calls record() while
+    # metrics are enabled, so the disabled cost is one attribute check.
+    
+    def __init__(self, trace_size=0):
+        self._lock=threading.Lock()
+        self._endpoints={}
+        self._exporters=[]
+        self._trace=deque(maxlen=trace_size) if trace_size > 0 else None
+        self._export_thread=None
+        self._export_stop=threading.Event()
+    
+    def record(self, method, relative_url, status, network, parse, bytes_in, bytes_out):
+        key=(method, endpoint_template(relative_url))
+        with self._lock:
+            e=self._endpoints.get(key, None)
+            if e is None:
+                e=_RWSEndpoint()
+                self._endpoints[key]=e
+            e.status[status]=e.status.get(status, 0) + 1
+            e.bytes_in+=bytes_in
+            e.bytes_out+=bytes_out
+            e.network.add(network)
+            e.parse.add(parse)
+            e.total.add(network + parse)
+            if self._trace is not None:
+                self._trace.append(RWSTraceRecord(time.time(), method, relative_url, status, network, parse, bytes_in))
+    
+    def snapshot(self):
+        with self._lock:
+            return [RWSEndpointStats(k[0], k[1], e.total.count, dict(e.status), e.bytes_in, e.bytes_out, \
+                                     e.network.snapshot(), e.parse.snapshot(), e.total.snapshot()) \
+                    for k, e in sorted(self._endpoints.items())]
+    
+    def trace(self):
+        with self._lock:
+            return list(self._trace) if self._trace is not None else []
+    
+    def reset(self):
+        with self._lock:
+            self._endpoints={}
+            if self._trace is not None:
+                self._trace.clear()
+    
+    def add_exporter(self, exporter):
+        self._exporters.append(exporter)
+    
+    def export(self):
+        s=self.snapshot()
+        for exporter in self._exporters:
+            exporter(s)
+        return s
+    
+    def start_export(self, period=10.0):
+        if self._export_thread is not None:
+            return
+        self._export_stop.clear()
+        def run():
+            while not self._export_stop.wait(period):
+                self.export()
+        self._export_thread=threading.Thread(target=run, name="rws_metrics_export")
+        self._export_thread.daemon=True
+        self._export_thread.start()
+    
+    def stop_export(self):
+        self._export_stop.set()
+        if self._export_thread is not None:
+            self._export_thread.join()
+            self._export_thread=None
+
+def format_metrics(snapshot):
+    lines=["%-6s %-52s %7s %9s %9s %9s %9s %10s" % ('method', 'endpoint', 'count', 'p50 ms', 'p99 ms', 'net ms', \
+                                                    'parse ms', 'bytes in')]
+    for s in snapshot:
+        n=max(s.count, 1)
+        lines.append("%-6s %-52s %7d %9.2f %9.2f %9.2f %9.2f %10d" % (s.method, s.endpoint, s.count, \
+            1e3*(histogram_percentile(s.total, 50) or 0), 1e3*(histogram_percentile(s.total, 99) or 0), \
+            1e3*s.network.sum/n, 1e3*s.parse.sum/n, s.bytes_in))
+    return '\n'.join(lines)
@@ -0,0 +1,977 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import threading
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from collections import namedtuple, deque
+from datetime import datetime
+from urlparse import parse_qs
+from xml.sax.saxutils import escape, quoteattr
+import numpy as np
+from requests.utils import parse_dict_header
+from ws4py import WS_KEY
+from ws4py.websocket import WebSocket
+from ws4py.manager import WebSocketManager
+from .rapid_codec import RAPID_CODECS, decode_rapid_value, decode_jointtarget_array
+
+# Stand-in for the RWS server of an IRC5 controller, for exercising RAPID,
+# the subscription classes and the ROS nodes without a robot. Resources
+# are rendered in the same XHTML layout the controller uses, or as JSON
+# with ?json=1.
+
+RWSMockStats=namedtuple('RWSMockStats', ['requests', 'rejected', 'challenges', 'sessions', 'events'])
+
+RWS_MOCK_ERR_NOT_FOUND=-1073442816
+RWS_MOCK_ERR_INVALID_VALUE=-1073442811
+RWS_MOCK_ERR_DIPC_QUEUE_EXISTS=-1073445879
+RWS_MOCK_ERR_BUSY=-1073741823
+
+_EXTAX_UNUSED='9E+09'
+
+_DEFAULT_VALUES={'num': '0', 'dnum': '0', 'bool': 'FALSE', 'string': '""', \
+                 'jointtarget': '[[0,0,0,0,0,0],[9E+09,9E+09,9E+09,9E+09,9E+09,9E+09]]'}
+
+_DECLARATION_RE=re.compile(r'^\s*(?:LOCAL\s+|TASK\s+)?(PERS|VAR|CONST)\s+(\w+)\s+(\w+)\s*(?:\{([\d,\s]+)\})?\s*(?::=\s*(.*?))?\s*;', re.M)
+_ROUTINE_RE=re.compile(r'^\s*(?:LOCAL\s+)?(?:PROC|FUNC|TRAP)\b', re.M)
+_MODULE_RE=re.compile(r'^\s*MODULE\s+(\w+)', re.M)
+
+def _default_value(datatype, dims):
+    v=_DEFAULT_VALUES.get(datatype, '0')
+    if dims is None:
+        return v
+    for d in reversed(dims):
+        v='[' + ','.join([v]*d) + ']'
+    return v
+
+class RWSMockError(Exception):
+    def __init__(self, status, code, message):
+        super(RWSMockError, self).__init__(message)
+        self.status=status
+        self.code=code
+
+class RWSMockSymbol(object):
+    def __init__(self, task, module, name, symtyp, datatype, dims, value):
+        self.task=task
+        self.module=module
+        self.name=name
+        self.symtyp=symtyp
+        self.datatype=datatype
+        self.dims=dims
+        self.value=value
+    
+    @property
+    def symburl(self):
+        return 'RAPID/' + self.task + '/' + self.module + '/' + self.name
+    
+    @property
+    def resource(self):
+        return 'rw/rapid/symbol/data/RAPID/' + self.task + '/' + self.name
+
+class RWSMockController(object):
+    
+    # Controller state behind RWSMockServer. Every change is reported to
+    # the listeners as (resource, event item) so the server can forward it
+    # to WebSocket subscriptions. When rpi_abb_irc5_rapid.mod is loaded
+    # and RAPID is running, the main loop of the module is emulated:
+    # JointTrajectoryCount points are executed one MoveAbsJ at a time,
+    # CurrentJointTrajectoryCount and the joint positions follow, and the
+    # IPers traps abort the motion when a trajectory variable changes.
+    # Streaming mode (-2000) reads the buffers as a ring of 100 points.
+    
+    def __init__(self, rapid_modules=None, mechunits=('ROB_1',), tasks=('T_ROB1',), step=0.01):
+        self._lock=threading.RLock()
+        self._listeners=[]
+        self.ctrlexecstate='stopped'
+        self.cycle='forever'
+        self.ctrlstate='motoron'
+        self.opmode='AUTO'
+        self.tasks=list(tasks)
+        self.mechunits=dict([(m, np.zeros((6,))) for m in mechunits])
+        self.symbols={}
+        self.signals={}
+        self.elog={0: []}
+        self._elog_seqnum=0
+        self.dipc_queues={}
+        self._dipc_cond=threading.Condition(self._lock)
+        self.rmmp_status='NOT_REQUESTED'
+        self.rmmp_grant_delay=0.0
+        self._rmmp_t=None
+        self.step=step
+        self._motion=None
+        self._stop_event=threading.Event()
+        self._thread=None
+        
+        if rapid_modules is None:
+            default=os.path.join(os.path.dirname(__file__), '..', '..', 'rapid', 'rpi_abb_irc5_rapid.mod')
+            rapid_modules=[default] if os.path.isfile(default) else []
+        for m in rapid_modules:
+            self.load_rapid_module(m)
+        for s in ('DO1', 'DO2', 'DI1', 'DI2', 'AO1', 'AI1', 'GO1', 'GI1'):
+            self.add_signal('Local/DRV_1/' + s, s[:2])
+    
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+    
+    def _changed(self, resource, cls, title, href, spans):
+        item=(cls, title, href, spans)
+        for l in self._listeners:
+            l(resource, item)
+    
+    def start(self):
+        self._stop_event.clear()
+        self._thread=threading.Thread(target=self._run, name="rws_mock_motion")
+        self._thread.daemon=True
+        self._thread.start()
+    
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread=None
+    
+    def load_rapid_module(self, path, task='T_ROB1'):
+        with open(path, 'r') as f:
+            text=f.read()
+        module=_MODULE_RE.search(text).group(1)
+        
+        # Only module level data, not the local variables of routines
+        r=_ROUTINE_RE.search(text)
+        if r is not None:
+            text=text[:r.start()]
+        for m in _DECLARATION_RE.finditer(text):
+            storage, datatype, name, dims, value=m.groups()
+            if dims is not None:
+                dims=[int(d) for d in dims.replace(',', ' ').split()]
+            symtyp={'PERS': 'per', 'VAR': 'var', 'CONST': 'con'}[storage]
+            self.declare(name, datatype, dims, value, module, task, symtyp)
+        return module
+    
+    def declare(self, name, datatype, dims=None, value=None, module='user', task='T_ROB1', symtyp='per'):
+        if value is None:
+            value=_default_value(datatype, dims)
+        with self._lock:
+            self.symbols[(task, name)]=RWSMockSymbol(task, module, name, symtyp, datatype, dims, value)
+    
+    def find_symbol(self, task, var):
+        parts=var.split('/')
+        with self._lock:
+            s=self.symbols.get((task, parts[-1]), None)
+        if s is None or len(parts) > 2 or (len(parts) == 2 and parts[0] != s.module):
+            raise RWSMockError(400, RWS_MOCK_ERR_NOT_FOUND, "RAPID symbol not found: " + task + "/" + var)
+        return s
+    
+    def get_symbol_value(self, task, var):
+        return self.find_symbol(task, var).value
+    
+    def set_symbol_value(self, task, var, value, check=True):
+        s=self.find_symbol(task, var)
+        if s.symtyp == 'con':
+            raise RWSMockError(400, RWS_MOCK_ERR_INVALID_VALUE, "RAPID symbol is read only: " + s.name)
+        if check and s.datatype in RAPID_CODECS:
+            try:
+                decode_rapid_value(value, s.datatype, s.dims)
+            except Exception:
+                raise RWSMockError(400, RWS_MOCK_ERR_INVALID_VALUE, "Invalid value for RAPID symbol " + s.name)
+        with self._lock:
+            s.value=value
+            self._symbol_changed(s)
+        self._changed(s.resource, 'rap-value-ev', s.name, '/' + s.resource + ';value', [])
+    
+    def add_signal(self, path, sigtype='DO', lvalue=0, category=''):
+        with self._lock:
+            # lvalue None lists the signal without a value, as the
+            # controller does for signals it cannot read
+            self.signals[path]={'type': sigtype, 'lvalue': str(lvalue) if lvalue is not None else None, \
+                                'category': category}
+    
+    def set_signal(self, path, lvalue):
+        with self._lock:
+            sig=self.signals.get(path, None)
+            if sig is None:
+                raise RWSMockError(404, RWS_MOCK_ERR_NOT_FOUND, "Signal not found: " + path)
+            try:
+                if sig['type'] in ('AI', 'AO'):
+                    v=repr(float(lvalue))
+                else:
+                    v=str(int(lvalue))
+                    if sig['type'] in ('DI', 'DO') and v not in ('0', '1'):
+                        raise ValueError()
+            except ValueError:
+                raise RWSMockError(400, RWS_MOCK_ERR_INVALID_VALUE, "Invalid signal value: " + str(lvalue))
+            sig['lvalue']=v
+        self._changed('rw/iosystem/signals/' + path, 'ios-signalstate-ev', path, \
+                      '/rw/iosystem/signals/' + path + ';state', [('lvalue', v), ('lstate', 'not simulated')])
+    
+    def set_execution_state(self, ctrlexecstate, cycle=None):
+        with self._lock:
+            if ctrlexecstate == 'running' and self.ctrlstate != 'motoron':
+                raise RWSMockError(400, RWS_MOCK_ERR_INVALID_VALUE, "Motors are off")
+            self.ctrlexecstate=ctrlexecstate
+            if cycle is not None and cycle != 'asis':
+                self.cycle=cycle
+            self._motion=None
+            if ctrlexecstate == 'running' and ('T_ROB1', 'CurrentJointTrajectoryCount') in self.symbols:
+                self._set_internal('CurrentJointTrajectoryCount', '0')
+        self._changed('rw/rapid/execution', 'rap-ctrlexecstate-ev', 'execution', '/rw/rapid/execution;ctrlexecstate', \
+                      [('ctrlexecstate', ctrlexecstate)])
+    
+    def set_controller_state(self, ctrlstate):
+        with self._lock:
+            self.ctrlstate=ctrlstate
+        self._changed('rw/panel/ctrlstate', 'pnl-ctrlstate-ev', 'ctrlstate', '/rw/panel/ctrlstate', \
+                      [('ctrlstate', ctrlstate)])
+        if ctrlstate != 'motoron' and self.ctrlexecstate == 'running':
+            self.set_execution_state('stopped')
+    
+    def set_operation_mode(self, opmode):
+        with self._lock:
+            self.opmode=opmode
+        self._changed('rw/panel/opmode', 'pnl-opmode-ev', 'opmode', '/rw/panel/opmode', [('opmode', opmode)])
+    
+    def add_event_log_message(self, code, title, msgtype=1, desc='', conseqs='', causes='', actions='', args=(), domain=0):
+        with self._lock:
+            self._elog_seqnum+=1
+            seqnum=self._elog_seqnum
+            self.elog.setdefault(domain, []).append({'seqnum': seqnum, 'msgtype': msgtype, 'code': code, \
+                'tstamp': datetime.now(), 'title': title, 'desc': desc, 'conseqs': conseqs, 'causes': causes, \
+                'actions': actions, 'args': list(args)})
+        self._changed('rw/elog/' + str(domain), 'elog-message-ev', 'message', '/rw/elog/%d/%d' % (domain, seqnum), \
+                      [('seqnum', str(seqnum))])
+        return seqnum
+    
+    def create_dipc_queue(self, name, size=4440, max_msg_size=444):
+        with self._lock:
+            if name in self.dipc_queues:
+                raise RWSMockError(400, RWS_MOCK_ERR_DIPC_QUEUE_EXISTS, "DIPC queue already exists: " + name)
+            self.dipc_queues[name]=(deque(), int(max_msg_size))
+    
+    def dipc_send(self, queue_name, data, userdef=1, msgtype=1, cmd=111, src_queue=''):
+        with self._lock:
+            q=self.dipc_queues.get(queue_name, None)
+            if q is None:
+                raise RWSMockError(404, RWS_MOCK_ERR_NOT_FOUND, "DIPC queue not found: " + queue_name)
+            if len(data) > q[1]:
+                raise RWSMockError(400, RWS_MOCK_ERR_INVALID_VALUE, "DIPC message too large")
+            q[0].append((str(msgtype), str(cmd), str(userdef), data, src_queue))
+            self._dipc_cond.notify_all()
+        self._changed('rw/dipc/' + queue_name, 'dipc-message-ev', queue_name, '/rw/dipc/' + queue_name, \
+                      [('dipc-msgtype', str(msgtype)), ('dipc-cmd', str(cmd)), ('dipc-userdef', str(userdef)), \
+                       ('dipc-data', data)])
+    
+    def dipc_read(self, queue_name, timeout=0):
+        t_end=time.time() + timeout
+        with self._lock:
+            if queue_name not in self.dipc_queues:
+                raise RWSMockError(404, RWS_MOCK_ERR_NOT_FOUND, "DIPC queue not found: " + queue_name)
+            q=self.dipc_queues[queue_name][0]
+            while len(q) == 0 and time.time() < t_end:
+                self._dipc_cond.wait(t_end - time.time())
+            return q.popleft() if len(q) > 0 else None
+    
+    def request_rmmp(self):
+        with self._lock:
+            self.rmmp_status='PENDING'
+            self._rmmp_t=time.time()
+    
+    def poll_rmmp(self):
+        with self._lock:
+            if self.rmmp_status == 'PENDING' and time.time() - self._rmmp_t >= self.rmmp_grant_delay:
+                self.rmmp_status='GRANTED'
+            return self.rmmp_status
+    
+    def _set_internal(self, name, value):
+        s=self.symbols[('T_ROB1', name)]
+        s.value=value
+        self._changed(s.resource, 'rap-value-ev', s.name, '/' + s.resource + ';value', [])
+    
+    def _symbol_changed(self, s):
+        
+        # IPers traps of rpi_abb_irc5_rapid.mod
+        
+        if s.task != 'T_ROB1' or s.module != 'rpi_abb_irc5_rapid':
+            return
+        if s.name == 'JointTrajectoryCount':
+            self._motion=None
+            self._set_internal('CurrentJointTrajectoryCount', '0')
+        elif s.name == 'JointTrajectoryTime' or s.name.startswith('JointTrajectory_'):
+            if float(self.symbols[('T_ROB1', 'JointTrajectoryCount')].value) > 0:
+                self._motion=None
+                self._set_internal('JointTrajectoryCount', '0')
+    
+    def _run(self):
+        while not self._stop_event.wait(self.step):
+            try:
+                with self._lock:
+                    self._step_motion()
+            except Exception:
+                self._motion=None
+    
+    def _step_motion(self):
+        if self.ctrlexecstate != 'running' or ('T_ROB1', 'JointTrajectoryCount') not in self.symbols:
+            return
+        count=int(float(self.symbols[('T_ROB1', 'JointTrajectoryCount')].value))
+        mechunit=sorted(self.mechunits.keys())[0]
+        if self._motion is None:
+            if count == -1000:
+                if self.symbols[('T_ROB1', 'CurrentJointTrajectoryCount')].value != '-1000':
+                    self._set_internal('CurrentJointTrajectoryCount', '-1000')
+                return
+            if count == -2000:
+                count=int(float(self.symbols[('T_ROB1', 'JointTrajectoryStreamTotal')].value))
+            elif count <= 0:
+                return
+            self._motion=[0, None, self.mechunits[mechunit].copy(), None, None, count]
+        
+        i, t0, start, target, T, count=self._motion
+        if t0 is None:
+            # Streaming mode waits for the producer
+            if int(float(self.symbols[('T_ROB1', 'JointTrajectoryCount')].value)) == -2000 \
+                and int(float(self.symbols[('T_ROB1', 'JointTrajectoryStreamWritten')].value)) <= i:
+                return
+            slot=i % 100
+            target=np.rad2deg(decode_jointtarget_array( \
+                self.symbols[('T_ROB1', 'JointTrajectory_%d' % (slot/10))].value)[slot % 10].robax)
+            T=max(float(decode_rapid_value(self.symbols[('T_ROB1', 'JointTrajectoryTime')].value, 'num', [100])[slot]), 1e-3)
+            t0=time.time()
+            self._motion=[i, t0, start, target, T, count]
+            self._set_internal('CurrentJointTrajectoryCount', str(i+1))
+        
+        s=min((time.time() - t0)/T, 1.0)
+        self.mechunits[mechunit]=start + s*(target - start)
+        if s < 1.0:
+            return
+        if i+1 >= count:
+            self._motion=None
+            self._set_internal('CurrentJointTrajectoryCount', '0')
+            self._set_internal('JointTrajectoryCount', '0')
+            return
+        self._motion=[i+1, None, target, None, None, count]
+
+class _RWSMockGroup(object):
+    def __init__(self, gid):
+        self.gid=gid
+        self.resources={}
+        self.sockets=set()
+
+class RWSMockWebSocket(WebSocket):
+    
+    def __init__(self, sock, server, group):
+        super(RWSMockWebSocket, self).__init__(sock, protocols=['robapi2_subscription'])
+        self._server=server
+        self._group=group
+        self._send_lock=threading.Lock()
+    
+    def send_event(self, text):
+        with self._send_lock:
+            self.send(text)
+    
+    def closed(self, code, reason=None):
+        self._server._socket_closed(self)
+
+class _RWSMockHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads=True
+    allow_reuse_address=True
+    
+    def __init__(self, address, handler, rws):
+        HTTPServer.__init__(self, address, handler)
+        self.rws=rws
+        self.upgraded=set()
+    
+    def shutdown_request(self, request):
+        # Sockets handed to the WebSocket manager stay open
+        if request in self.upgraded:
+            self.upgraded.discard(request)
+            return
+        HTTPServer.shutdown_request(self, request)
+
+class RWSMockServer(object):
+    
+    # HTTP/1.1 keep-alive server speaking the RWS resources used by RAPID.
+    # latency (plus uniform jitter) is added to every request. max_rate
+    # caps the accepted requests per second; requests above the cap get
+    # 503 like a busy controller. max_connection_requests closes a
+    # persistent connection after that many calls, as the controller does
+    # after 400.
+    
+    def __init__(self, controller=None, host='127.0.0.1', port=0, username='Default User', password='robotics', \
+                 latency=0.0, jitter=0.0, max_rate=None, max_connection_requests=None):
+        self.controller=controller if controller is not None else RWSMockController()
+        self.username=username
+        self.password=password
+        self.realm='validusers@robotcontroller.com'
+        self.latency=latency
+        self.jitter=jitter
+        self.max_rate=max_rate
+        self.max_connection_requests=max_connection_requests
+        self._lock=threading.Lock()
+        self._nonces=set()
+        self._sessions={}
+        self._groups={}
+        self._next_gid=1
+        self._tokens=None
+        self._tokens_t=None
+        self.requests=0
+        self.rejected=0
+        self.challenges=0
+        self.events=0
+        self._httpd=_RWSMockHTTPServer((host, port), _RWSMockRequestHandler, self)
+        self._manager=WebSocketManager()
+        self._thread=None
+        self.controller.add_listener(self._resource_changed)
+    
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+    
+    @property
+    def base_url(self):
+        return 'http://%s:%d' % self._httpd.server_address[:2]
+    
+    def get_stats(self):
+        with self._lock:
+            return RWSMockStats(self.requests, self.rejected, self.challenges, len(self._sessions), self.events)
+    
+    def start(self):
+        self._manager.start()
+        self.controller.start()
+        self._thread=threading.Thread(target=self._httpd.serve_forever, name="rws_mock_server")
+        self._thread.daemon=True
+        self._thread.start()
+    
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._manager.close_all()
+        self._manager.stop()
+        self._manager.join()
+        self.controller.stop()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread=None
+    
+    def drop_subscriptions(self):
+        
+        # Close every subscription WebSocket but keep the groups, as a lost
+        # network connection does. Returns the number of sockets closed.
+        
+        with self._lock:
+            sockets=[ws for g in self._groups.values() for ws in g.sockets]
+        for ws in sockets:
+            ws.close()
+        return len(sockets)
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, *args):
+        self.stop()
+    
+    def _admit(self):
+        with self._lock:
+            self.requests+=1
+            if self.max_rate is None:
+                return True
+            now=time.time()
+            if self._tokens is None:
+                self._tokens=float(self.max_rate)
+            else:
+                self._tokens=min(float(self.max_rate), self._tokens + (now - self._tokens_t)*self.max_rate)
+            self._tokens_t=now
+            if self._tokens < 1.0:
+                self.rejected+=1
+                return False
+            self._tokens-=1.0
+            return True
+    
+    def _delay(self):
+        d=self.latency
+        if self.jitter > 0:
+            d+=random.uniform(0, self.jitter)
+        if d > 0:
+            time.sleep(d)
+    
+    def _authenticate(self, method, uri, headers):
+        
+        # Returns (authenticated, Set-Cookie values)
+        
+        cookies=dict([c.strip().split('=', 1) for c in headers.get('Cookie', '').split(';') if '=' in c])
+        with self._lock:
+            if cookies.get('-http-session-', None) in self._sessions:
+                return True, []
+        
+        h=headers.get('Authorization', '')
+        if h.lower().startswith('digest '):
+            d=parse_dict_header(h[7:])
+            with self._lock:
+                nonce_ok=d.get('nonce', None) in self._nonces
+            if nonce_ok and d.get('username') == self.username and d.get('uri') == uri:
+                ha1=_md5('%s:%s:%s' % (self.username, self.realm, self.password))
+                ha2=_md5('%s:%s' % (method, uri))
+                if d.get('qop', None) is None:
+                    expected=_md5('%s:%s:%s' % (ha1, d['nonce'], ha2))
+                else:
+                    expected=_md5('%s:%s:%s:%s:%s:%s' % (ha1, d['nonce'], d.get('nc'), d.get('cnonce'), d['qop'], ha2))
+                if d.get('response') == expected:
+                    session=base64.b32encode(os.urandom(10))
+                    with self._lock:
+                        self._sessions[session]=time.time()
+                    return True, ['-http-session-=%s; path=/' % session, 'ABBCX=%d; path=/' % len(self._sessions)]
+        return False, []
+    
+    def _challenge(self):
+        nonce=base64.b64encode(os.urandom(24))
+        with self._lock:
+            self._nonces.add(nonce)
+            self.challenges+=1
+        return 'Digest realm="%s", qop="auth", nonce="%s", opaque="%s"' % (self.realm, nonce, _md5(self.realm))
+    
+    def _route(self, method, path, query, form):
+        
+        # Returns (status, links, items, headers), items are
+        # (class, title, href, [(span class, text)])
+        
+        c=self.controller
+        action=query.get('action', None)
+        
+        if path == 'rw/rapid/execution':
+            if method == 'GET':
+                return 200, [], [('rap-execution', 'execution', None, [('ctrlexecstate', c.ctrlexecstate), \
+                                                                       ('cycle', c.cycle)])], []
+            if action == 'start':
+                c.set_execution_state('running', form.get('cycle', None))
+            elif action == 'stop':
+                c.set_execution_state('stopped')
+            elif action == 'resetpp':
+                if c.ctrlexecstate == 'running':
+                    raise RWSMockError(400, RWS_MOCK_ERR_INVALID_VALUE, "RAPID is running")
+            else:
+                raise RWSMockError(400, RWS_MOCK_ERR_NOT_FOUND, "Unknown action")
+            return 204, [], [], []
+        
+        if path == 'rw/panel/ctrlstate':
+            if method == 'POST' and action == 'setctrlstate':
+                c.set_controller_state(form.get('ctrl-state', 'motoron'))
+                return 204, [], [], []
+            return 200, [], [('pnl-ctrlstate', 'ctrlstate', None, [('ctrlstate', c.ctrlstate)])], []
+        
+        if path == 'rw/panel/opmode':
+            return 200, [], [('pnl-opmode', 'opmode', None, [('opmode', c.opmode)])], []
+        
+        if path == 'rw/rapid/tasks':
+            state='started' if c.ctrlexecstate == 'running' else 'stopped'
+            return 200, [], [('rap-task-li', t, 'tasks/' + t, [('name', t), ('type', 'normal'), ('taskstate', 'linked'), \
+                                                               ('excstate', state), ('active', 'On'), \
+                                                               ('motiontask', 'TRUE' if i == 0 else 'FALSE')]) \
+                             for i, t in enumerate(c.tasks)], []
+        
+        m=re.match(r'^rw/rapid/symbol/(data|properties)/RAPID/([^/]+)/(.+)$', path)
+        if m is not None:
+            kind, task, var=m.groups()
+            s=c.find_symbol(task, var)
+            if kind == 'properties':
+                return 200, [], [_symbol_item(s)], []
+            if method == 'POST':
+                if action != 'set' or 'value' not in form:
+                    raise RWSMockError(400, RWS_MOCK_ERR_INVALID_VALUE, "Missing value")
+                c.set_symbol_value(task, var, form['value'])
+                return 204, [], [], []
+            return 200, [], [('rap-data', s.name, None, [('value', s.value)])], []
+        
+        if path == 'rw/rapid/symbols' and action == 'search-symbols':
+            blockurl=form.get('blockurl', 'RAPID').split('/')
+            with c._lock:
+                symbols=sorted(c.symbols.values(), key=lambda s: s.name)
+            symbols=[s for s in symbols if (len(blockurl) < 2 or s.task == blockurl[1]) \
+                     and (len(blockurl) < 3 or s.module == blockurl[2])]
+            return 200, [], [_symbol_item(s) for s in symbols], []
+        
+        if path == 'rw/iosystem/signals':
+            network=query.get('network', None)
+            unit=query.get('device', None)
+            with c._lock:
+                signals=sorted(c.signals.items())
+            signals=[(p, s) for p, s in signals if (network is None or p.split('/')[0] == network) \
+                     and (unit is None or p.split('/')[1] == unit)]
+            start=int(query.get('start', 0))
+            limit=int(query.get('limit', 100))
+            links=[]
+            if start + limit < len(signals):
+                q=dict(query)
+                q['start']=str(start + limit)
+                q['limit']=str(limit)
+                links.append(('signals?' + '&'.join(['%s=%s' % kv for kv in sorted(q.items())]), 'next'))
+            return 200, links, [_signal_item(p, s, 'ios-signal-li') for p, s in signals[start:start+limit]], []
+        
+        m=re.match(r'^rw/iosystem/signals/([^/]+/[^/]+/[^/]+)$', path)
+        if m is not None:
+            sig=m.group(1)
+            if method == 'POST':
+                if action != 'set' or 'lvalue' not in form:
+                    raise RWSMockError(400, RWS_MOCK_ERR_INVALID_VALUE, "Missing lvalue")
+                c.set_signal(sig, form['lvalue'])
+                return 204, [], [], []
+            with c._lock:
+                s=c.signals.get(sig, None)
+            if s is None:
+                raise RWSMockError(404, RWS_MOCK_ERR_NOT_FOUND, "Signal not found: " + sig)
+            return 200, [], [_signal_item(sig, s, 'ios-signal')], []
+        
+        if path == 'rw/motionsystem/mechunits':
+            return 200, [], [('ms-mechunit-li', m, m, [('mode', 'Activated')]) for m in sorted(c.mechunits.keys())], []
+        
+        m=re.match(r'^rw/motionsystem/mechunits/([^/]+)/(jointtarget|robtarget)$', path)
+        if m is not None:
+            with c._lock:
+                joints=c.mechunits.get(m.group(1), None)
+            if joints is None:
+                raise RWSMockError(404, RWS_MOCK_ERR_NOT_FOUND, "Mechunit not found: " + m.group(1))
+            extax=[('eax_' + chr(i), _EXTAX_UNUSED) for i in xrange(ord('a'), ord('g'))]
+            if m.group(2) == 'jointtarget':
+                return 200, [], [('ms-jointtarget', m.group(1), None, \
+                                  [('rax_%d' % (i+1), '%.2f' % joints[i]) for i in xrange(6)] + extax)], []
+            values=zip(['x', 'y', 'z', 'q1', 'q2', 'q3', 'q4', 'cf1', 'cf4', 'cf6', 'cfx'], \
+                       ['515.00', '0.00', '712.00', '0.5', '0', '0.866025', '0', '0', '0', '0', '0'])
+            return 200, [], [('ms-robtargets', m.group(1), None, values + extax)], []
+        
+        if path == 'rw/elog':
+            return 200, [], [('elog-domain-li', str(d), 'elog/%d?lang=en' % d, [('numevts', str(len(e)))]) \
+                             for d, e in sorted(c.elog.items())], []
+        
+        m=re.match(r'^rw/elog/(\d+)(?:/(\d+))?$', path)
+        if m is not None:
+            domain=int(m.group(1))
+            with c._lock:
+                entries=list(reversed(c.elog.get(domain, [])))
+            if m.group(2) is not None:
+                entries=[e for e in entries if e['seqnum'] == int(m.group(2))]
+                if len(entries) == 0:
+                    raise RWSMockError(404, RWS_MOCK_ERR_NOT_FOUND, "Event log message not found")
+                return 200, [], [_elog_item(domain, entries[0])], []
+            start=int(query.get('start', 0))
+            limit=int(query.get('limit', 50))
+            links=[]
+            if start + limit < len(entries):
+                links.append(('%d?lang=en&start=%d&limit=%d' % (domain, start + limit, limit), 'next'))
+            return 200, links, [_elog_item(domain, e) for e in entries[start:start+limit]], []
+        
+        if path == 'rw/dipc' and action == 'dipc-create':
+            c.create_dipc_queue(form['dipc-queue-name'], form.get('dipc-queue-size', 4440), \
+                                form.get('dipc-max-msg-size', 444))
+            return 201, [], [], []
+        
+        m=re.match(r'^rw/dipc/([^/]+)$', path)
+        if m is not None:
+            if action == 'dipc-send':
+                c.dipc_send(m.group(1), form.get('dipc-data', ''), form.get('dipc-userdef', 1), form.get('dipc-msgtype', 1), \
+                            form.get('dipc-cmd', 111), form.get('dipc-src-queue-name', ''))
+                return 204, [], [], []
+            msg=c.dipc_read(m.group(1), float(query.get('timeout', 0)))
+            if msg is None:
+                return 200, [], [], []
+            return 200, [], [('dipc-message-li', m.group(1), None, zip(['dipc-msgtype', 'dipc-cmd', 'dipc-userdef', \
+                                                                       'dipc-data', 'dipc-src-queue-name'], msg))], []
+        
+        if path == 'users/rmmp' and method == 'POST':
+            c.request_rmmp()
+            return 202, [], [], []
+        
+        if path == 'users/rmmp/poll':
+            return 200, [], [('rmmp-poll', 'poll', None, [('status', c.poll_rmmp())])], []
+        
+        if path == 'subscription' and method == 'POST':
+            gid=self._create_group(form)
+            return 201, [('ws://%s:%d/poll/%d' % (self._httpd.server_address[:2] + (gid,)), 'self')], [], \
+                [('Location', self.base_url + '/subscription/%d' % gid)]
+        
+        m=re.match(r'^subscription/(\d+)(?:/(.+))?$', path)
+        if m is not None:
+            self._modify_group(method, int(m.group(1)), m.group(2), form)
+            return 200 if method == 'PUT' else 204, [], [], []
+        
+        raise RWSMockError(404, RWS_MOCK_ERR_NOT_FOUND, "Resource not found: " + path)
+    
+    def _subscription_resources(self, form):
+        o={}
+        resources=form.get('resources', [])
+        if isinstance(resources, basestring):
+            resources=[resources]
+        for r in resources:
+            url=form[r].strip('/')
+            o[url.split(';')[0]]=self._canonical_resource(url.split(';')[0])
+        return o
+    
+    def _canonical_resource(self, path):
+        m=re.match(r'^rw/rapid/symbol/data/RAPID/([^/]+)/(.+)$', path)
+        if m is not None:
+            return self.controller.find_symbol(m.group(1), m.group(2)).resource
+        return path
+    
+    def _create_group(self, form):
+        resources=self._subscription_resources(form)
+        with self._lock:
+            gid=self._next_gid
+            self._next_gid+=1
+            g=_RWSMockGroup(gid)
+            g.resources.update(resources)
+            self._groups[gid]=g
+        return gid
+    
+    def _modify_group(self, method, gid, resource, form):
+        with self._lock:
+            g=self._groups.get(gid, None)
+        if g is None:
+            raise RWSMockError(404, RWS_MOCK_ERR_NOT_FOUND, "Subscription group not found")
+        if method == 'PUT':
+            resources=self._subscription_resources(form)
+            with self._lock:
+                g.resources.update(resources)
+        elif method == 'DELETE' and resource is not None:
+            with self._lock:
+                g.resources.pop(resource.split(';')[0].strip('/'), None)
+        elif method == 'DELETE':
+            with self._lock:
+                self._groups.pop(gid, None)
+                sockets=list(g.sockets)
+            for ws in sockets:
+                ws.close()
+        else:
+            raise RWSMockError(400, RWS_MOCK_ERR_NOT_FOUND, "Unsupported subscription request")
+    
+    def _connect_group(self, gid, sock):
+        with self._lock:
+            g=self._groups.get(gid, None)
+        if g is None:
+            return None
+        ws=RWSMockWebSocket(sock, self, g)
+        with self._lock:
+            g.sockets.add(ws)
+        self._manager.add(ws)
+        return ws
+    
+    def _socket_closed(self, ws):
+        with self._lock:
+            ws._group.sockets.discard(ws)
+    
+    def _resource_changed(self, resource, item):
+        
+        # Forward a controller change to every group subscribed to the
+        # resource, using the url the group subscribed with
+        
+        cls, title, href, spans=item
+        sends=[]
+        with self._lock:
+            for g in self._groups.values():
+                for url, canonical in g.resources.items():
+                    if canonical != resource or len(g.sockets) == 0:
+                        continue
+                    if cls == 'rap-value-ev':
+                        href='/' + url + ';value'
+                    text=_render_xhtml(self.base_url + '/', [(self.base_url + '/subscription/%d' % g.gid, 'group')], \
+                                       [(cls, title, href, spans)])
+                    sends.extend([(ws, text) for ws in g.sockets])
+            self.events+=len(sends)
+        for ws, text in sends:
+            try:
+                ws.send_event(text)
+            except Exception:
+                pass
+
+class _RWSMockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version='HTTP/1.1'
+    server_version='RWSMock/1.0'
+    # Buffer each response into one write, flushed by handle_one_request
+    wbufsize=-1
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._calls=0
+    
+    def do_GET(self):
+        self._handle('GET')
+    
+    def do_POST(self):
+        self._handle('POST')
+    
+    def do_PUT(self):
+        self._handle('PUT')
+    
+    def do_DELETE(self):
+        self._handle('DELETE')
+    
+    def _handle(self, method):
+        rws=self.server.rws
+        self._calls+=1
+        length=int(self.headers.get('Content-Length', 0) or 0)
+        body=self.rfile.read(length) if length > 0 else ''
+        path, _, query=self.path.partition('?')
+        path=path.strip('/')
+        query=dict([(k, v[-1]) for k, v in parse_qs(query).items()])
+        form=dict([(k, v if k == 'resources' else v[-1]) for k, v in parse_qs(body).items()])
+        as_json=query.get('json', None) == '1'
+        
+        authenticated, cookies=rws._authenticate(method, self.path, self.headers)
+        if not authenticated:
+            self._send_error(RWSMockError(401, RWS_MOCK_ERR_BUSY, "Unauthorized"), as_json, \
+                             [('WWW-Authenticate', rws._challenge())])
+            return
+        headers=[('Set-Cookie', c) for c in cookies]
+        
+        if not rws._admit():
+            self._send_error(RWSMockError(503, RWS_MOCK_ERR_BUSY, "Too many requests"), as_json, headers)
+            return
+        rws._delay()
+        
+        if method == 'GET' and path.startswith('poll/') and self.headers.get('Upgrade', '').lower() == 'websocket':
+            self._upgrade(int(path.split('/')[1]), headers)
+            return
+        
+        try:
+            status, links, items, extra_headers=rws._route(method, path, query, form)
+        except RWSMockError as e:
+            self._send_error(e, as_json, headers)
+            return
+        except Exception as e:
+            self._send_error(RWSMockError(500, RWS_MOCK_ERR_BUSY, str(e)), as_json, headers)
+            return
+        
+        base=rws.base_url + '/' + (path.rsplit('/',1)[0] + '/' if '/' in path else '')
+        if status == 204:
+            content=''
+        elif as_json:
+            content=_render_json(base, links, items)
+        else:
+            content=_render_xhtml(base, links, items)
+        self._send(status, content, as_json, headers + extra_headers)
+    
+    def _upgrade(self, gid, headers):
+        key=self.headers.get('Sec-WebSocket-Key', None)
+        if key is None or self.server.rws._groups.get(gid, None) is None:
+            self._send_error(RWSMockError(404, RWS_MOCK_ERR_NOT_FOUND, "Subscription group not found"), False, headers)
+            return
+        self.send_response(101, 'Switching Protocols')
+        for h in headers + [('Upgrade', 'websocket'), ('Connection', 'Upgrade'), \
+                            ('Sec-WebSocket-Accept', base64.b64encode(hashlib.sha1(key + WS_KEY).digest())), \
+                            ('Sec-WebSocket-Protocol', 'robapi2_subscription')]:
+            self.send_header(*h)
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection=1
+        self.server.upgraded.add(self.request)
+        self.server.rws._connect_group(gid, self.request)
+    
+    def _send_error(self, e, as_json, headers):
+        if as_json:
+            content=json.dumps({'status': {'code': e.code, 'msg': str(e)}})
+        else:
+            content='<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml"><head>' \
+                '<title>Error</title></head><body><div class="status"><span class="code">%d</span>' \
+                '<span class="msg">%s</span></div></body></html>' % (e.code, escape(str(e)))
+        self._send(e.status, content, as_json, headers)
+    
+    def _send(self, status, content, as_json, headers):
+        self.send_response(status)
+        if status != 204:
+            self.send_header('Content-Type', 'application/hal+json;v=2.0' if as_json else 'application/xhtml+xml;v=2.0')
+        self.send_header('Content-Length', str(len(content)))
+        for h in headers:
+            self.send_header(*h)
+        rws=self.server.rws
+        if rws.max_connection_requests is not None and self._calls >= rws.max_connection_requests:
+            self.send_header('Connection', 'close')
+            self.close_connection=1
+        self.end_headers()
+        self.wfile.write(content)
+
+def _symbol_item(s):
+    spans=[('name', s.name), ('symburl', s.symburl), ('symtyp', s.symtyp), ('dattyp', s.datatype), \
+           ('ndim', str(len(s.dims) if s.dims is not None else 0))]
+    if s.dims is not None:
+        spans.append(('dim', ' '.join([str(d) for d in s.dims])))
+    spans.extend([('local', 'false'), ('rdonly', 'true' if s.symtyp == 'con' else 'false'), ('taskvar', 'false')])
+    return ('rap-symprop' + s.symtyp + '-li' if s.symtyp != 'per' else 'rap-sympropper-li', s.name, None, spans)
+
+def _signal_item(path, s, cls):
+    spans=[('name', path.rsplit('/',1)[-1]), ('type', s['type']), ('category', s['category'])]
+    if s['lvalue'] is not None:
+        spans.append(('lvalue', s['lvalue']))
+    spans.append(('lstate', 'not simulated'))
+    return (cls, path, path, spans)
+
+def _elog_item(domain, e):
+    spans=[('msgtype', str(e['msgtype'])), ('code', str(e['code'])), \
+           ('tstamp', e['tstamp'].strftime('%Y-%m-%d T  %H:%M:%S')), ('title', e['title']), ('desc', e['desc']), \
+           ('conseqs', e['conseqs']), ('causes', e['causes']), ('actions', e['actions']), ('argc', str(len(e['args'])))]
+    spans.extend([('arg%d' % (i+1), str(a)) for i, a in enumerate(e['args'])])
+    return ('elog-message-li', '/rw/elog/%d/%d' % (domain, e['seqnum']), '%d/%d?lang=en' % (domain, e['seqnum']), spans)
+
+def _render_xhtml(base, links, items):
+    o=['<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml"><head><title>RWS</title>' \
+       '<base href=%s/></head><body><div class="state">' % quoteattr(base)]
+    for href, rel in links:
+        o.append('<a href=%s rel="%s"></a>' % (quoteattr(href), rel))
+    o.append('<ul>')
+    for cls, title, href, spans in items:
+        o.append('<li class="%s" title=%s>' % (cls, quoteattr(title)))
+        if href is not None:
+            o.append('<a href=%s rel="self"></a>' % quoteattr(href))
+        for c, v in spans:
+            o.append('<span class="%s">%s</span>' % (c, escape(v)))
+        o.append('</li>')
+    o.append('</ul></div></body></html>')
+    return ''.join(o)
+
+def _render_json(base, links, items):
+    state=[]
+    for cls, title, href, spans in items:
+        d={'_type': cls, '_title': title}
+        if href is not None:
+            d['_links']={'self': {'href': href}}
+        d.update(spans)
+        state.append(d)
+    l={'base': {'href': base}}
+    for href, rel in links:
+        l[rel]={'href': href}
+    return json.dumps({'_links': l, '_embedded': {'_state': state}})
+
+def _md5(s):
+    return hashlib.md5(s).hexdigest()
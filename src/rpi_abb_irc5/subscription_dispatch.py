@@ -0,0 +1,179 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import threading
+import time
+import traceback
+import weakref
+import Queue
+from collections import namedtuple, deque
+
+RAPIDDispatchStats=namedtuple('RAPIDDispatchStats', ['name', 'coalesce', 'depth', 'max_depth', 'delivered', \
+                                                     'coalesced', 'dropped'])
+
+class RAPIDDispatchChannel(object):
+    
+    # Per-subscription queue between the socket thread and the user
+    # callback. Coalescing channels hold only the latest value; other
+    # channels hold up to maxsize values and block the producer when full,
+    # dropping the new value if block_timeout expires. A block_timeout of
+    # None drops immediately, so a stuck callback can never stall the
+    # socket thread. Every drop is counted and reported to
+    # overflow_callback with the channel name, so the consumer knows to
+    # resync the resource.
+    
+    def __init__(self, dispatcher, name, callback, coalesce, maxsize, block_timeout, overflow_callback=None):
+        self._dispatcher=dispatcher
+        self.name=name
+        self._callback=callback
+        self.coalesce=coalesce
+        self.maxsize=1 if coalesce else maxsize
+        self._block_timeout=block_timeout
+        self._overflow_callback=overflow_callback
+        self._queue=deque()
+        self._cv=threading.Condition(threading.Lock())
+        self._scheduled=False
+        self.max_depth=0
+        self.delivered=0
+        self.coalesced=0
+        self.dropped=0
+    
+    def __call__(self, data):
+        overflow=False
+        with self._cv:
+            if self.coalesce:
+                if len(self._queue) > 0:
+                    self._queue[0]=data
+                    self.coalesced+=1
+                    return
+            elif not self._wait_for_space():
+                self.dropped+=1
+                overflow=True
+            if not overflow:
+                self._queue.append(data)
+                self.max_depth=max(self.max_depth, len(self._queue))
+                if self._scheduled:
+                    return
+                self._scheduled=True
+        if overflow:
+            self._overflow()
+            return
+        self._dispatcher._schedule(self)
+    
+    def _wait_for_space(self):
+        deadline=time.time() + (self._block_timeout or 0)
+        while len(self._queue) >= self.maxsize:
+            remaining=deadline - time.time()
+            if remaining <= 0:
+                return False
+            self._cv.wait(remaining)
+        return True
+    
+    def _overflow(self):
+        if self._overflow_callback is None:
+            return
+        try:
+            self._overflow_callback(self.name)
+        except:
+            traceback.print_exc()
+    
+    def _run(self):
+        with self._cv:
+            data=self._queue.popleft()
+            self._cv.notify()
+        try:
+            self._callback(data)
+        except:
+            traceback.print_exc()
+        with self._cv:
+            self.delivered+=1
+            if len(self._queue) == 0:
+                self._scheduled=False
+                return
+        self._dispatcher._schedule(self)
+    
+    @property
+    def depth(self):
+        return len(self._queue)
+    
+    def stats(self):
+        with self._cv:
+            return RAPIDDispatchStats(self.name, self.coalesce, len(self._queue), self.max_depth, self.delivered, \
+                                      self.coalesced, self.dropped)
+
+class RAPIDCallbackDispatcher(object):
+    
+    # Runs subscription callbacks on a pool of worker threads. A channel is
+    # handed to at most one worker at a time, so callbacks of a single
+    # subscription stay in order while slow callbacks only delay their own
+    # subscription.
+    
+    def __init__(self, workers=1, maxsize=100, block_timeout=1.0, overflow_callback=None):
+        self.maxsize=maxsize
+        self.block_timeout=block_timeout
+        self.overflow_callback=overflow_callback
+        self._ready=Queue.Queue()
+        self._channels=weakref.WeakSet()
+        self._lock=threading.Lock()
+        self._workers=[]
+        for i in xrange(workers):
+            t=threading.Thread(target=self._worker, name="rapid_dispatch_%d" % i)
+            t.daemon=True
+            t.start()
+            self._workers.append(t)
+    
+    def channel(self, name, callback, coalesce=False, maxsize=None):
+        if maxsize is None:
+            maxsize=self.maxsize
+        c=RAPIDDispatchChannel(self, name, callback, coalesce, maxsize, self.block_timeout, self.overflow_callback)
+        with self._lock:
+            self._channels.add(c)
+        return c
+    
+    def stats(self):
+        with self._lock:
+            channels=list(self._channels)
+        return [c.stats() for c in channels]
+    
+    def close(self):
+        for t in self._workers:
+            self._ready.put(None)
+        for t in self._workers:
+            t.join()
+        self._workers=[]
+    
+    def _schedule(self, channel):
+        self._ready.put(channel)
+    
+    def _worker(self):
+        while True:
+            c=self._ready.get()
+            if c is None:
+                return
+            c._run()
@@ -0,0 +1,275 @@
+# Copyright (c) 2017, Rensselaer Polytechnic Institute, Wason Technology LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Rensselaer Polytechnic Institute, or Wason 
+#       Technology LLC, nor the names of its contributors may be used to 
+#       endorse or promote products derived from this software without 
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from __future__ import absolute_import
+
+import os
+import threading
+import traceback
+import numpy as np
+from collections import namedtuple, deque
+from .joint_trajectory import sample_joint_trajectory
+
+# Commanded versus measured analysis of executed joint trajectories. A run
+# is one commanded trajectory, (t, q) or RetimedJointTrajectory, started at
+# absolute time start, and the joint positions measured while it executed
+# (EGM feedback or RAPIDJointStateSampler). Times are in seconds, errors
+# are the largest joint error in radians.
+
+TrajectoryRunSummary=namedtuple('TrajectoryRunSummary', ['start', 'points', 'samples', 'commanded_duration', \
+                                                         'measured_duration', 'lag_mean', 'lag_max', 'error_rms', \
+                                                         'error_max', 'fine_time', 'settle_time', 'idle_before'])
+TrajectoryRunAnalysis=namedtuple('TrajectoryRunAnalysis', ['summary', 'segment_lag', 'segment_error_rms', \
+                                                           'segment_error_max', 'segment_samples'])
+TrajectoryShiftSummary=namedtuple('TrajectoryShiftSummary', ['runs', 'start', 'end', 'busy_time', 'idle_time', \
+                                                             'utilization', 'cycle_mean', 'cycle_p95', 'lag_mean', \
+                                                             'error_rms', 'error_max', 'fine_time'])
+
+def analyze_trajectory_run(start, traj, sample_times, sample_positions, fine=None, max_lag=0.5, lag_step=0.004, \
+                           settle_tolerance=np.deg2rad(0.1), fine_radius=np.deg2rad(1.0), idle_before=None):
+    
+    # Samples are assigned to the commanded segment active at their time.
+    # The lag of a segment is the time shift of the commanded trajectory,
+    # from 0 to max_lag in lag_step, that best fits its samples, found for
+    # all segments at once, evaluating one candidate shift at a time so
+    # memory stays proportional to the number of samples.
+    # Samples after the commanded end only count towards settling: the
+    # run ends when the robot stays within settle_tolerance of the last
+    # point. fine marks the waypoints executed with fine zones (default the
+    # last one); fine_time is the time spent within fine_radius of them.
+    
+    t=np.asarray(traj[0], dtype=np.float64)
+    q=np.asarray(traj[1], dtype=np.float64)
+    ts=np.asarray(sample_times, dtype=np.float64)
+    qs=np.asarray(sample_positions, dtype=np.float64)
+    if len(ts) != len(qs) or len(t) == 0:
+        raise ValueError("Invalid trajectory or samples")
+    duration=float(t[-1])
+    nseg=max(len(t) - 1, 1)
+    
+    tc=ts - start
+    valid=tc >= 0
+    tc=tc[valid]
+    qs=qs[valid]
+    ts=ts[valid]
+    k=len(tc)
+    
+    active=tc <= duration
+    seg=np.clip(np.searchsorted(t, tc[active], side='right') - 1, 0, nseg - 1)
+    counts=np.bincount(seg, minlength=nseg).astype(np.float64)
+    
+    err=np.max(np.abs(qs - sample_joint_trajectory(traj, tc)), axis=1) if k > 0 else np.zeros((0,))
+    err_active=err[active]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        segment_error_rms=np.sqrt(np.bincount(seg, weights=err_active**2, minlength=nseg) / counts)
+    segment_error_max=np.full((nseg,), np.nan)
+    if len(seg) > 0:
+        m=np.zeros((nseg,))
+        np.maximum.at(m, seg, err_active)
+        segment_error_max=np.where(counts > 0, m, np.nan)
+    
+    segment_lag=np.full((nseg,), np.nan)
+    if len(seg) > 0:
+        lags=np.arange(0.0, max_lag + 0.5*lag_step, lag_step)
+        tc_active=tc[active]
+        qs_active=qs[active]
+        cost=np.zeros((len(lags), nseg))
+        for j in xrange(len(lags)):
+            e=np.sum((qs_active - sample_joint_trajectory(traj, tc_active - lags[j]))**2, axis=1)
+            cost[j]=np.bincount(seg, weights=e, minlength=nseg)
+        segment_lag=np.where(counts > 0, lags[np.argmin(cost, axis=0)], np.nan)
+    
+    settle_time=np.nan
+    measured_duration=np.nan
+    if k > 0:
+        outside=np.flatnonzero(np.max(np.abs(qs - q[-1]), axis=1) > settle_tolerance)
+        i=outside[-1] + 1 if len(outside) > 0 else 0
+        if i < k:
+            settled=max(ts[i], start + duration)
+            measured_duration=settled - start
+            settle_time=measured_duration - duration
+    
+    if fine is None:
+        fine=np.zeros((len(t),), dtype=bool)
+        fine[-1]=True
+    fine_points=q[np.asarray(fine, dtype=bool)]
+    fine_time=0.0
+    if k > 1 and len(fine_points) > 0:
+        near=np.min(np.max(np.abs(qs[:,None,:] - fine_points[None,:,:]), axis=2), axis=1) <= fine_radius
+        dt=np.diff(ts)
+        fine_time=float(np.sum(dt[near[:-1] & near[1:]]))
+    
+    with np.errstate(invalid='ignore'):
+        summary=TrajectoryRunSummary(float(start), len(t), k, duration, float(measured_duration), \
+                                     float(np.nanmean(segment_lag)) if np.any(counts > 0) else np.nan, \
+                                     float(np.nanmax(segment_lag)) if np.any(counts > 0) else np.nan, \
+                                     float(np.sqrt(np.mean(err_active**2))) if len(err_active) > 0 else np.nan, \
+                                     float(np.max(err_active)) if len(err_active) > 0 else np.nan, \
+                                     fine_time, float(settle_time), idle_before)
+    return TrajectoryRunAnalysis(summary, segment_lag, segment_error_rms, segment_error_max, counts.astype(int))
+
+def summarize_trajectory_runs(summaries):
+    
+    # Aggregate of consecutive runs, for comparing shifts or cells. Busy
+    # time is the measured duration of each run, or the commanded one if
+    # the run did not settle.
+    
+    if len(summaries) == 0:
+        return None
+    start=np.array([s.start for s in summaries])
+    cycle=np.array([s.measured_duration if np.isfinite(s.measured_duration) else s.commanded_duration \
+                    for s in summaries])
+    end=float(np.max(start + cycle))
+    busy=float(np.sum(cycle))
+    total=end - float(start[0])
+    idle=float(np.sum([s.idle_before for s in summaries if s.idle_before is not None]))
+    samples=np.array([s.samples for s in summaries], dtype=np.float64)
+    rms=np.array([s.error_rms for s in summaries])
+    ok=np.isfinite(rms) & (samples > 0)
+    with np.errstate(invalid='ignore'):
+        return TrajectoryShiftSummary(len(summaries), float(start[0]), end, busy, idle, \
+                                      busy / total if total > 0 else 1.0, float(np.mean(cycle)), \
+                                      float(np.percentile(cycle, 95)), \
+                                      float(np.nanmean([s.lag_mean for s in summaries])), \
+                                      float(np.sqrt(np.sum(rms[ok]**2 * samples[ok]) / np.sum(samples[ok]))) \
+                                          if np.any(ok) else np.nan, \
+                                      float(np.nanmax([s.error_max for s in summaries])), \
+                                      float(np.sum([s.fine_time for s in summaries])))
+
+def format_trajectory_summaries(summaries):
+    lines=["%-17s %6s %7s %9s %9s %8s %8s %9s %9s %8s %8s %8s" % ('start', 'points', 'samples', 'cmd s', \
+            'meas s', 'lag ms', 'lagmx ms', 'rms mrad', 'max mrad', 'fine s', 'settle s', 'idle s')]
+    for s in summaries:
+        lines.append("%-17.3f %6d %7d %9.3f %9.3f %8.1f %8.1f %9.3f %9.3f %8.3f %8.3f %8.3f" % (s.start, s.points, \
+            s.samples, s.commanded_duration, s.measured_duration, 1e3*s.lag_mean, 1e3*s.lag_max, 1e3*s.error_rms, \
+            1e3*s.error_max, s.fine_time, s.settle_time, s.idle_before if s.idle_before is not None else np.nan))
+    return '\n'.join(lines)
+
+class TrajectoryRunRecorder(object):
+    
+    # Collects the measured samples of each run from the driver threads and
+    # analyzes the run when it ends. begin() while a run is recording ends
+    # that run first (preemption). idle_before is the time from the last
+    # sample of the previous run, so gaps between goals show up in the
+    # summaries.
+    # Keyword arguments are passed to analyze_trajectory_run.
+    
+    def __init__(self, history=1000, max_samples=100000, **analysis_args):
+        self._lock=threading.Lock()
+        self._analysis_args=analysis_args
+        self._max_samples=max_samples
+        self._run=None
+        self._times=[]
+        self._positions=[]
+        self._last_end=None
+        self.history=deque(maxlen=history)
+    
+    @property
+    def recording(self):
+        return self._run is not None
+    
+    def begin(self, start, traj, fine=None):
+        analysis=None
+        if self._run is not None:
+            analysis=self.end(start)
+        with self._lock:
+            idle=start - self._last_end if self._last_end is not None else None
+            self._run=(start, traj, fine, idle)
+            self._times=[]
+            self._positions=[]
+        return analysis
+    
+    def add_sample(self, time, positions):
+        with self._lock:
+            if self._run is None or len(self._times) >= self._max_samples:
+                return
+            self._times.append(time)
+            self._positions.append(positions)
+    
+    def end(self, time=None, callback=None):
+        
+        # Samples after time are dropped. With a callback the run is
+        # detached here and analyzed on a separate thread, for callers
+        # that cannot block for the analysis.
+        
+        with self._lock:
+            run=self._run
+            self._run=None
+            times=self._times
+            positions=self._positions
+            self._times=[]
+            self._positions=[]
+            if run is None:
+                return None
+            if time is not None:
+                keep=np.searchsorted(np.asarray(times), time, side='right')
+                times=times[:keep]
+                positions=positions[:keep]
+            if len(times) > 0:
+                self._last_end=times[-1]
+            elif time is not None:
+                self._last_end=time
+        
+        if callback is None:
+            return self._analyze(run, times, positions)
+        def analyze():
+            try:
+                callback(self._analyze(run, times, positions))
+            except:
+                traceback.print_exc()
+        t=threading.Thread(target=analyze, name="trajectory_run_analysis")
+        t.daemon=True
+        t.start()
+    
+    def _analyze(self, run, times, positions):
+        start, traj, fine, idle=run
+        if len(times) == 0:
+            times=np.zeros((0,))
+            positions=np.zeros((0, np.asarray(traj[1]).shape[1]))
+        analysis=analyze_trajectory_run(start, traj, times, positions, fine, idle_before=idle, **self._analysis_args)
+        with self._lock:
+            self.history.append(analysis.summary)
+        return analysis
+    
+    def summaries(self):
+        with self._lock:
+            return list(self.history)
+    
+    def shift_summary(self):
+        return summarize_trajectory_runs(self.summaries())
+
+def append_trajectory_summary_csv(path, summary):
+    
+    # One line per run, with a header when the file is new
+    
+    new=not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a') as f:
+        if new:
+            f.write(','.join(TrajectoryRunSummary._fields) + '\n')
+        f.write(','.join(['' if v is None else repr(v) for v in summary]) + '\n')